@@ -1,30 +1,91 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import uvicorn
-import random
+import numpy as np
 from datetime import datetime
 from pydantic import BaseModel
 import asyncio
-from typing import Dict, Any, Optional
-from time import time
+import bisect
+import gzip
+import json
+import heapq
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import math
+from multiprocessing import shared_memory
+import os
+import socket
+import struct
+import sys
+import threading
+import zlib
+from typing import Callable, Dict, Any, Optional, List, Set, Tuple, Union
+from time import perf_counter, sleep, time
+
+try:
+    import orjson  # fast JSON encoder; falls back to the stdlib when not installed
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # "br" response compression; gzip only when not installed
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack  # binary websocket frames (subprotocol "msgpack"); JSON only when not installed
+except ImportError:
+    msgpack = None
+
+try:
+    import fcntl  # writer election for multi-worker shared state (POSIX only)
+except ImportError:
+    fcntl = None
 
 # ============================================================
 #  Industrial Facility Monitoring API - Optimized Version
 #  - KPI-specific update cadences (e.g., temp every 30s, humidity every 10m)
-#  - Lazy stateful updates (only refresh when due, otherwise reuse last value)
+#  - Background due-time scheduler regenerates KPI groups; requests only read state
+#  - Columnar KPI state: values/timestamps in arrays indexed by conveyor slot
+#  - Vectorized batch engine: all KPIs for all conveyors from one array draw
 #  - Runtime-configurable KPI rules via /kpi-rules endpoint
+#  - Configurable conveyor fleet (SIMULATED_CONVEYORS_FILE or /conveyors admin routes)
+#  - Shared broadcast tick: one snapshot per tick fanned out to all websockets
+#  - REST snapshot bodies serialized once per state version and served as raw bytes
+#  - Monotonic facility/conveyor/category versions exposed as seq fields and ETags (304 support)
+#  - Negotiated br/gzip compression of large REST bodies, compressed once per state version
+#  - POST /batch: many (conveyor, category) selectors answered from one snapshot read
+#  - fields= sparse fieldsets on /data and the conveyor routes; only the named KPIs are read
+#  - /events Server-Sent Events stream of the delta feed, resumable via Last-Event-ID
+#  - Multi-worker mode: one writer keeps KPI state in shared memory, other workers read it
+#  - Tick feed: the writer encodes each broadcast once; the other workers relay it from a Unix socket
+#  - KPI history in preallocated ring buffers, served downsampled (LTTB) via /history
+#  - Minute/hour/shift rollups (min/max/mean/count) updated per sample, served via /rollups
+#  - Streaming SPC: running mean/variance, EWMA and Western Electric rules per KPI, via /spc and /ws/spc
+#  - Periodic atomic checkpoints of state, rules, fleet and pause flag for warm restarts
+#  - Optional record (append-only binary tick log) and deterministic replay at Nx speed
+#  - Virtual simulation clock with a warp factor and a manual-step mode (/clock admin)
+#  - Prometheus-style /metrics: route latency, websocket sends, generator/serialization time
+#  - Opt-in delta websocket frames (/ws?mode=delta) with periodic keyframes
+#  - Multiplexed /ws/subscribe: per-client conveyor/category/field filters and intervals
+#  - Per-client bounded send queues: stale frames coalesced, send timeouts, slow-client eviction
+#  - Websocket wire format negotiated by subprotocol (json default, msgpack), encoded once per format
 #  - Backwards-compatible routes
 # ============================================================
 
 app = FastAPI(
-    title="Industrial Facility Monitoring API - 5 Conveyor Belt System (Optimized)",
+    title="Industrial Facility Monitoring API - Conveyor Belt System (Optimized)",
     description="""
-    This API simulates a factory environment with 5 conveyor belts:
+    This API simulates a factory environment with a configurable fleet of conveyor belts.
+    By default there are 5:
     
     - Conveyor belts 1-3 are fully operational
     - Conveyor belt 4 is faulty (producing abnormal/extreme values)
     - Conveyor belt 5 is non-operational (all values are zero)
     
+    Load a different fleet with SIMULATED_CONVEYORS_FILE or manage it at runtime via /conveyors.
+    
     KPIs are updated on independent cadences for realism (e.g., temperature 30s, humidity 10m).
     """
 )
@@ -43,388 +104,3261 @@ app.add_middleware(
 # ------------------------------------------------------------
 paused: bool = False  # simulation paused flag
 
+# ------------------------------------------------------------
+# Simulation clock
+# - All cadence, history and payload timestamps read clock.now() instead of time()
+# - warp > 1 runs simulated time faster than the wall clock (SIMULATED_CLOCK_WARP)
+# - Manual mode freezes simulated time; POST /clock/step advances it and runs
+#   every scheduler event that falls inside the step, in order
+# ------------------------------------------------------------
+class SimClock:
+    """Simulated epoch seconds = base + (wall elapsed since rebase) * warp; never moves backwards."""
+
+    def __init__(self, warp: float = 1.0):
+        self._lock = threading.Lock()
+        wall = time()
+        # (sim, wall, warp, manual): swapped whole under the lock, so readers never need it
+        self._anchor: Tuple[float, float, float, bool] = (wall, wall, warp, False)
+
+    @property
+    def warp(self) -> float:
+        return self._anchor[2]
+
+    @property
+    def manual(self) -> bool:
+        return self._anchor[3]
+
+    @staticmethod
+    def _at(anchor: Tuple[float, float, float, bool]) -> float:
+        sim, wall, warp, manual = anchor
+        return sim if manual else sim + (time() - wall) * warp
+
+    def now(self) -> float:
+        return self._at(self._anchor)
+
+    def configure(self, warp: Optional[float] = None, manual: Optional[bool] = None):
+        with self._lock:
+            anchor = self._anchor
+            self._anchor = (self._at(anchor), time(), anchor[2] if warp is None else warp,
+                            anchor[3] if manual is None else manual)
+
+    def set(self, sim: float):
+        """Jump to a simulated time (forward only)."""
+        with self._lock:
+            anchor = self._anchor
+            self._anchor = (max(sim, self._at(anchor)), time(), anchor[2], anchor[3])
+
+    def wall_delay(self, sim_seconds: float) -> Optional[float]:
+        """Wall seconds until `sim_seconds` of simulated time pass; None while frozen."""
+        _, _, warp, manual = self._anchor
+        if manual:
+            return None
+        return max(sim_seconds, 0) / warp
+
+    def as_dict(self) -> Dict[str, Any]:
+        anchor = self._anchor
+        now = self._at(anchor)
+        return {"now": now, "iso": datetime.fromtimestamp(now).isoformat(), "warp": anchor[2], "manual": anchor[3]}
+
+    def state(self) -> Dict[str, Any]:
+        """Raw anchors, so another process can follow the same clock."""
+        sim, wall, warp, manual = self._anchor
+        return {"sim": sim, "wall": wall, "warp": warp, "manual": manual}
+
+    def load(self, state: Dict[str, Any]):
+        with self._lock:
+            self._anchor = (state["sim"], state["wall"], state["warp"], state["manual"])
+
+clock = SimClock(float(os.environ.get("SIMULATED_CLOCK_WARP", 1.0)))
+MAX_CLOCK_STEP_SECONDS = 7 * 24 * 3600
+
+def _timestamp() -> str:
+    return datetime.fromtimestamp(clock.now()).isoformat()
+
+# Websocket topics: every connection subscribes to exactly one of these.
+FACILITY_TOPIC: Tuple = ("facility",)
+FACILITY_DELTA_TOPIC: Tuple = ("facility", "delta")
+
+def _conveyor_topic(conveyor_id: int) -> Tuple:
+    return ("conveyor", conveyor_id)
+
+def _category_topic(conveyor_id: int, category_name: str) -> Tuple:
+    return ("category", conveyor_id, category_name)
+
+# SPC event streams carry rule onsets only, never snapshots
+SPC_TOPIC: Tuple = ("spc",)
+
+def _spc_topic(conveyor_id: int) -> Tuple:
+    return ("spc", conveyor_id)
+
+# ------------------------------------------------------------
+# Websocket wire formats
+# - Clients pick one with the Sec-WebSocket-Protocol header ("msgpack" or "json");
+#   no header (or nothing we support) means JSON text frames, as before
+# - A Frame keeps its payload and encodes it at most once per format, so every
+#   client on the same format shares the same bytes
+# ------------------------------------------------------------
+WIRE_FORMATS: Tuple[str, ...] = ("json", "msgpack") if msgpack is not None else ("json",)
+
+class Frame:
+    """One outbound websocket message, lazily encoded per wire format."""
+    __slots__ = ("payload", "_encoded")
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.payload = payload
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    @classmethod
+    def preencoded(cls, payload: Dict[str, Any], encoded: Dict[str, Union[str, bytes]]) -> "Frame":
+        """A frame whose encodings arrived ready-made (gateways relaying the simulator's tick)."""
+        frame = cls(payload)
+        frame._encoded = encoded
+        return frame
+
+    def encoded(self, wire_format: str) -> Union[str, bytes]:
+        data = self._encoded.get(wire_format)
+        if data is None:
+            if wire_format == "msgpack":
+                started = perf_counter()
+                data = msgpack.packb(self.payload, use_bin_type=True)
+                METRICS.stages["serialize"].observe(perf_counter() - started)
+            else:
+                data = _encode(self.payload)
+            self._encoded[wire_format] = data
+        return data
+
+def _negotiate_format(websocket: WebSocket) -> Optional[str]:
+    """First offered subprotocol we support, or None (plain JSON, no subprotocol echoed)."""
+    for offered in websocket.scope.get("subprotocols") or ():
+        if offered in WIRE_FORMATS:
+            return offered
+    return None
+
+async def _receive_message(websocket: WebSocket) -> Any:
+    """Next client message decoded from JSON text or msgpack binary; raw text if it isn't JSON."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            return None
+        try:
+            return msgpack.unpackb(message["bytes"], raw=False)
+        except Exception:
+            return None
+    text = message.get("text") or ""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+# ------------------------------------------------------------
+# Outbound websocket queues (backpressure)
+# - Every socket gets a ClientChannel: a small queue drained by its own writer task,
+#   so a broadcast never waits on a slow client
+# - Frames are keyed by stream (topic, subscription); a newer frame for a key that is
+#   still queued replaces it (coalescing), and a full queue drops its oldest frame
+# - Delta streams resync: a coalesced or timed-out delta is replaced by a keyframe
+# - Each send has a timeout; WS_EVICT_AFTER_DROPS drops without the queue draining
+#   in between closes the socket
+# ------------------------------------------------------------
+WS_MAX_PENDING_FRAMES = 8
+WS_SEND_TIMEOUT_SECONDS = 5.0
+WS_EVICT_AFTER_DROPS = int(os.environ.get("SIMULATED_WS_EVICT_AFTER_DROPS", 20))
+
+class ClientChannel:
+    """Bounded, coalescing outbound queue for one websocket."""
+
+    def __init__(self, websocket: WebSocket, wire_format: str = "json"):
+        self.websocket = websocket
+        self.wire_format = wire_format
+        self.pending: "OrderedDict[Any, Frame]" = OrderedDict()
+        self.resync: Dict[Any, Callable[[], Frame]] = {}
+        self.needs_resync: Set[Any] = set()
+        self.drops = 0          # since the queue last drained
+        self.total_drops = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._run())
+
+    def put(self, key: Any, frame: Frame, resync: Optional[Callable[[], Frame]] = None):
+        if self.closed:
+            return
+        if resync is not None:
+            self.resync[key] = resync
+            if key in self.needs_resync:
+                self.needs_resync.discard(key)
+                frame = resync()
+        if key in self.pending:
+            # The queued frame is stale; a delta stream needs a keyframe to skip it
+            self.pending[key] = resync() if resync is not None else frame
+            self._dropped()
+        else:
+            if len(self.pending) >= WS_MAX_PENDING_FRAMES:
+                dropped, _ = self.pending.popitem(last=False)
+                if dropped in self.resync:
+                    self.needs_resync.add(dropped)
+                self._dropped()
+            self.pending[key] = frame
+        self._ready.set()
+
+    def _dropped(self):
+        self.drops += 1
+        self.total_drops += 1
+        METRICS.ws_dropped_frames += 1
+        if self.drops >= WS_EVICT_AFTER_DROPS and not self.closed:
+            self.closed = True
+            METRICS.ws_evictions += 1
+            asyncio.create_task(self._evict())
+
+    async def _evict(self):
+        self.pending.clear()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=1008, reason=f"Client too slow: {self.drops} frames dropped"), WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self.pending and not self.closed:
+                key, frame = self.pending.popitem(last=False)
+                data = frame.encoded(self.wire_format)
+                start = perf_counter()
+                try:
+                    send = self.websocket.send_bytes(data) if isinstance(data, bytes) else self.websocket.send_text(data)
+                    await asyncio.wait_for(send, WS_SEND_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    METRICS.ws_send_timeouts += 1
+                    if key in self.resync:
+                        self.needs_resync.add(key)
+                    self._dropped()
+                except Exception:
+                    # Socket is gone; the endpoint's receive loop cleans up
+                    METRICS.ws_send_failures += 1
+                    self.closed = True
+                    return
+                finally:
+                    METRICS.ws_send.observe(perf_counter() - start)
+            if self.closed:
+                return
+            self._ready.clear()
+            self.drops = 0
+
+    def close(self):
+        self.closed = True
+        self._writer.cancel()
+
 class ConnectionManager:
+    """Tracks websocket subscribers per topic and fans pre-encoded frames out through per-client queues."""
+
     def __init__(self):
-        self.active_connections = []
+        self.active_connections: List[WebSocket] = []
+        self.subscribers: Dict[Tuple, Set[WebSocket]] = {}
+        self.channels: Dict[WebSocket, ClientChannel] = {}
+        # Last frame sent per topic, so new subscribers get data without waiting a tick
+        self.last_frames: Dict[Tuple, Frame] = {}
+        self.topics_changed = asyncio.Event()  # a gateway forwards topic changes to the simulator
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, topic: Optional[Tuple] = FACILITY_TOPIC):
+        """Accept (negotiating the wire format) and track a socket; topic None is for sockets not fed by topic broadcasts."""
+        wire_format = _negotiate_format(websocket)
+        await websocket.accept(subprotocol=wire_format)
         self.active_connections.append(websocket)
+        self.channels[websocket] = ClientChannel(websocket, wire_format or "json")
+        if topic is not None:
+            if topic not in self.subscribers:
+                self.topics_changed.set()
+            self.subscribers.setdefault(topic, set()).add(websocket)
 
-    def disconnect(self, websocket: WebSocket):
+    def disconnect(self, websocket: WebSocket, topic: Optional[Tuple] = FACILITY_TOPIC):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        channel = self.channels.pop(websocket, None)
+        if channel is not None:
+            channel.close()
+            METRICS.ws_connection_drops.observe(channel.total_drops)
+        if topic is None:
+            return
+        subs = self.subscribers.get(topic)
+        if subs is not None:
+            subs.discard(websocket)
+            if not subs:
+                del self.subscribers[topic]
+                self.last_frames.pop(topic, None)
+                self.topics_changed.set()
+
+    def topics(self) -> List[Tuple]:
+        return list(self.subscribers)
+
+    def send(self, websocket: WebSocket, frame: Frame, key: Any = None, resync: Optional[Callable[[], Frame]] = None):
+        """Queue a frame; frames without a key are never coalesced (replies, acks)."""
+        channel = self.channels.get(websocket)
+        if channel is not None:
+            channel.put(object() if key is None else key, frame, resync)
+
+    async def broadcast(self, topic: Tuple, message: Frame, resync: Optional[Callable[[], Frame]] = None):
+        """Queue the same encoded frame for every subscriber of a topic; never waits on a client."""
+        sockets = list(self.subscribers.get(topic, ()))
+        if not sockets:
+            return
+        self.last_frames[topic] = message
+        for ws in sockets:
+            self.send(ws, message, topic, resync)
 
 manager = ConnectionManager()
 
+EQUIPMENT = ["Conveyor Line", "CNC Machine", "Laser Cutter", "Injection Molder", "Robot Arm"]
+
 # ------------------------------------------------------------
 # KPI Update Rules (seconds)
 # - Keys are (category -> field -> interval_seconds)
+# - A field is a top-level key of the category; nested values refresh together
+# - Every shipped field has a cadence, so a tick only moves a few of them and
+#   delta frames stay small; GET /kpi-rules lists them all
+# - Fields without a rule (e.g. added via PATCH) refresh every DEFAULT_UPDATE_INTERVAL seconds
 # - You can modify at runtime via /kpi-rules
 # ------------------------------------------------------------
+DEFAULT_UPDATE_INTERVAL = 5   # same as the websocket broadcast tick
+MIN_UPDATE_INTERVAL = 1       # floor for rules of 0 so the scheduler can't spin
+
 UPDATE_RULES: Dict[str, Dict[str, int]] = {
     "overall_facility": {
         "temperature": 30,              # every 30 seconds
         "humidity": 600,                # every 10 minutes
+        "air_quality": 60,
         "warnings_notifications": 1200, # every 20 minutes
         "personal_data": 8 * 60 * 60,   # every 8 hours
-        # Add more fields as needed
+        "power_usage": 15,
+        "co2_emissions": 60,
+    },
+    "production_data": {
+        "quality": 60,
+        "time_per_hour": 60,
+        "product_management": 300,
+        "production_rate": 15,
+    },
+    "equipment_performance": {
+        "uptime_downtime": 300,
+        "operating_conditions": 10,
+        "time_per_hour": 60,
+        "parameters": 10,
+    },
+    "quality_control": {
+        "defective_products": 60,
+        "areas_of_improvement": 1800,
+        "defects_rates": 300,
+        "quality_metrics": 120,
     },
-    # Examples for future:
-    # "production_data": {"production_rate": 60},
-    # "equipment_performance": {"uptime_downtime": 300},
+    "equipment_details": {item: 60 for item in EQUIPMENT},
 }
 
+def _get_interval(category: str, field: str) -> Optional[int]:
+    return UPDATE_RULES.get(category, {}).get(field)
+
 # ------------------------------------------------------------
-# In-memory KPI STATE
-# STATE[conveyor_id][category][field] = {"value": <any>, "t": <epoch_seconds>}
+# KPI table: every simulated leaf with its per-status bounds
+# - float/int: (low, high) per status, drawn uniformly (int bounds inclusive)
+# - bool:      probability of True per status
+# - choice:    tuple of options per status, picked uniformly
+# - drift:     if set, cadenced updates move the previous value by +/- drift
+#              (clamped to bounds) instead of redrawing it
+# Rows are listed in response order; nested keys are dotted paths.
 # ------------------------------------------------------------
-STATE: Dict[int, Dict[str, Dict[str, Dict[str, Any]]]] = {}
+STATUSES = ("operational", "faulty", "non-operational")
+_STATUS_INDEX = {name: i for i, name in enumerate(STATUSES)}
 
-def _get_state(conveyor_id: int, category: str, field: str, default: Any = None) -> Dict[str, Any]:
-    return STATE.setdefault(conveyor_id, {}).setdefault(category, {}).setdefault(field, {"value": default, "t": 0.0})
+class KpiSpec:
+    __slots__ = ("index", "category", "path", "kind", "decimals", "bounds", "drift", "group")
 
-def _get_interval(category: str, field: str) -> Optional[int]:
-    return UPDATE_RULES.get(category, {}).get(field)
+    def __init__(self, index: int, category: str, path: str, kind: str, operational: Any, faulty: Any,
+                 non_operational: Any, decimals: int = 0, drift: Optional[float] = None):
+        self.index = index
+        self.category = category
+        self.path = tuple(path.split("."))
+        self.kind = kind
+        self.decimals = decimals
+        self.bounds = (operational, faulty, non_operational)
+        self.drift = drift
+        self.group = -1  # cadence group id, assigned below
 
-def _should_update(conveyor_id: int, category: str, field: str) -> bool:
-    interval = _get_interval(category, field)
-    if interval is None:
-        # If no rule defined, update every call (legacy behavior)
-        return True
-    node = _get_state(conveyor_id, category, field)
-    return (time() - float(node["t"])) >= interval
+_KPI_ROWS = [
+    # overall_facility
+    ("overall_facility", "temperature", "float", (20, 26), (30, 45), (0, 0), 1, 0.4),
+    ("overall_facility", "humidity", "float", (40, 60), (75, 95), (0, 0), 1, 1.0),
+    ("overall_facility", "air_quality", "float", (85, 99), (60, 75), (0, 0), 1),
+    ("overall_facility", "warnings_notifications", "int", (0, 3), (5, 10), (0, 0)),
+    ("overall_facility", "personal_data.personnel_present", "int", (10, 50), (2, 5), (0, 0)),
+    ("overall_facility", "personal_data.shift_efficiency", "float", (80, 95), (40, 65), (0, 0), 1),
+    ("overall_facility", "personal_data.safety_incidents", "int", (0, 1), (1, 3), (0, 0)),
+    ("overall_facility", "power_usage.current_kw", "float", (500, 2000), (2500, 4000), (0, 0), 2),
+    ("overall_facility", "power_usage.daily_usage", "float", (10000, 40000), (45000, 60000), (0, 0), 2),
+    ("overall_facility", "power_usage.efficiency_rating", "float", (75, 90), (40, 65), (0, 0), 1),
+    ("overall_facility", "co2_emissions.current_level", "float", (400, 1200), (1500, 2500), (0, 0), 2),
+    ("overall_facility", "co2_emissions.daily_average", "float", (500, 900), (1200, 2000), (0, 0), 2),
+    ("overall_facility", "co2_emissions.target_compliance", "float", (85, 99), (40, 70), (0, 0), 1),
+    # production_data
+    ("production_data", "quality.first_pass_yield", "float", (85, 99.5), (50, 70), (0, 0), 1),
+    ("production_data", "quality.defect_rate", "float", (0.1, 5), (15, 30), (0, 0), 2),
+    ("production_data", "quality.scrap_rate", "float", (0.2, 3), (10, 20), (0, 0), 2),
+    ("production_data", "time_per_hour.units_produced", "int", (50, 200), (10, 40), (0, 0)),
+    ("production_data", "time_per_hour.cycle_time", "float", (15, 60), (80, 180), (0, 0), 2),
+    ("production_data", "time_per_hour.efficiency", "float", (75, 98), (30, 60), (0, 0), 1),
+    ("production_data", "product_management.active_orders", "int", (3, 15), (1, 5), (0, 0)),
+    ("production_data", "product_management.backlog", "int", (0, 10), (15, 30), (0, 0)),
+    ("production_data", "product_management.on_time_delivery", "float", (80, 99), (30, 60), (0, 0), 1),
+    ("production_data", "product_management.inventory_levels", "float", (70, 95), (20, 40), (0, 0), 1),
+    ("production_data", "production_rate.current_rate", "int", (80, 150), (20, 50), (0, 0)),
+    ("production_data", "production_rate.target_rate", "int", (100, 160), (100, 160), (0, 0)),
+    ("production_data", "production_rate.variance", "float", (-15, 10), (-70, -40), (0, 0), 1),
+    # equipment_performance
+    ("equipment_performance", "uptime_downtime.uptime_percentage", "float", (85, 99), (30, 60), (0, 0), 1),
+    ("equipment_performance", "uptime_downtime.planned_downtime", "float", (1, 8), (3, 6), (24, 24), 1),
+    ("equipment_performance", "uptime_downtime.unplanned_downtime", "float", (0, 4), (4, 12), (0, 0), 2),
+    ("equipment_performance", "uptime_downtime.mean_time_between_failures", "float", (100, 500), (10, 60), (0, 0), 1),
+    ("equipment_performance", "operating_conditions.temperature", "float", (20, 40), (45, 65), (0, 0), 1),
+    ("equipment_performance", "operating_conditions.pressure", "float", (80, 110), (40, 70), (0, 0), 1),
+    ("equipment_performance", "operating_conditions.vibration", "float", (0.1, 2.5), (5, 15), (0, 0), 2),
+    ("equipment_performance", "operating_conditions.noise_level", "float", (60, 95), (95, 110), (0, 0), 1),
+    ("equipment_performance", "operating_conditions.load_percentage", "float", (60, 90), (30, 50), (0, 0), 1),
+    ("equipment_performance", "time_per_hour.processing_time", "float", (45, 58), (20, 35), (0, 0), 1),
+    ("equipment_performance", "time_per_hour.idle_time", "float", (0, 10), (15, 25), (60, 60), 1),
+    ("equipment_performance", "time_per_hour.setup_time", "float", (2, 8), (10, 20), (0, 0), 1),
+    ("equipment_performance", "time_per_hour.maintenance_time", "float", (0, 5), (5, 15), (0, 0), 1),
+    ("equipment_performance", "parameters.temp_pressure_vibration.temperature", "float", (20, 40), (45, 65), (0, 0), 1),
+    ("equipment_performance", "parameters.temp_pressure_vibration.pressure", "float", (80, 110), (40, 70), (0, 0), 1),
+    ("equipment_performance", "parameters.temp_pressure_vibration.vibration", "float", (0.1, 2.5), (5, 15), (0, 0), 2),
+    ("equipment_performance", "parameters.temp_pressure_vibration.within_spec", "bool", 0.75, 0.0, 0.0),
+    # quality_control
+    ("quality_control", "defective_products.count", "int", (0, 20), (40, 80), (0, 0)),
+    ("quality_control", "defective_products.percentage", "float", (0.1, 3), (15, 30), (0, 0), 2),
+    ("quality_control", "defective_products.critical_defects", "int", (0, 5), (10, 25), (0, 0)),
+    ("quality_control", "areas_of_improvement.identified_areas", "int", (1, 5), (8, 15), (0, 0)),
+    ("quality_control", "areas_of_improvement.priority_level", "choice", ("low", "medium", "high"), ("high",), ("none",)),
+    ("quality_control", "areas_of_improvement.estimated_impact", "float", (1, 10), (7, 10), (0, 0), 1),
+    ("quality_control", "defects_rates.by_category.assembly", "float", (0.1, 2), (10, 20), (0, 0), 2),
+    ("quality_control", "defects_rates.by_category.material", "float", (0.05, 1.5), (5, 15), (0, 0), 2),
+    ("quality_control", "defects_rates.by_category.finish", "float", (0.2, 2.5), (8, 18), (0, 0), 2),
+    ("quality_control", "defects_rates.by_category.packaging", "float", (0.1, 1), (3, 8), (0, 0), 2),
+    ("quality_control", "defects_rates.trend", "choice", ("improving", "stable", "worsening"), ("worsening",), ("none",)),
+    ("quality_control", "defects_rates.within_targets", "bool", 0.75, 0.0, 0.0),
+    ("quality_control", "quality_metrics.dimensional_accuracy", "float", (95, 99.9), (70, 85), (0, 0), 2),
+    ("quality_control", "quality_metrics.visual_inspection_pass_rate", "float", (90, 99), (60, 80), (0, 0), 1),
+    ("quality_control", "quality_metrics.customer_return_rate", "float", (0.01, 1), (5, 15), (0, 0), 2),
+]
+for _item in EQUIPMENT:
+    _KPI_ROWS += [
+        ("equipment_details", f"{_item}.usage_hours", "float", (0, 24), (5, 10), (0, 0), 1),
+        ("equipment_details", f"{_item}.performance_score", "float", (70, 100), (20, 50), (0, 0), 1),
+        ("equipment_details", f"{_item}.wear_percentage", "float", (0, 80), (60, 95), (0, 0), 1),
+        ("equipment_details", f"{_item}.maintenance_needed", "bool", 0.2, 1.0, 0.0),
+        ("equipment_details", f"{_item}.downtime", "float", (0, 2), (5, 15), (24, 24), 2),
+    ]
 
-def _set_state(conveyor_id: int, category: str, field: str, value: Any) -> Any:
-    node = _get_state(conveyor_id, category, field)
-    node["value"] = value
-    node["t"] = time()
-    return value
+KPI_SPECS: List[KpiSpec] = [KpiSpec(i, *row) for i, row in enumerate(_KPI_ROWS)]
+VALID_CATEGORIES = ["overall_facility", "production_data", "equipment_performance", "quality_control", "equipment_details"]
+CATEGORY_INDEX = {cat: i for i, cat in enumerate(VALID_CATEGORIES)}
+KPIS_BY_CATEGORY: Dict[str, List[KpiSpec]] = {cat: [k for k in KPI_SPECS if k.category == cat] for cat in VALID_CATEGORIES}
 
-def _get_value(conveyor_id: int, category: str, field: str) -> Any:
-    return _get_state(conveyor_id, category, field)["value"]
+# KPIs sharing a top-level field form one cadence group, keyed like UPDATE_RULES
+KPI_GROUPS: List[Tuple[str, str]] = []
+_GROUP_INDEX: Dict[Tuple[str, str], int] = {}
+for _k in KPI_SPECS:
+    _key = (_k.category, _k.path[0])
+    if _key not in _GROUP_INDEX:
+        _GROUP_INDEX[_key] = len(KPI_GROUPS)
+        KPI_GROUPS.append(_key)
+    _k.group = _GROUP_INDEX[_key]
+
+# Bound tables indexed [kpi, status] so one fancy-index gives per-conveyor bounds
+_LOW = np.zeros((len(KPI_SPECS), len(STATUSES)))
+_HIGH = np.zeros((len(KPI_SPECS), len(STATUSES)))
+for _k in KPI_SPECS:
+    for _s, _b in enumerate(_k.bounds):
+        if _k.kind == "bool":
+            _LOW[_k.index, _s] = _b
+        elif _k.kind == "choice":
+            _HIGH[_k.index, _s] = len(_b)
+        elif _k.kind == "int":
+            _LOW[_k.index, _s], _HIGH[_k.index, _s] = _b[0], _b[1] + 1  # inclusive upper bound
+        else:
+            _LOW[_k.index, _s], _HIGH[_k.index, _s] = _b
+
+# SIMULATED_SEED makes runs reproducible; otherwise a fresh seed is drawn (and recorded when logging)
+SIMULATION_SEED = int(os.environ.get("SIMULATED_SEED") or np.random.SeedSequence().entropy % 2**63)
+_rng = np.random.default_rng(SIMULATION_SEED)
+
+# ------------------------------------------------------------
+# Metrics (Prometheus text format at /metrics)
+# - Hot paths only bump preallocated counters: a bisect and two additions per
+#   observation, no locks (an increment lost to a thread race is acceptable)
+# - All formatting happens when /metrics is scraped
+# ------------------------------------------------------------
+HISTOGRAM_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DROPPED_FRAME_BUCKETS = (0, 1, 5, 20, 100, 500, 2500)
+
+class Histogram:
+    """Per-bucket counts (not cumulative) plus a running sum."""
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: Tuple[float, ...] = HISTOGRAM_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+
+    def render(self, name: str, labels: str) -> List[str]:
+        sep = "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+class Metrics:
+    STAGES = ("generate", "read_batch", "serialize", "compress")
+
+    def __init__(self):
+        self.route_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.stages = {stage: Histogram() for stage in self.STAGES}
+        self.category_builds = {cat: Histogram() for cat in VALID_CATEGORIES}
+        self.ws_send = Histogram()
+        self.ws_send_failures = 0
+        self.ws_send_timeouts = 0
+        self.ws_dropped_frames = 0
+        self.ws_evictions = 0
+        self.ws_connection_drops = Histogram(DROPPED_FRAME_BUCKETS)  # observed once per closed socket
+        self.kpi_regenerations = np.zeros(len(KPI_SPECS), dtype=np.int64)
+        self.spc_violations: Dict[str, int] = {}
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        histogram = self.route_latency.get((method, route))
+        if histogram is None:
+            histogram = self.route_latency.setdefault((method, route), Histogram())
+        histogram.observe(seconds)
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self) -> str:
+        lines = ["# HELP simulated_http_request_duration_seconds REST latency per route template",
+                 "# TYPE simulated_http_request_duration_seconds histogram"]
+        for (method, route), histogram in sorted(self.route_latency.items()):
+            lines += histogram.render("simulated_http_request_duration_seconds", f'method="{method}",route="{route}"')
+        lines += ["# HELP simulated_http_requests_total REST requests per route template and status",
+                  "# TYPE simulated_http_requests_total counter"]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f'simulated_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+        lines += ["# HELP simulated_websocket_connections Open websocket connections",
+                  "# TYPE simulated_websocket_connections gauge",
+                  f"simulated_websocket_connections {len(manager.active_connections)}",
+                  "# HELP simulated_sse_clients Open /events streams",
+                  "# TYPE simulated_sse_clients gauge",
+                  f"simulated_sse_clients {event_log.clients}",
+                  "# HELP simulated_tick_feed_gateways Gateway processes subscribed to this simulator's tick feed",
+                  "# TYPE simulated_tick_feed_gateways gauge",
+                  f"simulated_tick_feed_gateways {len(tick_feed.gateways) if tick_feed is not None else 0}",
+                  "# HELP simulated_websocket_subscribers Websocket subscribers per topic kind",
+                  "# TYPE simulated_websocket_subscribers gauge"]
+        kinds: Dict[str, int] = {}
+        for topic, subscribers in list(manager.subscribers.items()):
+            kind = "delta" if topic == FACILITY_DELTA_TOPIC else topic[0]
+            kinds[kind] = kinds.get(kind, 0) + len(subscribers)
+        for kind, count in sorted(kinds.items()):
+            lines.append(f'simulated_websocket_subscribers{{topic="{kind}"}} {count}')
+        lines += ["# HELP simulated_websocket_send_seconds Duration of individual websocket sends",
+                  "# TYPE simulated_websocket_send_seconds histogram"]
+        lines += self.ws_send.render("simulated_websocket_send_seconds", "")
+        lines += ["# HELP simulated_websocket_send_failures_total Websocket sends that raised (socket dropped)",
+                  "# TYPE simulated_websocket_send_failures_total counter",
+                  f"simulated_websocket_send_failures_total {self.ws_send_failures}",
+                  "# HELP simulated_websocket_send_timeouts_total Websocket sends that exceeded WS_SEND_TIMEOUT_SECONDS",
+                  "# TYPE simulated_websocket_send_timeouts_total counter",
+                  f"simulated_websocket_send_timeouts_total {self.ws_send_timeouts}",
+                  "# HELP simulated_websocket_dropped_frames_total Frames coalesced, overflowed or timed out",
+                  "# TYPE simulated_websocket_dropped_frames_total counter",
+                  f"simulated_websocket_dropped_frames_total {self.ws_dropped_frames}",
+                  "# HELP simulated_websocket_evictions_total Slow clients closed after too many drops",
+                  "# TYPE simulated_websocket_evictions_total counter",
+                  f"simulated_websocket_evictions_total {self.ws_evictions}",
+                  "# HELP simulated_websocket_clients_dropping Connected websocket clients that have had frames dropped",
+                  "# TYPE simulated_websocket_clients_dropping gauge",
+                  f"simulated_websocket_clients_dropping {sum(1 for c in list(manager.channels.values()) if c.total_drops)}",
+                  "# HELP simulated_websocket_connection_dropped_frames Frames dropped over the lifetime of each closed connection",
+                  "# TYPE simulated_websocket_connection_dropped_frames histogram"]
+        lines += self.ws_connection_drops.render("simulated_websocket_connection_dropped_frames", "")
+        lines += ["# HELP simulated_stage_duration_seconds Time in KPI generation, batch reads, serialization and compression",
+                  "# TYPE simulated_stage_duration_seconds histogram"]
+        for stage, histogram in self.stages.items():
+            lines += histogram.render("simulated_stage_duration_seconds", f'stage="{stage}"')
+        lines += ["# HELP simulated_category_build_seconds Time building one conveyor's category dict (simulate_* payloads)",
+                  "# TYPE simulated_category_build_seconds histogram"]
+        for category, histogram in self.category_builds.items():
+            lines += histogram.render("simulated_category_build_seconds", f'category="{category}"')
+        lines += ["# HELP simulated_kpi_regenerations_total KPI values regenerated by the cadence scheduler",
+                  "# TYPE simulated_kpi_regenerations_total counter"]
+        for k, count in zip(KPI_SPECS, self.kpi_regenerations.tolist()):
+            lines.append(f'simulated_kpi_regenerations_total{{category="{k.category}",field="{".".join(k.path)}"}} {count}')
+        lines += ["# HELP simulated_spc_violations_total SPC rule onsets (a rule starting to fire on a KPI)",
+                  "# TYPE simulated_spc_violations_total counter"]
+        for rule, count in sorted(self.spc_violations.items()):
+            lines.append(f'simulated_spc_violations_total{{rule="{rule}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request, labelled by the matched route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = perf_counter()
+        status = [500]
+        elapsed = [None]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                # Latency is time to the response headers, so long-lived streams don't skew it
+                elapsed[0] = perf_counter() - start
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            duration = elapsed[0] if elapsed[0] is not None else perf_counter() - start
+            METRICS.observe_request(scope["method"], getattr(route, "path", "unmatched"), status[0], duration)
+
+app.add_middleware(MetricsMiddleware)
+
+# ------------------------------------------------------------
+# In-memory KPI STATE (columnar)
+# - STATE.values[kpi, slot]   latest value of every KPI (NaN = never generated);
+#                             ints/bools/choice indices are stored as floats
+# - STATE.stamps[group, slot] last update time of each cadence group (0 = never)
+# Each conveyor owns one slot (column); freed slots are reused.
+# ------------------------------------------------------------
+class KpiStore:
+    """Latest KPI values and cadence timestamps in contiguous arrays, one column per conveyor."""
+
+    def __init__(self, n_kpis: int, n_groups: int, capacity: int = 64):
+        self.values = np.full((n_kpis, capacity), np.nan)
+        self.stamps = np.zeros((n_groups, capacity))
+        # Versions come from one monotonic counter: the facility version is the counter itself,
+        # each conveyor/category slice records the counter value of its last actual change
+        self.version = 0
+        self.conveyor_versions = np.zeros(capacity, dtype=np.int64)
+        self.category_versions = np.zeros((len(VALID_CATEGORIES), capacity), dtype=np.int64)
+        # Slots holding a value for every KPI; a new slot fills one cadence group at a time otherwise
+        self.generated = np.zeros(capacity, dtype=bool)
+        self._slots: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._next = 0
+        self._lock = threading.Lock()
+        # (ids list, slots) for the last fleet-wide lookup, swapped as one tuple for thread safety
+        self._cached: Tuple[Optional[List[int]], Optional[np.ndarray]] = (None, None)
+        self.on_grow: Optional[Callable[[], None]] = None  # set when the arrays live in shared memory
+
+    def __contains__(self, conveyor_id: int) -> bool:
+        return conveyor_id in self._slots
+
+    def conveyor_ids(self) -> List[int]:
+        return list(self._slots)
+
+    def _grow(self):
+        capacity = self.values.shape[1] * 2
+        values = np.full((self.values.shape[0], capacity), np.nan)
+        values[:, :self.values.shape[1]] = self.values
+        stamps = np.zeros((self.stamps.shape[0], capacity))
+        stamps[:, :self.stamps.shape[1]] = self.stamps
+        conveyor_versions = np.zeros(capacity, dtype=np.int64)
+        conveyor_versions[:len(self.conveyor_versions)] = self.conveyor_versions
+        category_versions = np.zeros((self.category_versions.shape[0], capacity), dtype=np.int64)
+        category_versions[:, :self.category_versions.shape[1]] = self.category_versions
+        generated = np.zeros(capacity, dtype=bool)
+        generated[:len(self.generated)] = self.generated
+        self.values, self.stamps, self.generated = values, stamps, generated
+        self.conveyor_versions, self.category_versions = conveyor_versions, category_versions
+
+    def bind(self, arrays: Dict[str, np.ndarray]):
+        """Point the store at externally owned arrays of the same layout; nothing is copied."""
+        self.values, self.stamps = arrays["values"], arrays["stamps"]
+        self.conveyor_versions, self.category_versions = arrays["conveyor_versions"], arrays["category_versions"]
+        self.generated = ~np.isnan(self.values).any(axis=0)
+
+    def adopt_slots(self, slots: Dict[int, int]):
+        """Replace the conveyor -> slot map wholesale (read-only workers following a writer)."""
+        with self._lock:
+            self._slots = dict(slots)
+            self._cached = (None, None)
+
+    def _allocate(self, conveyor_ids: List[int]):
+        grew = False
+        with self._lock:
+            for cid in conveyor_ids:
+                if cid in self._slots:
+                    continue
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot = self._next
+                    self._next += 1
+                    if slot >= self.values.shape[1]:
+                        self._grow()
+                        grew = True
+                self._slots[cid] = slot
+        # Outside our lock: the hook takes the shared-state write lock, which is always acquired first
+        if grew and self.on_grow is not None:
+            self.on_grow()
+
+    def slots(self, conveyor_ids: List[int]) -> np.ndarray:
+        """Slot index per conveyor, allocating on first sight. Fleet-wide lists are cached by identity."""
+        cached_ids, cached_slots = self._cached
+        if conveyor_ids is cached_ids:
+            return cached_slots
+        slot_of = self._slots
+        if any(cid not in slot_of for cid in conveyor_ids):
+            self._allocate(conveyor_ids)
+        slots = np.fromiter((slot_of[cid] for cid in conveyor_ids), dtype=np.intp, count=len(conveyor_ids))
+        if len(conveyor_ids) > 1:
+            self._cached = (conveyor_ids, slots)
+        return slots
+
+    def forget(self, conveyor_id: int):
+        with self._lock:
+            slot = self._slots.pop(conveyor_id, None)
+            if slot is None:
+                return
+            self.values[:, slot] = np.nan
+            self.stamps[:, slot] = 0.0
+            self.generated[slot] = False
+            self._free.append(slot)
+            self._cached = (None, None)
+            self.version += 1
+
+    def reset_stamps(self, category: str, field: str):
+        """Mark a cadence group as due for every conveyor."""
+        group = _GROUP_INDEX.get((category, field))
+        if group is not None:
+            self.stamps[group, :] = 0.0
+
+    def column(self, kpi_index: int, conveyor_ids: List[int]) -> np.ndarray:
+        """Bulk read of one KPI across conveyors, e.g. every temperature for aggregation."""
+        return self.values[kpi_index, self.slots(conveyor_ids)]
+
+    def touch(self) -> int:
+        """Bump the facility version for changes outside the KPI arrays (fleet, pause flag)."""
+        self.version += 1
+        return self.version
+
+    def conveyor_version(self, conveyor_id: int) -> int:
+        return int(self.conveyor_versions[self._slots[conveyor_id]])
+
+    def category_version(self, conveyor_id: int, category: str) -> int:
+        return int(self.category_versions[CATEGORY_INDEX[category], self._slots[conveyor_id]])
+
+    def value(self, conveyor_id: int, kpi_index: int) -> float:
+        return float(self.values[kpi_index, self._slots[conveyor_id]])
+
+    def missing(self, conveyor_ids: List[int]) -> List[int]:
+        """Conveyors without a full set of values (never seen, or only some cadence groups drawn)."""
+        cached_ids, cached_slots = self._cached
+        if conveyor_ids is cached_ids and self.generated[cached_slots].all():
+            return []
+        slot_of, generated = self._slots, self.generated
+        return [cid for cid in conveyor_ids if cid not in slot_of or not generated[slot_of[cid]]]
+
+    def mark_generated(self, slots: np.ndarray):
+        """Flag the given slots once none of their KPIs is still unset."""
+        pending = slots[~self.generated[slots]]
+        if len(pending):
+            self.generated[pending] = ~np.isnan(self.values[:, pending]).any(axis=0)
+
+    def slot_of(self, conveyor_id: int) -> Optional[int]:
+        return self._slots.get(conveyor_id)
+
+    def slot_table(self, size: Optional[int] = None) -> np.ndarray:
+        """Conveyor id per slot (-1 = free) for the first `size` slots (default: all used)."""
+        size = self._next if size is None else size
+        slot_ids = np.full(size, -1, dtype=np.int64)
+        for cid, slot in self._slots.items():
+            if slot < size:
+                slot_ids[slot] = cid
+        return slot_ids
+
+    def export(self) -> Dict[str, np.ndarray]:
+        """Copies of the used part of every array plus the slot -> conveyor id map."""
+        with self._lock:
+            used = self._next
+            slot_ids = self.slot_table(used)
+            return {
+                "values": self.values[:, :used].copy(),
+                "stamps": self.stamps[:, :used].copy(),
+                "conveyor_versions": self.conveyor_versions[:used].copy(),
+                "category_versions": self.category_versions[:, :used].copy(),
+                "slot_ids": slot_ids,
+            }
+
+    def restore(self, arrays: Dict[str, np.ndarray], version: int):
+        """Inverse of export(); slots keep their positions so the arrays are copied as blocks."""
+        used = len(arrays["slot_ids"])
+        with self._lock:
+            while self.values.shape[1] < used:
+                self._grow()
+            self.values[:, :used] = arrays["values"]
+            self.stamps[:, :used] = arrays["stamps"]
+            self.conveyor_versions[:used] = arrays["conveyor_versions"]
+            self.category_versions[:, :used] = arrays["category_versions"]
+            self.generated[:used] = ~np.isnan(self.values[:, :used]).any(axis=0)
+            self._slots = {int(cid): slot for slot, cid in enumerate(arrays["slot_ids"]) if cid >= 0}
+            self._free = [slot for slot, cid in enumerate(arrays["slot_ids"]) if cid < 0]
+            self._next = used
+            self._cached = (None, None)
+            self.version = version
+
+STATE = KpiStore(len(KPI_SPECS), len(KPI_GROUPS))
 
 # ------------------------------------------------------------
-# Utility: determine conveyor status string
+# KPI history: one preallocated ring buffer per (cadence group, conveyor slot)
+# - Every generation of a group appends one sample for each of its KPIs
+# - Ring length covers HISTORY_HOURS at the group's cadence when the service
+#   starts (capped at HISTORY_MAX_SAMPLES); faster runtime rules shorten the window
+# - Faster cadences (e.g. unruled fields at every tick) keep one sample per
+#   HISTORY_MIN_SPACING_SECONDS; rollups still fold in every sample
+# - Values are float32; they are rounded back to the KPI's decimals when served
+# - History and rollups cost ~0.4 MB per conveyor, so only the first
+#   HISTORY_MAX_CONVEYORS conveyor slots are tracked
 # ------------------------------------------------------------
+HISTORY_HOURS = float(os.environ.get("SIMULATED_HISTORY_HOURS", 4))
+HISTORY_MAX_SAMPLES = 2880
+HISTORY_MIN_SPACING_SECONDS = 30
+HISTORY_MAX_POINTS = 5000  # upper bound for /history?max_points
+HISTORY_MAX_CONVEYORS = int(os.environ.get("SIMULATED_HISTORY_MAX_CONVEYORS", 500))
+
+def _tracked(slots: np.ndarray, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The slots (and their sample columns) that history and rollups keep."""
+    if len(slots) and slots.max() >= HISTORY_MAX_CONVEYORS:
+        keep = slots < HISTORY_MAX_CONVEYORS
+        return slots[keep], samples[:, keep]
+    return slots, samples
+
+_GROUP_KPIS: List[List[KpiSpec]] = [[k for k in KPI_SPECS if k.group == g] for g in range(len(KPI_GROUPS))]
+_ROW_IN_GROUP: Dict[int, int] = {k.index: row for kpis in _GROUP_KPIS for row, k in enumerate(kpis)}
+_KPI_GROUP = np.array([k.group for k in KPI_SPECS], dtype=np.intp)
+_KPI_ROW_IN_GROUP = np.array([_ROW_IN_GROUP[k.index] for k in KPI_SPECS], dtype=np.intp)
+KPI_BY_PATH: Dict[Tuple[str, str], KpiSpec] = {(k.category, ".".join(k.path)): k for k in KPI_SPECS}
+
+class HistoryStore:
+    """Past samples per KPI in fixed-size rings; appends are O(1) array writes for the whole fleet."""
+
+    def __init__(self, hours: float, capacity: int = 64):
+        lengths = []
+        for group in range(len(KPI_GROUPS)):
+            interval = _get_interval(*KPI_GROUPS[group]) or DEFAULT_UPDATE_INTERVAL
+            samples = math.ceil(hours * 3600 / max(interval, MIN_UPDATE_INTERVAL, HISTORY_MIN_SPACING_SECONDS))
+            lengths.append(min(max(samples, 2), HISTORY_MAX_SAMPLES))
+        self.lengths = np.array(lengths)
+        self.values = [np.full((len(_GROUP_KPIS[g]), capacity, n), np.nan, dtype=np.float32) for g, n in enumerate(self.lengths)]
+        self.times = [np.zeros((capacity, n)) for n in self.lengths]
+        self.head = np.zeros((len(KPI_GROUPS), capacity), dtype=np.intp)
+        self.count = np.zeros((len(KPI_GROUPS), capacity), dtype=np.intp)
+
+    def _ensure_capacity(self, capacity: int):
+        current = self.head.shape[1]
+        if capacity <= current:
+            return
+        for g, n in enumerate(self.lengths):
+            values = np.full((len(_GROUP_KPIS[g]), capacity, n), np.nan, dtype=np.float32)
+            values[:, :current] = self.values[g]
+            times = np.zeros((capacity, n))
+            times[:current] = self.times[g]
+            self.values[g], self.times[g] = values, times
+        head = np.zeros((len(KPI_GROUPS), capacity), dtype=np.intp)
+        head[:, :current] = self.head
+        count = np.zeros((len(KPI_GROUPS), capacity), dtype=np.intp)
+        count[:, :current] = self.count
+        self.head, self.count = head, count
+
+    def record(self, kpi_indices: np.ndarray, groups: Dict[int, List[int]], slots: np.ndarray, samples: np.ndarray, now: float):
+        """Append samples[i, j] (KPI kpi_indices[i], conveyor slot slots[j]); groups maps group -> its positions in i."""
+        slots, samples = _tracked(slots, samples)
+        if not len(slots):
+            return
+        self._ensure_capacity(min(STATE.values.shape[1], HISTORY_MAX_CONVEYORS))
+        rows = _KPI_ROW_IN_GROUP[kpi_indices]
+        cells = np.ix_(list(groups), slots)
+        heads, lengths = self.head[cells], self.lengths[cells[0]]
+        # Half a second of slack, so float drift never drops a 5 s cadence to every 7th sample
+        due = np.empty(heads.shape, dtype=bool)
+        for i, (group, positions) in enumerate(groups.items()):
+            head, times = heads[i], self.times[group]
+            due[i] = times[slots, (head - 1) % lengths[i, 0]] <= now - HISTORY_MIN_SPACING_SECONDS + MIN_UPDATE_INTERVAL / 2
+            if due[i].all():
+                self.values[group][rows[positions, None], slots, head] = samples[positions]
+                times[slots, head] = now
+            elif due[i].any():
+                picked, head = slots[due[i]], head[due[i]]
+                self.values[group][rows[positions, None], picked, head] = samples[positions][:, due[i]]
+                times[picked, head] = now
+        self.head[cells] = (heads + due) % lengths
+        self.count[cells] = np.minimum(self.count[cells] + due, lengths)
+
+    def clear(self, slot: int):
+        if slot < self.head.shape[1]:
+            # Times too: the spacing check reads the stamp before the head, which would hold back the next owner
+            for times in self.times:
+                times[slot] = 0
+            self.head[:, slot] = 0
+            self.count[:, slot] = 0
+
+    def series(self, slot: int, kpi: KpiSpec) -> Tuple[np.ndarray, np.ndarray]:
+        """Chronological (times, values) of one KPI on one conveyor."""
+        group, length = kpi.group, self.lengths[kpi.group]
+        if slot >= self.head.shape[1]:
+            return np.empty(0), np.empty(0)
+        count, head = int(self.count[group, slot]), int(self.head[group, slot])
+        order = (np.arange(head - count, head) % length)
+        return self.times[group][slot, order], self.values[group][_ROW_IN_GROUP[kpi.index], slot, order].astype(np.float64)
+
+HISTORY = HistoryStore(HISTORY_HOURS)
+
+def lttb(times: np.ndarray, values: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets downsampling to at most `threshold` points."""
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return times, values
+    every = (n - 2) / (threshold - 2)
+    picked = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        if i < threshold - 3:
+            next_end = int((i + 2) * every) + 1
+            avg_t, avg_v = times[end:next_end].mean(), values[end:next_end].mean()
+        else:
+            avg_t, avg_v = times[-1], values[-1]
+        area = np.abs((times[a] - avg_t) * (values[start:end] - values[a])
+                      - (times[a] - times[start:end]) * (avg_v - values[a]))
+        a = start + int(np.argmax(area))
+        picked.append(a)
+    picked.append(n - 1)
+    return times[picked], values[picked]
+
+# ------------------------------------------------------------
+# KPI rollups: min/max/sum/count buckets per (KPI, conveyor slot) at three levels
+# - Each sample folds into the current bucket of every level: O(1), no rescans
+# - Buckets live in rings indexed by (epoch // width) % retention; a bucket is
+#   reset lazily the first time a new period lands on its position
+# - Bucket epochs are shared per cadence group since groups are always generated whole
+# ------------------------------------------------------------
+ROLLUP_LEVELS: Tuple[Tuple[str, int, int], ...] = (
+    ("minute", 60, 60),         # last hour
+    ("hour", 3600, 48),         # last two days
+    ("shift", 8 * 3600, 93),    # last 31 days
+)
+
+class RollupStore:
+    """Per-level ring of aggregate buckets laid out [bucket, kpi, slot]; record() updates one 2-D block per level."""
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = 0
+        self.mins: List[np.ndarray] = []
+        self.maxs: List[np.ndarray] = []
+        self.sums: List[np.ndarray] = []
+        self.counts: List[np.ndarray] = []
+        self.epochs: List[np.ndarray] = []
+        for _, _, buckets in ROLLUP_LEVELS:
+            self.mins.append(np.empty((buckets, len(KPI_SPECS), 0), dtype=np.float32))
+            self.maxs.append(np.empty((buckets, len(KPI_SPECS), 0), dtype=np.float32))
+            self.sums.append(np.empty((buckets, len(KPI_SPECS), 0), dtype=np.float64))  # float32 drifts over a shift of samples
+            self.counts.append(np.empty((buckets, len(KPI_SPECS), 0), dtype=np.int32))
+            self.epochs.append(np.empty((buckets, len(KPI_GROUPS), 0), dtype=np.int64))
+        self._ensure_capacity(capacity)
+
+    def _ensure_capacity(self, capacity: int):
+        if capacity <= self.capacity:
+            return
+        current = self.capacity
+
+        def grown(array: np.ndarray, fill) -> np.ndarray:
+            out = np.full(array.shape[:2] + (capacity,), fill, dtype=array.dtype)
+            out[:, :, :current] = array
+            return out
+
+        for level in range(len(ROLLUP_LEVELS)):
+            self.mins[level] = grown(self.mins[level], np.inf)
+            self.maxs[level] = grown(self.maxs[level], -np.inf)
+            self.sums[level] = grown(self.sums[level], 0.0)
+            self.counts[level] = grown(self.counts[level], 0)
+            self.epochs[level] = grown(self.epochs[level], -1)
+        self.capacity = capacity
+
+    def record(self, kpi_indices: np.ndarray, slots: np.ndarray, samples: np.ndarray, now: float):
+        """Fold samples[i, j] (KPI kpi_indices[i], conveyor slot slots[j]) into every level, all groups at once."""
+        slots, samples = _tracked(slots, samples)
+        if not len(slots):
+            return
+        self._ensure_capacity(min(STATE.values.shape[1], HISTORY_MAX_CONVEYORS))
+        row_index, slot_index = _contiguous(kpi_indices), _contiguous(slots)
+        block = (row_index, slot_index) if isinstance(row_index, slice) and isinstance(slot_index, slice) else np.ix_(kpi_indices, slots)
+        groups, group_of_row = np.unique(_KPI_GROUP[kpi_indices], return_inverse=True)
+        group_block = np.ix_(groups, slots)
+        for level, (_, width, buckets) in enumerate(ROLLUP_LEVELS):
+            epoch = int(now // width)
+            pos = epoch % buckets
+            mins, maxs, sums, counts = self.mins[level][pos], self.maxs[level][pos], self.sums[level][pos], self.counts[level][pos]
+            epochs = self.epochs[level][pos]
+            stale = epochs[group_block] != epoch
+            if stale.any():
+                # A new period landed on this bucket: restart the affected (group, slot) cells from this sample
+                stale = stale[group_of_row]
+                mins[block] = np.where(stale, samples, np.minimum(mins[block], samples))
+                maxs[block] = np.where(stale, samples, np.maximum(maxs[block], samples))
+                sums[block] = np.where(stale, samples, sums[block] + samples)
+                counts[block] = np.where(stale, 1, counts[block] + 1)
+                epochs[group_block] = epoch
+            else:
+                mins[block] = np.minimum(mins[block], samples)
+                maxs[block] = np.maximum(maxs[block], samples)
+                sums[block] += samples
+                counts[block] += 1
+
+    def clear(self, slot: int):
+        if slot < self.capacity:
+            for level in range(len(ROLLUP_LEVELS)):
+                self.epochs[level][:, :, slot] = -1
+
+    @staticmethod
+    def covers(level: int, start: float, now: float) -> bool:
+        """Whether the level's ring still holds the bucket containing start."""
+        _, width, buckets = ROLLUP_LEVELS[level]
+        return start // width > now // width - buckets
+
+    def level_for(self, start: float, now: float) -> int:
+        """Finest level that still holds every whole bucket after start (the coarsest one if none does)."""
+        for level, (_, width, buckets) in enumerate(ROLLUP_LEVELS):
+            if math.ceil(start / width) > now // width - buckets:
+                return level
+        return len(ROLLUP_LEVELS) - 1
+
+    def buckets(self, level: int, slot: int, kpi: KpiSpec, start: float, end: float) -> List[Tuple[int, float, float, float, int]]:
+        """Chronological (epoch, min, max, sum, count) of the buckets overlapping [start, end]."""
+        width = ROLLUP_LEVELS[level][1]
+        return self._epochs(level, slot, kpi, int(start // width), int(end // width))
+
+    def _epochs(self, level: int, slot: int, kpi: KpiSpec, first: int, last: int) -> List[Tuple[int, float, float, float, int]]:
+        buckets = ROLLUP_LEVELS[level][2]
+        if slot >= self.capacity:
+            return []
+        out = []
+        for epoch in range(max(first, last - buckets + 1), last + 1):
+            pos = epoch % buckets
+            count = int(self.counts[level][pos, kpi.index, slot])
+            if self.epochs[level][pos, kpi.group, slot] == epoch and count:
+                out.append((epoch, float(self.mins[level][pos, kpi.index, slot]), float(self.maxs[level][pos, kpi.index, slot]),
+                            float(self.sums[level][pos, kpi.index, slot]), count))
+        return out
+
+    def summary(self, slot: int, kpi: KpiSpec, start: float, end: float, now: float) -> Optional[Tuple[float, float, float, int]]:
+        """(min, max, sum, count) over [start, end]: whole coarse buckets inside the window, edges from finer levels.
+
+        Only an edge that no finer level still holds (or that is finer than a minute) counts its whole bucket.
+        """
+        parts: List[Tuple[int, float, float, float, int]] = []
+
+        def whole(level: int, lo: float, hi: float):
+            width = ROLLUP_LEVELS[level][1]
+            first = math.floor(lo / width)  # hi is exclusive: it may be where a coarser bucket takes over
+            parts.extend(self._epochs(level, slot, kpi, first, max(first, math.ceil(hi / width) - 1)))
+
+        def edge(level: int, lo: float, hi: float):
+            if level > 0 and self.covers(level - 1, lo, now):
+                walk(level - 1, lo, hi)
+            else:
+                whole(level, lo, hi)
+
+        def walk(level: int, lo: float, hi: float):
+            width = ROLLUP_LEVELS[level][1]
+            first, last = math.ceil(lo / width), math.floor(hi / width)  # epochs [first, last) lie fully inside
+            if level == 0 or first >= last:
+                edge(level, lo, hi) if level else whole(level, lo, hi)
+                return
+            parts.extend(self._epochs(level, slot, kpi, first, last - 1))
+            if lo < first * width:
+                edge(level, lo, first * width)
+            if last * width < hi:
+                edge(level, last * width, hi)
+
+        walk(len(ROLLUP_LEVELS) - 1, start, end)
+        if not parts:
+            return None
+        return min(p[1] for p in parts), max(p[2] for p in parts), sum(p[3] for p in parts), sum(p[4] for p in parts)
+
+ROLLUPS = RollupStore()
+
+# ------------------------------------------------------------
+# Statistical process control: running stats and Western Electric rules per (numeric KPI, conveyor)
+# - Every sample updates count/mean/M2 (Welford), an EWMA and six 8-bit run
+#   registers (beyond 0/1/2 sigma on either side) in place: O(1), no history rescans
+# - Points are judged against the limits from the samples before them, once
+#   SPC_MIN_SAMPLES are in (center = running mean, limits = mean +/- 3 sigma)
+# - Rules: we1 one point beyond 3 sigma; we2 2 of 3 beyond 2 sigma; we3 4 of 5 beyond
+#   1 sigma; we4 8 in a row on one side (we2-we4 same side, current point included);
+#   ewma the EWMA beyond its asymptotic +/- SPC_EWMA_L limits
+# - State is kept per conveyor id, not slot, so a status change (e.g. to faulty)
+#   is judged against the conveyor's earlier behaviour; removal clears it
+# - An event is queued when a rule starts firing; the broadcast tick sends them to /ws/spc
+# ------------------------------------------------------------
+SPC_MIN_SAMPLES = 20
+SPC_EWMA_LAMBDA = 0.2
+SPC_EWMA_L = 3.0
+SPC_MAX_PENDING_EVENTS = 10000
+SPC_RULES: Tuple[Tuple[str, str], ...] = (
+    ("we1", "one point beyond 3 sigma"),
+    ("we2", "2 of 3 consecutive points beyond 2 sigma on the same side"),
+    ("we3", "4 of 5 consecutive points beyond 1 sigma on the same side"),
+    ("we4", "8 consecutive points on the same side of the center line"),
+    ("ewma", f"EWMA (lambda {SPC_EWMA_LAMBDA}) beyond its {SPC_EWMA_L} sigma limits"),
+)
+
+SPC_KPIS: List[KpiSpec] = [k for k in KPI_SPECS if k.kind in ("float", "int")]
+_SPC_ROW: Dict[int, int] = {k.index: row for row, k in enumerate(SPC_KPIS)}
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_EWMA_WIDTH = SPC_EWMA_L * math.sqrt(SPC_EWMA_LAMBDA / (2 - SPC_EWMA_LAMBDA))
+
+def _spc_value(kpi: KpiSpec, value: float) -> Union[int, float]:
+    return int(value) if kpi.kind == "int" else round(float(value), kpi.decimals)
+
+class SpcStore:
+    """Running SPC state laid out [kpi, column], one column per conveyor id."""
+
+    def __init__(self, capacity: int = 64):
+        self._columns: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._lock = threading.Lock()
+        self._cached: Tuple[Optional[List[int]], Optional[np.ndarray]] = (None, None)
+        self.capacity = 0
+        rows = len(SPC_KPIS)
+        self.count = np.zeros((rows, 0), dtype=np.int64)
+        self.mean = np.zeros((rows, 0))
+        self.m2 = np.zeros((rows, 0))
+        self.ewma = np.zeros((rows, 0))
+        self.last = np.zeros((rows, 0))
+        self.runs = np.zeros((6, rows, 0), dtype=np.uint8)  # beyond +0/+1/+2 sigma, then -0/-1/-2
+        self.flags = np.zeros((rows, 0), dtype=np.uint8)    # rules firing on the latest point, bit per SPC_RULES
+        self.violations = np.zeros((rows, 0), dtype=np.int64)
+        self._ensure_capacity(capacity)
+        self.events: deque = deque(maxlen=SPC_MAX_PENDING_EVENTS)
+        self.event_seq = 0
+
+    def _ensure_capacity(self, capacity: int):
+        if capacity <= self.capacity:
+            return
+        for name in ("count", "mean", "m2", "ewma", "last", "runs", "flags", "violations"):
+            array = getattr(self, name)
+            grown = np.zeros(array.shape[:-1] + (capacity,), dtype=array.dtype)
+            grown[..., :self.capacity] = array
+            setattr(self, name, grown)
+        self.capacity = capacity
+
+    def columns(self, conveyor_ids: List[int]) -> np.ndarray:
+        """Column per conveyor, allocating (zeroed) on first sight. Fleet-wide lists are cached by identity."""
+        cached_ids, cached_columns = self._cached
+        if conveyor_ids is cached_ids:
+            return cached_columns
+        if any(cid not in self._columns for cid in conveyor_ids):
+            with self._lock:
+                for cid in conveyor_ids:
+                    if cid in self._columns:
+                        continue
+                    column = self._free.pop() if self._free else len(self._columns)
+                    if column >= self.capacity:
+                        self._ensure_capacity(max(column + 1, self.capacity * 2))
+                    self._reset(column)
+                    self._columns[cid] = column
+        columns = np.fromiter((self._columns[cid] for cid in conveyor_ids), dtype=np.intp, count=len(conveyor_ids))
+        if len(conveyor_ids) > 1:
+            self._cached = (conveyor_ids, columns)
+        return columns
+
+    def _reset(self, column: int):
+        for name in ("count", "mean", "m2", "ewma", "last", "runs", "flags", "violations"):
+            getattr(self, name)[..., column] = 0
+
+    def forget(self, conveyor_id: int):
+        with self._lock:
+            column = self._columns.pop(conveyor_id, None)
+            if column is not None:
+                self._free.append(column)
+                self._cached = (None, None)
+
+    def record(self, kpis: List[KpiSpec], conveyor_ids: List[int], samples: np.ndarray, now: float):
+        """Judge samples[i, j] (KPI kpis[i], conveyor conveyor_ids[j]) against the limits so far, then fold them in."""
+        picked = [i for i, k in enumerate(kpis) if k.index in _SPC_ROW]
+        if not picked or not conveyor_ids:
+            return
+        rows = np.fromiter((_SPC_ROW[kpis[i].index] for i in picked), dtype=np.intp, count=len(picked))
+        columns = self.columns(conveyor_ids)
+        row_index, column_index = _contiguous(rows), _contiguous(columns)
+        # Views for the usual whole-group, whole-fleet block; fancy indexing otherwise
+        if isinstance(row_index, slice) and isinstance(column_index, slice):
+            block = (row_index, column_index)
+        else:
+            block = np.ix_(rows, columns)
+        x = samples[picked] if len(picked) < len(kpis) else samples
+        count, mean, m2 = self.count[block], self.mean[block], self.m2[block]
+        sigma = np.sqrt(np.divide(m2, count - 1, out=np.zeros_like(m2), where=count > 1))
+        live = (count >= SPC_MIN_SAMPLES) & (sigma > 0)
+        z = np.divide(x - mean, sigma, out=np.zeros_like(x), where=live)
+        beyond = np.stack([z > 0, z > 1, z > 2, z < 0, z < -1, z < -2]) & live
+        runs = (self.runs[(slice(None),) + block] << 1) | beyond
+        ewma = np.where(count == 0, x, SPC_EWMA_LAMBDA * x + (1 - SPC_EWMA_LAMBDA) * self.ewma[block])
+        fired = [
+            live & (np.abs(z) > 3),
+            (beyond[2] & (_POPCOUNT[runs[2] & 0b111] >= 2)) | (beyond[5] & (_POPCOUNT[runs[5] & 0b111] >= 2)),
+            (beyond[1] & (_POPCOUNT[runs[1] & 0b11111] >= 4)) | (beyond[4] & (_POPCOUNT[runs[4] & 0b11111] >= 4)),
+            (runs[0] == 0xFF) | (runs[3] == 0xFF),
+            live & (np.abs(ewma - mean) > _EWMA_WIDTH * sigma),
+        ]
+        flags = np.zeros(x.shape, dtype=np.uint8)
+        for bit, rule in enumerate(fired):
+            flags |= rule.astype(np.uint8) << bit
+        onset = flags & ~self.flags[block]
+        if onset.any():
+            self._queue_events(rows, conveyor_ids, onset, x, mean, sigma, ewma, now)
+            self.violations[block] += onset != 0
+        # Welford update
+        count = count + 1
+        delta = x - mean
+        mean = mean + delta / count
+        self.count[block], self.mean[block], self.m2[block] = count, mean, m2 + delta * (x - mean)
+        self.ewma[block], self.last[block], self.flags[block] = ewma, x, flags
+        self.runs[(slice(None),) + block] = runs
+
+    def _queue_events(self, rows: np.ndarray, conveyor_ids: List[int], onset: np.ndarray, x: np.ndarray,
+                      mean: np.ndarray, sigma: np.ndarray, ewma: np.ndarray, now: float):
+        at = datetime.fromtimestamp(now).isoformat()
+        for i, j in zip(*np.nonzero(onset)):
+            k = SPC_KPIS[rows[i]]
+            rules = [name for bit, (name, _) in enumerate(SPC_RULES) if onset[i, j] >> bit & 1]
+            for rule in rules:
+                METRICS.spc_violations[rule] = METRICS.spc_violations.get(rule, 0) + 1
+            self.event_seq += 1
+            center, spread = float(mean[i, j]), 3 * float(sigma[i, j])
+            self.events.append({
+                "seq": self.event_seq, "time": at, "conveyor_id": conveyor_ids[j], "category": k.category,
+                "kpi": ".".join(k.path), "rules": rules, "value": _spc_value(k, x[i, j]), "center": round(center, 4),
+                "ucl": round(center + spread, 4), "lcl": round(center - spread, 4), "ewma": round(float(ewma[i, j]), 4),
+            })
+
+    def drain(self) -> List[Dict[str, Any]]:
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+    def report(self, conveyor_id: int, kpis: List[KpiSpec]) -> Dict[str, Dict[str, Any]]:
+        """Current stats, limits and firing rules per KPI, nested by category."""
+        column = self._columns.get(conveyor_id)
+        out: Dict[str, Dict[str, Any]] = {}
+        for k in kpis:
+            row = _SPC_ROW.get(k.index)
+            if row is None:
+                continue
+            n = int(self.count[row, column]) if column is not None else 0
+            entry: Dict[str, Any] = {"n": n}
+            if n:
+                mean = float(self.mean[row, column])
+                sigma = math.sqrt(self.m2[row, column] / (n - 1)) if n > 1 else 0.0
+                flags = int(self.flags[row, column])
+                entry.update({
+                    "last": _spc_value(k, self.last[row, column]), "mean": round(mean, 4), "std": round(sigma, 4),
+                    "ucl": round(mean + 3 * sigma, 4), "lcl": round(mean - 3 * sigma, 4),
+                    "ewma": round(float(self.ewma[row, column]), 4),
+                    "ewma_ucl": round(mean + _EWMA_WIDTH * sigma, 4), "ewma_lcl": round(mean - _EWMA_WIDTH * sigma, 4),
+                    "judged": n > SPC_MIN_SAMPLES, "in_control": not flags,
+                    "rules": [name for bit, (name, _) in enumerate(SPC_RULES) if flags >> bit & 1],
+                    "violations": int(self.violations[row, column]),
+                })
+            out.setdefault(k.category, {})[".".join(k.path)] = entry
+        return out
+
+SPC = SpcStore()
+
+# ------------------------------------------------------------
+# Conveyor registry
+# - Default fleet: 1-3 operational, 4 faulty, 5 non-operational
+# - SIMULATED_CONVEYORS_FILE may point to JSON like
+#   {"conveyors": [{"id": 1, "status": "operational"}, ...]}
+# - Runtime changes via the /conveyors admin routes
+# - A checkpoint brings back the fleet it was saved with, unless the fleet
+#   file has changed since; then the file wins
+# ------------------------------------------------------------
+DEFAULT_CONVEYORS: Dict[int, str] = {1: "operational", 2: "operational", 3: "operational", 4: "faulty", 5: "non-operational"}
+
+class ConveyorRegistry:
+    """Conveyor id -> status with O(1) lookup and a cached, sorted id list for fleet-wide passes."""
+
+    def __init__(self, conveyors: Dict[int, str]):
+        self.replace(conveyors)
+
+    @staticmethod
+    def validate(conveyor_id: int, status: str):
+        if conveyor_id < 1:
+            raise ValueError(f"Conveyor ID must be >= 1, got {conveyor_id}")
+        if status not in _STATUS_INDEX:
+            raise ValueError(f"Status must be one of: {', '.join(STATUSES)}")
+
+    def replace(self, conveyors: Dict[int, str]):
+        for cid, status in conveyors.items():
+            self.validate(cid, status)
+        self._statuses = dict(conveyors)
+        self._refresh()
+
+    def _refresh(self):
+        # Rebuilt on change only; readers always see a complete list/array pair
+        self.revision = getattr(self, "revision", 0) + 1
+        ids = sorted(self._statuses)
+        status_idx = np.fromiter((_STATUS_INDEX[self._statuses[cid]] for cid in ids), dtype=np.intp, count=len(ids))
+        self._fleet = (ids, status_idx)
+
+    def __contains__(self, conveyor_id: int) -> bool:
+        return conveyor_id in self._statuses
+
+    def __len__(self) -> int:
+        return len(self._statuses)
+
+    def ids(self) -> List[int]:
+        return self._fleet[0]
+
+    def status(self, conveyor_id: int) -> str:
+        return self._statuses[conveyor_id]
+
+    def status_indices(self, conveyor_ids: List[int]) -> np.ndarray:
+        ids, status_idx = self._fleet
+        if conveyor_ids is ids:
+            return status_idx
+        statuses = self._statuses
+        return np.fromiter((_STATUS_INDEX[statuses[cid]] for cid in conveyor_ids), dtype=np.intp, count=len(conveyor_ids))
+
+    def set(self, conveyor_id: int, status: str):
+        self.validate(conveyor_id, status)
+        self._statuses[conveyor_id] = status
+        self._refresh()
+
+    def remove(self, conveyor_id: int):
+        del self._statuses[conveyor_id]
+        self._refresh()
+
+    def as_list(self) -> List[Dict[str, Any]]:
+        return [{"id": cid, "status": self._statuses[cid]} for cid in self._fleet[0]]
+
+def _load_conveyors() -> Dict[int, str]:
+    path = os.environ.get("SIMULATED_CONVEYORS_FILE")
+    if not path:
+        return dict(DEFAULT_CONVEYORS)
+    with open(path) as f:
+        config = json.load(f)
+    return {int(item["id"]): item.get("status", "operational") for item in config["conveyors"]}
+
+def _fleet_digest(conveyors: Dict[int, str]) -> int:
+    return zlib.crc32(json.dumps(sorted(conveyors.items())).encode())
+
+_configured_fleet = _load_conveyors()
+registry = ConveyorRegistry(_configured_fleet)
+# Fingerprint of the fleet file; a checkpoint only restores its own fleet while this still matches
+FLEET_FILE_DIGEST = _fleet_digest(_configured_fleet) if os.environ.get("SIMULATED_CONVEYORS_FILE") else None
+
 def _conveyor_status(conveyor_id: int) -> str:
-    if conveyor_id == 5:
-        return "non-operational"
-    if conveyor_id == 4:
-        return "faulty"
-    return "operational"
+    return registry.status(conveyor_id)
+
+def _forget_conveyor_state(conveyor_id: int):
+    slot = STATE.slot_of(conveyor_id)
+    if slot is not None:
+        HISTORY.clear(slot)
+        ROLLUPS.clear(slot)
+    with _state_write():
+        STATE.forget(conveyor_id)
+        if slot is not None and shared_state is not None:
+            shared_state.release_slot(slot)
 
 # ------------------------------------------------------------
-# Generators with lazy/timed updates
+# Batch engine: one uniform draw per tick covers every KPI of every conveyor
 # ------------------------------------------------------------
-def _gen_overall_temperature(conveyor_id: int, status: str) -> float:
-    if status == "non-operational":
-        low, high = 0, 0
-    elif status == "faulty":
-        low, high = 30, 45
-    else:
-        low, high = 20, 26
-    prev = _get_value(conveyor_id, "overall_facility", "temperature")
-    if prev is None:
-        newv = round(random.uniform(low, high), 1)
-    else:
-        drift = random.uniform(-0.4, 0.4)
-        newv = round(min(max(prev + drift, low), high), 1)
-    return newv
-
-def _gen_overall_humidity(conveyor_id: int, status: str) -> float:
-    if status == "non-operational":
-        low, high = 0, 0
-    elif status == "faulty":
-        low, high = 75, 95
-    else:
-        low, high = 40, 60
-    prev = _get_value(conveyor_id, "overall_facility", "humidity")
-    if prev is None:
-        base = round(random.uniform(low, high), 1)
-    else:
-        base = prev + random.uniform(-1.0, 1.0)
-    return round(min(max(base, low), high), 1)
-
-def _gen_overall_warnings(conveyor_id: int, status: str) -> int:
-    if status == "non-operational":
-        return 0
-    elif status == "faulty":
-        return random.randint(5, 10)
-    else:
-        return random.randint(0, 3)
-
-def _gen_overall_personal(conveyor_id: int, status: str) -> Dict[str, Any]:
-    if status == "non-operational":
-        return {"personnel_present": 0, "shift_efficiency": 0, "safety_incidents": 0}
-    elif status == "faulty":
-        return {
-            "personnel_present": random.randint(2, 5),
-            "shift_efficiency": round(random.uniform(40, 65), 1),
-            "safety_incidents": random.randint(1, 3)
-        }
-    else:
-        return {
-            "personnel_present": random.randint(10, 50),
-            "shift_efficiency": round(random.uniform(80, 95), 1),
-            "safety_incidents": random.randint(0, 1)
-        }
+def _draw(kpis: List[KpiSpec], status_idx: np.ndarray) -> np.ndarray:
+    """Raw values for the given KPIs, shape (len(kpis), n_conveyors)."""
+    rows = np.fromiter((k.index for k in kpis), dtype=np.intp, count=len(kpis))
+    low = _LOW[rows][:, status_idx]
+    u = _rng.random((len(kpis), len(status_idx)))
+    # float/int/choice share low + u * (high - low); choice rows have low == 0, high == n_options
+    values = low + u * (_HIGH[rows][:, status_idx] - low)
+    floored = [i for i, k in enumerate(kpis) if k.kind in ("int", "choice")]
+    if floored:
+        values[floored] = np.floor(values[floored])
+    flags = [i for i, k in enumerate(kpis) if k.kind == "bool"]
+    if flags:
+        values[flags] = u[flags] < low[flags]
+    for decimals in {k.decimals for k in kpis if k.kind == "float"}:
+        picked = [i for i, k in enumerate(kpis) if k.kind == "float" and k.decimals == decimals]
+        values[picked] = np.round(values[picked], decimals)
+    return values
 
-def simulate_overall_facility_data(conveyor_id: int) -> Dict[str, Any]:
-    status = _conveyor_status(conveyor_id)
-
-    # temperature (30s cadence)
-    if _should_update(conveyor_id, "overall_facility", "temperature"):
-        _set_state(conveyor_id, "overall_facility", "temperature", _gen_overall_temperature(conveyor_id, status))
-    temperature = _get_value(conveyor_id, "overall_facility", "temperature")
-
-    # humidity (10m cadence)
-    if _should_update(conveyor_id, "overall_facility", "humidity"):
-        _set_state(conveyor_id, "overall_facility", "humidity", _gen_overall_humidity(conveyor_id, status))
-    humidity = _get_value(conveyor_id, "overall_facility", "humidity")
-
-    # warnings (20m cadence)
-    if _should_update(conveyor_id, "overall_facility", "warnings_notifications"):
-        _set_state(conveyor_id, "overall_facility", "warnings_notifications", _gen_overall_warnings(conveyor_id, status))
-    warnings_notifications = _get_value(conveyor_id, "overall_facility", "warnings_notifications")
-
-    # personal data (8h cadence)
-    if _should_update(conveyor_id, "overall_facility", "personal_data"):
-        _set_state(conveyor_id, "overall_facility", "personal_data", _gen_overall_personal(conveyor_id, status))
-    personal_data = _get_value(conveyor_id, "overall_facility", "personal_data")
-
-    # Legacy behavior for the rest (you can add cadences later).
-    if status == "non-operational":
-        air_quality = 0
-        power_usage = {"current_kw": 0, "daily_usage": 0, "efficiency_rating": 0}
-        co2_emissions = {"current_level": 0, "daily_average": 0, "target_compliance": 0}
-    elif status == "faulty":
-        air_quality = round(random.uniform(60, 75), 1)
-        power_usage = {
-            "current_kw": round(random.uniform(2500, 4000), 2),
-            "daily_usage": round(random.uniform(45000, 60000), 2),
-            "efficiency_rating": round(random.uniform(40, 65), 1),
-        }
-        co2_emissions = {
-            "current_level": round(random.uniform(1500, 2500), 2),
-            "daily_average": round(random.uniform(1200, 2000), 2),
-            "target_compliance": round(random.uniform(40, 70), 1),
-        }
+def _to_columns(kpis: List[KpiSpec], values: np.ndarray, status_idx: np.ndarray) -> Dict[int, List[Any]]:
+    """Convert drawn arrays to per-KPI Python lists (the serialization edge)."""
+    columns: Dict[int, List[Any]] = {}
+    for kind, convert in (("float", None), ("int", np.int64), ("bool", bool)):
+        picked = [i for i, k in enumerate(kpis) if k.kind == kind]
+        if not picked:
+            continue
+        block = values[picked] if convert is None else values[picked].astype(convert)
+        for i, col in zip(picked, block.tolist()):
+            columns[kpis[i].index] = col
+    statuses = status_idx.tolist()
+    for i, k in enumerate(kpis):
+        if k.kind == "choice":
+            columns[k.index] = [k.bounds[s][c] for s, c in zip(statuses, values[i].astype(np.int64).tolist())]
+    return columns
+
+def _contiguous(index: np.ndarray):
+    """A slice when the index is a consecutive run (the common full-fleet case), so numpy can copy blocks."""
+    if len(index) and index[-1] - index[0] == len(index) - 1 and (len(index) < 2 or (np.diff(index) == 1).all()):
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+def generate(kpis: List[KpiSpec], conveyor_ids: List[int], now: Optional[float] = None):
+    """Draw fresh values for the given KPIs (drifting where configured) and store them."""
+    if not kpis or not conveyor_ids:
+        return
+    with _state_write():
+        _generate(kpis, conveyor_ids, now)
+
+def _generate(kpis: List[KpiSpec], conveyor_ids: List[int], now: Optional[float]):
+    started = perf_counter()
+    now = clock.now() if now is None else now
+    status_idx = registry.status_indices(conveyor_ids)
+    slots = STATE.slots(conveyor_ids)
+    values = _draw(kpis, status_idx)
+    slot_index = _contiguous(slots)
+    for i, k in enumerate(kpis):
+        if k.drift is None:
+            continue
+        prev = STATE.values[k.index, slot_index]
+        drifting = ~np.isnan(prev)
+        if drifting.any():
+            sidx = status_idx[drifting]
+            moved = prev[drifting] + _rng.uniform(-k.drift, k.drift, int(drifting.sum()))
+            values[i, drifting] = np.round(np.clip(moved, _LOW[k.index, sidx], _HIGH[k.index, sidx]), k.decimals)
+    store(kpis, conveyor_ids, values, now)
+    if recorder is not None:
+        recorder.append(kpis, conveyor_ids, values, now)
+    METRICS.kpi_regenerations[[k.index for k in kpis]] += len(conveyor_ids)
+    METRICS.stages["generate"].observe(perf_counter() - started)
+
+def store(kpis: List[KpiSpec], conveyor_ids: List[int], values: np.ndarray, now: float):
+    """Write a (len(kpis), len(conveyor_ids)) block of values: state, stamps, history, rollups, versions."""
+    with _state_write():
+        _store(kpis, conveyor_ids, values, now)
+
+# Guards STATE and the registry in the process that writes them: threadpool routes read and fill in
+# conveyors (_ensure_generated) while the event loop runs the scheduler and the admin routes
+_state_lock = threading.RLock()
+
+def _state_write():
+    return shared_state.write() if shared_state is not None else _state_lock
+
+def _store(kpis: List[KpiSpec], conveyor_ids: List[int], values: np.ndarray, now: float):
+    slots = STATE.slots(conveyor_ids)
+    rows = np.fromiter((k.index for k in kpis), dtype=np.intp, count=len(kpis))
+    row_index, slot_index = _contiguous(rows), _contiguous(slots)
+    contiguous = isinstance(row_index, slice) and isinstance(slot_index, slice)
+    old = STATE.values[row_index, slot_index] if contiguous else STATE.values[np.ix_(rows, slots)]
+    changed = values != old  # NaN (never generated) always counts as changed
+    if contiguous:
+        STATE.values[row_index, slot_index] = values
     else:
-        air_quality = round(random.uniform(85, 99), 1)
-        power_usage = {
-            "current_kw": round(random.uniform(500, 2000), 2),
-            "daily_usage": round(random.uniform(10000, 40000), 2),
-            "efficiency_rating": round(random.uniform(75, 90), 1),
-        }
-        co2_emissions = {
-            "current_level": round(random.uniform(400, 1200), 2),
-            "daily_average": round(random.uniform(500, 900), 2),
-            "target_compliance": round(random.uniform(85, 99), 1),
-        }
+        STATE.values[np.ix_(rows, slots)] = values
+    groups: Dict[int, List[int]] = {}
+    for i, k in enumerate(kpis):
+        groups.setdefault(k.group, []).append(i)
+    STATE.stamps[np.ix_(list(groups), slots)] = now
+    HISTORY.record(rows, groups, slots, values, now)
+    ROLLUPS.record(rows, slots, values, now)
+    SPC.record(kpis, conveyor_ids, values, now)
+    STATE.mark_generated(slots)
+    _bump_versions(kpis, slots, changed)
 
-    return {
-        "temperature": temperature,
-        "humidity": humidity,
-        "air_quality": air_quality,
-        "warnings_notifications": warnings_notifications,
-        "personal_data": personal_data,
-        "power_usage": power_usage,
-        "co2_emissions": co2_emissions,
+def _bump_versions(kpis: List[KpiSpec], slots: np.ndarray, changed: np.ndarray):
+    """Advance the facility version and stamp it on every conveyor/category slice whose values moved."""
+    changed_slots = changed.any(axis=0)
+    if not changed_slots.any():
+        return
+    STATE.version += 1
+    version = STATE.version
+    STATE.conveyor_versions[slots[changed_slots]] = version
+    by_category: Dict[int, List[int]] = {}
+    for i, k in enumerate(kpis):
+        by_category.setdefault(CATEGORY_INDEX[k.category], []).append(i)
+    for cat, positions in by_category.items():
+        moved = changed[positions].any(axis=0)
+        STATE.category_versions[cat, slots[moved]] = version
+
+def _ensure_generated(conveyor_ids: List[int]):
+    # Conveyors without a full draw yet (just added, or no scheduler running) get every KPI at once
+    if shared_state is not None and not shared_state.writer:
+        return
+    missing = STATE.missing(conveyor_ids)
+    if missing:
+        generate(KPI_SPECS, missing)
+
+def _read(kpis: List[KpiSpec], conveyor_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Current values (kpi x conveyor) and the status index of each conveyor."""
+    rows = np.fromiter((k.index for k in kpis), dtype=np.intp, count=len(kpis))
+    if shared_state is not None and not shared_state.writer:
+        return shared_state.read_values(rows, conveyor_ids)
+    with _state_lock:
+        for conveyor_id in conveyor_ids:
+            _require_conveyor(conveyor_id)  # removed since the route listed it
+        _ensure_generated(conveyor_ids)  # or its status changed, which clears its values
+        slots = STATE.slots(conveyor_ids)
+        row_index, slot_index = _contiguous(rows), _contiguous(slots)
+        if isinstance(row_index, slice) and isinstance(slot_index, slice):
+            values = STATE.values[row_index, slot_index].copy()
+        else:
+            values = STATE.values[np.ix_(rows, slots)]
+        return values, registry.status_indices(conveyor_ids)
+
+# ------------------------------------------------------------
+# Scheduler: min-heap of (next_due, group). The background loop pops due
+# groups and regenerates them for the whole fleet in one draw.
+# ------------------------------------------------------------
+def _group_interval(group: int) -> float:
+    interval = _get_interval(*KPI_GROUPS[group])
+    if interval is None:
+        return DEFAULT_UPDATE_INTERVAL
+    return max(interval, MIN_UPDATE_INTERVAL)
+
+class KpiScheduler:
+    """Keeps every cadence group keyed by its next due time; stale heap entries are skipped lazily."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, int]] = []
+        self._version = [0] * len(KPI_GROUPS)
+        self._lock = threading.Lock()
+        self._step_lock = asyncio.Lock()  # concurrent /clock/step calls run one after the other
+
+    def schedule(self, group: int, due: float):
+        with self._lock:
+            self._version[group] += 1
+            heapq.heappush(self._heap, (due, self._version[group], group))
+
+    def start(self, now: float):
+        """Generate conveyors that have no state yet and queue each group at its own cadence.
+
+        After a checkpoint restore, groups resume from their saved stamps; overdue ones run at once.
+        """
+        ids = registry.ids()
+        _ensure_generated(ids)
+        slots = STATE.slots(ids)
+        for group in range(len(KPI_GROUPS)):
+            last = float(STATE.stamps[group, slots].min()) if len(slots) else now
+            self.schedule(group, last + _group_interval(group))
+
+    def pop_due(self, now: float) -> List[int]:
+        due: List[int] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, version, group = heapq.heappop(self._heap)
+                if version == self._version[group]:
+                    due.append(group)
+        return due
+
+    def run_due(self, now: float) -> List[int]:
+        groups = self.pop_due(now)
+        if groups:
+            wanted = set(groups)
+            ids = registry.ids()
+            _ensure_generated(ids)  # conveyors added since the last pass need every group, not just the due ones
+            generate([k for k in KPI_SPECS if k.group in wanted], ids, now)
+            for group in groups:
+                self.schedule(group, now + _group_interval(group))
+        return groups
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._heap[0][1] != self._version[self._heap[0][2]]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    async def advance(self, seconds: float) -> int:
+        """Step the (manual) clock forward, running each due event at its own simulated time.
+
+        Yields to the event loop between events, so a long step doesn't freeze other connections.
+        """
+        async with self._step_lock:
+            target = clock.now() + seconds
+            runs = 0
+            while True:
+                due = self.next_due()
+                if due is None or due > target:
+                    break
+                clock.set(due)
+                runs += len(self.run_due(clock.now()))
+                await asyncio.sleep(0)
+            clock.set(target)
+            return runs
+
+scheduler = KpiScheduler()
+SCHEDULER_MAX_SLEEP = 1.0  # upper bound on idle sleep so rule changes are picked up quickly
+
+async def _scheduler_loop():
+    scheduler.start(clock.now())
+    while True:
+        try:
+            scheduler.run_due(clock.now())
+        except Exception as e:
+            print(f"KPI scheduler tick failed: {e}")
+        next_due = scheduler.next_due()
+        delay = None if next_due is None else clock.wall_delay(next_due - clock.now())
+        await asyncio.sleep(SCHEDULER_MAX_SLEEP if delay is None else min(delay, SCHEDULER_MAX_SLEEP))
+
+# ------------------------------------------------------------
+# Checkpoints: KPI arrays, versions, rules, fleet, pause flag and clock mode in one .npz file
+# - Array copies are taken on the event loop (block memcpy); the file is written in
+#   a worker thread to a temp file and swapped in with os.replace, so it is never torn
+# - Written every CHECKPOINT_INTERVAL_SECONDS when something changed, and on shutdown
+# - SIMULATED_CHECKPOINT_FILE="" disables checkpoints; history and rollups are not saved
+# ------------------------------------------------------------
+CHECKPOINT_PATH = os.environ.get("SIMULATED_CHECKPOINT_FILE", "simulated_checkpoint.npz")
+CHECKPOINT_INTERVAL_SECONDS = 30
+CHECKPOINT_FORMAT = 1
+_KPI_LAYOUT = [f"{k.category}/{'.'.join(k.path)}" for k in KPI_SPECS]
+_last_checkpoint: Optional[Tuple] = None
+
+def _checkpoint_signature() -> Tuple:
+    return (STATE.version, paused, json.dumps(UPDATE_RULES, sort_keys=True), clock.warp, clock.manual)
+
+def _capture_checkpoint() -> Dict[str, np.ndarray]:
+    arrays = STATE.export()
+    arrays["meta"] = np.array(json.dumps({
+        "format": CHECKPOINT_FORMAT,
+        "saved_at": time(),
+        "clock": clock.now(),
+        "clock_warp": clock.warp,
+        "clock_manual": clock.manual,
+        "version": STATE.version,
+        "paused": paused,
+        "rules": UPDATE_RULES,
+        "conveyors": registry.as_list(),
+        "fleet_file": FLEET_FILE_DIGEST,
+        "kpis": _KPI_LAYOUT,
+    }))
+    return arrays
+
+def _write_checkpoint(path: str, arrays: Dict[str, np.ndarray]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+async def save_checkpoint(force: bool = False):
+    global _last_checkpoint
+    if not CHECKPOINT_PATH:
+        return
+    signature = _checkpoint_signature()
+    if signature == _last_checkpoint and not force:
+        return
+    await asyncio.to_thread(_write_checkpoint, CHECKPOINT_PATH, _capture_checkpoint())
+    _last_checkpoint = signature
+
+def restore_checkpoint() -> bool:
+    """Load the checkpoint if present and compatible; the service starts cold otherwise."""
+    global paused, _last_checkpoint
+    if not CHECKPOINT_PATH or not os.path.exists(CHECKPOINT_PATH):
+        return False
+    try:
+        with np.load(CHECKPOINT_PATH) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format") != CHECKPOINT_FORMAT or meta.get("kpis") != _KPI_LAYOUT:
+                print(f"Ignoring checkpoint {CHECKPOINT_PATH}: incompatible KPI layout")
+                return False
+            arrays = {name: data[name] for name in data.files if name != "meta"}
+        saved = {c["id"]: c["status"] for c in meta["conveyors"]}
+        if FLEET_FILE_DIGEST is None or meta.get("fleet_file") == FLEET_FILE_DIGEST:
+            registry.replace(saved)
+        else:
+            print("SIMULATED_CONVEYORS_FILE changed since the checkpoint; keeping the file's fleet")
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring checkpoint {CHECKPOINT_PATH}: {e}")
+        return False
+    STATE.restore(arrays, meta["version"])
+    for cid in STATE.conveyor_ids():
+        if (registry.status(cid) if cid in registry else None) != saved.get(cid):
+            STATE.forget(cid)  # dropped or re-statused by the fleet file: regenerate rather than resume
+    for category, fields in meta["rules"].items():
+        UPDATE_RULES.setdefault(category, {}).update(fields)
+    paused = meta["paused"]
+    # Stamps are simulated times: continue from the saved clock plus the downtime (none while stepped by hand)
+    manual = meta.get("clock_manual", False)
+    clock.configure(warp=meta.get("clock_warp", clock.warp), manual=manual)
+    clock.set(meta.get("clock", meta["saved_at"]) + (0 if manual else time() - meta["saved_at"]))
+    response_cache.clear()
+    _last_checkpoint = _checkpoint_signature()
+    return True
+
+async def _checkpoint_loop():
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL_SECONDS)
+        try:
+            await save_checkpoint()
+        except Exception as e:
+            print(f"Checkpoint failed: {e}")
+
+# ------------------------------------------------------------
+# Record / replay
+# - SIMULATED_RECORD_FILE: every generated block is appended as fixed-size records
+#   (timestamp f8, conveyor u4, KPI id u2, value f4) after a JSON header with the
+#   seed, the KPI layout and the fleet at the time recording started
+# - Each recording run (new file, append, or after a checkpoint restore) starts with a
+#   keyframe block: every KPI of every conveyor that already has values
+# - SIMULATED_REPLAY_FILE: the scheduler is replaced by a loop that applies the logged
+#   blocks at SIMULATED_REPLAY_SPEED x their original pacing; nothing is drawn at random
+# - Replay refuses a log whose leading full blocks don't cover the recorded fleet, since
+#   any conveyor without values would be filled with random draws
+# - Replay does not restore or write checkpoints
+# ------------------------------------------------------------
+RECORD_PATH = os.environ.get("SIMULATED_RECORD_FILE", "")
+REPLAY_PATH = os.environ.get("SIMULATED_REPLAY_FILE", "")
+REPLAY_SPEED = float(os.environ.get("SIMULATED_REPLAY_SPEED", 1.0))
+LOG_MAGIC = b"SIMLOG01"
+LOG_RECORD = np.dtype([("t", "<f8"), ("conveyor", "<u4"), ("kpi", "<u2"), ("value", "<f4")])
+
+def _read_log_header(f) -> Dict[str, Any]:
+    if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+        raise ValueError("not a simulation log")
+    length = int.from_bytes(f.read(4), "little")
+    header = json.loads(f.read(length))
+    if header.get("kpis") != _KPI_LAYOUT:
+        raise ValueError("log was recorded with a different KPI layout")
+    return header
+
+class TickRecorder:
+    """Appends generated blocks to the log; one vectorized write per generate() call."""
+
+    def __init__(self, path: str):
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                header = _read_log_header(f)
+            if header["seed"] != SIMULATION_SEED:
+                print(f"Appending to {path}; blocks from this run use seed {SIMULATION_SEED}, not the header's {header['seed']}")
+        else:
+            header = json.dumps({"seed": SIMULATION_SEED, "kpis": _KPI_LAYOUT, "conveyors": registry.as_list(), "created": time()}).encode()
+            with open(path, "wb") as f:
+                f.write(LOG_MAGIC + len(header).to_bytes(4, "little") + header)
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+        self._last = 0.0
+        self._keyframe()
+
+    def _keyframe(self):
+        """Write the values this run starts from, so replay never begins from a partial state."""
+        missing = set(STATE.missing(registry.ids()))
+        conveyor_ids = [cid for cid in registry.ids() if cid not in missing]
+        if conveyor_ids:
+            slots = STATE.slots(conveyor_ids)
+            self.append(KPI_SPECS, conveyor_ids, STATE.values[:, slots], clock.now())
+
+    def append(self, kpis: List[KpiSpec], conveyor_ids: List[int], values: np.ndarray, now: float):
+        # Kpi-major order, so replay can reshape a block back to (len(kpis), len(conveyor_ids))
+        block = np.empty(values.size, dtype=LOG_RECORD)
+        block["kpi"] = np.repeat([k.index for k in kpis], len(conveyor_ids))
+        block["conveyor"] = np.tile(np.asarray(conveyor_ids, dtype=np.uint32), len(kpis))
+        block["value"] = values.ravel()
+        with self._lock:
+            # Blocks are told apart by timestamp, so keep them strictly increasing
+            self._last = block["t"] = max(now, self._last + 1e-6)
+            self._file.write(block.tobytes())
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+recorder: Optional[TickRecorder] = None
+
+_FLOAT_DECIMALS = np.array([k.decimals if k.kind == "float" else -1 for k in KPI_SPECS])
+
+class ReplayLog:
+    """A recorded log split into the blocks written by each generate() call."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.header = _read_log_header(f)
+            offset = f.tell()
+        records = np.memmap(path, dtype=LOG_RECORD, mode="r", offset=offset)
+        # A block is a run of records sharing one timestamp
+        bounds = np.flatnonzero(np.diff(records["t"]) != 0) + 1
+        self.records = records
+        self.starts = np.concatenate(([0], bounds)).astype(np.intp)
+        self.ends = np.concatenate((bounds, [len(records)])).astype(np.intp)
+        self.position = 0  # next block to apply
+
+    def __len__(self) -> int:
+        return len(self.starts) if len(self.records) else 0
+
+    def block(self, i: int) -> Tuple[float, List[KpiSpec], List[int], np.ndarray]:
+        chunk = self.records[self.starts[i]:self.ends[i]]
+        kpi_ids = chunk["kpi"]
+        n_ids = int((kpi_ids == kpi_ids[0]).sum())
+        kpis = [KPI_SPECS[int(k)] for k in kpi_ids[::n_ids]]
+        conveyor_ids = chunk["conveyor"][:n_ids].astype(np.int64).tolist()
+        values = chunk["value"].astype(np.float64).reshape(len(kpis), n_ids)
+        # float32 storage: restore the KPI's own rounding
+        decimals = _FLOAT_DECIMALS[[k.index for k in kpis]]
+        for d in set(decimals.tolist()) - {-1}:
+            values[decimals == d] = np.round(values[decimals == d], d)
+        return float(chunk["t"][0]), kpis, conveyor_ids, values
+
+def _apply_replay_block(log: ReplayLog, i: int) -> float:
+    t, kpis, conveyor_ids, values = log.block(i)
+    known = [j for j, cid in enumerate(conveyor_ids) if cid in registry]
+    if len(known) < len(conveyor_ids):
+        conveyor_ids, values = [conveyor_ids[j] for j in known], values[:, known]
+    if conveyor_ids:
+        store(kpis, conveyor_ids, values, clock.now())
+    return t
+
+def start_replay(path: str) -> ReplayLog:
+    """Install the recorded fleet and apply the starting keyframe so no request ever sees random values."""
+    log = ReplayLog(path)
+    fleet = {c["id"]: c["status"] for c in log.header["conveyors"]}
+    registry.replace(fleet)
+    covered: Set[int] = set()
+    while log.position < len(log) and not fleet.keys() <= covered:
+        _, kpis, conveyor_ids, _ = log.block(log.position)
+        if len(kpis) < len(KPI_SPECS):
+            break  # a cadence block: the keyframe ended short of the fleet
+        _apply_replay_block(log, log.position)
+        covered.update(conveyor_ids)
+        log.position += 1
+    uncovered = sorted(fleet.keys() - covered)
+    if uncovered:
+        raise ValueError(f"{path} has no starting keyframe for conveyors {uncovered[:10]}; "
+                         "record it again so replay doesn't fill them with random values")
+    return log
+
+async def _replay_loop(log: ReplayLog, speed: float):
+    if log.position >= len(log):
+        return
+    # Pace from the last keyframe block start_replay applied
+    origin, started = float(log.records["t"][log.starts[max(log.position - 1, 0)]]), time()
+    for i in range(log.position, len(log)):
+        due = started + (float(log.records["t"][log.starts[i]]) - origin) / speed
+        await asyncio.sleep(max(due - time(), 0))
+        try:
+            _apply_replay_block(log, i)
+        except Exception as e:
+            print(f"Replay block {i} failed: {e}")
+    print(f"Replay of {REPLAY_PATH} finished ({len(log)} blocks); serving the final state")
+
+# ------------------------------------------------------------
+# Multi-worker shared state (SIMULATED_SHARED_STATE=<segment name>)
+# - Every worker races for an flock on <tmpdir>/<name>.lock; the winner is the writer.
+#   It runs the scheduler, checkpoints and recorder as a single-process server would,
+#   with the KPI arrays (values, stamps, versions) placed in a shared-memory segment
+# - The other workers are readers: they map the same arrays and copy out of them under
+#   a seqlock (the writer makes the sequence odd for the duration of each write)
+# - Fleet (slot table), pause flag, rules and clock are republished by the writer after
+#   every request that changes them; readers reload them when the revision moves
+# - Readers forward state-changing requests, and /history, /rollups and /spc (the writer
+#   alone keeps those buffers), to the writer through a one-request mailbox in the segment;
+#   a datagram on a unix socket wakes the writer, so an idle mailbox costs nothing
+# - The writer is not replaced if it dies; readers keep serving its last state
+# ------------------------------------------------------------
+SHARED_STATE_NAME = os.environ.get("SIMULATED_SHARED_STATE", "")
+SHARED_META_BYTES = 64 * 1024
+SHARED_MAILBOX_BYTES = 4 * 1024 * 1024
+SHARED_ATTACH_TIMEOUT_SECONDS = 30.0
+SHARED_FORWARD_TIMEOUT_SECONDS = 10.0
+SHARED_POLL_SECONDS = 0.005
+SHARED_MAILBOX_IDLE_SECONDS = 1.0  # the writer re-checks the mailbox this often if a doorbell datagram was lost
+SHARED_READ_SPINS = 100  # seqlock retries before a reader backs off (asleep in a thread, awaiting on the loop)
+WRITER_PATH_PREFIXES = ("/kpi-rules", "/conveyors", "/simulate/status", "/clock")
+WRITER_READ_PREFIXES = ("/history/", "/rollups/", "/spc/")
+
+# Control segment: int64 header slots, then the meta JSON, then the mailbox
+(_H_SEQ, _H_TOKEN, _H_LAYOUT, _H_GENERATION, _H_CAPACITY, _H_VERSION, _H_TABLES,
+ _H_META_LEN, _H_REQUEST, _H_RESPONSE, _H_MAILBOX_LEN) = range(11)
+_HEADER_SLOTS = 16
+_LAYOUT_ID = zlib.crc32(json.dumps([_KPI_LAYOUT, VALID_CATEGORIES, len(KPI_GROUPS)]).encode())
+
+def _data_layout(capacity: int) -> List[Tuple[str, Tuple[int, ...], Any]]:
+    return [
+        ("values", (len(KPI_SPECS), capacity), np.float64),
+        ("stamps", (len(KPI_GROUPS), capacity), np.float64),
+        ("conveyor_versions", (capacity,), np.int64),
+        ("category_versions", (len(VALID_CATEGORIES), capacity), np.int64),
+        ("slot_ids", (capacity,), np.int64),  # as of the last publish
+        ("slot_status", (capacity,), np.int64),
+        ("slot_owner", (capacity,), np.int64),  # live: -1 from a forget until the next publish
+    ]
+
+def _data_arrays(buf, capacity: int) -> Dict[str, np.ndarray]:
+    arrays, offset = {}, 0
+    for name, shape, dtype in _data_layout(capacity):
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += arrays[name].nbytes
+    return arrays
+
+def _data_bytes(capacity: int) -> int:
+    return sum(int(np.prod(shape)) * 8 for _, shape, _ in _data_layout(capacity))
+
+def _create_segment(name: str, size: int) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name, create=True, size=size)
+    except FileExistsError:
+        # Left behind by a writer that didn't shut down cleanly
+        shared_memory.SharedMemory(name).unlink()
+        return shared_memory.SharedMemory(name, create=True, size=size)
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    # Older Pythons register attached segments as well; uvicorn's spawned workers share
+    # the supervisor's resource tracker, so the writer's unlink clears that registration
+    return shared_memory.SharedMemory(name)
+
+class SharedState:
+    """One worker's view of the shared segment: the writer publishes, readers follow."""
+
+    def __init__(self, name: str):
+        if fcntl is None:
+            raise RuntimeError("SIMULATED_SHARED_STATE needs a POSIX platform (fcntl)")
+        self.name = name
+        lock_dir = os.environ.get("TMPDIR", "/tmp")
+        self._lock_fd = os.open(os.path.join(lock_dir, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        self._mailbox_fd = os.open(os.path.join(lock_dir, f"{name}.mailbox.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        self._doorbell_path = os.path.join(lock_dir, f"{name}.mailbox.sock")
+        self._doorbell: Optional[socket.socket] = None
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.writer = True
+        except BlockingIOError:
+            self.writer = False
+        self.control: Optional[shared_memory.SharedMemory] = None
+        self.data: Optional[shared_memory.SharedMemory] = None
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.generation = 0
+        self.tables = 0
+        self._retired: List[shared_memory.SharedMemory] = []  # may still back views in flight
+        self._write_lock = _state_lock
+        self._write_depth = 0
+        self._mailbox_lock = asyncio.Lock()
+
+    @property
+    def role(self) -> str:
+        return "writer" if self.writer else "reader"
+
+    def _map_control(self, segment: shared_memory.SharedMemory):
+        self.control = segment
+        self.header = np.ndarray((_HEADER_SLOTS,), dtype=np.int64, buffer=segment.buf)
+        meta_start = _HEADER_SLOTS * 8
+        self.meta = segment.buf[meta_start:meta_start + SHARED_META_BYTES]
+        self.mailbox = segment.buf[meta_start + SHARED_META_BYTES:]
+
+    # ---- writer side ----
+    def start_writer(self):
+        token = int.from_bytes(os.urandom(8), "little") >> 1
+        self._map_control(_create_segment(f"{self.name}-ctl", _HEADER_SLOTS * 8 + SHARED_META_BYTES + SHARED_MAILBOX_BYTES))
+        self.header[:] = 0
+        self.header[_H_LAYOUT] = _LAYOUT_ID
+        with self.write():
+            self._new_data_segment()
+        STATE.on_grow = self._regrow
+        self.publish()
+        os.ftruncate(self._lock_fd, 0)
+        os.pwrite(self._lock_fd, str(token).encode(), 0)
+        self.header[_H_TOKEN] = token  # readers attach once this matches the lock file
+
+    def _new_data_segment(self):
+        """Move STATE's arrays into a fresh segment sized to its current capacity."""
+        capacity = STATE.values.shape[1]
+        self.generation += 1
+        segment = _create_segment(f"{self.name}-data-{self.generation}", _data_bytes(capacity))
+        arrays = _data_arrays(segment.buf, capacity)
+        for name in ("values", "stamps", "conveyor_versions", "category_versions"):
+            arrays[name][...] = getattr(STATE, name)
+        arrays["slot_ids"][:] = arrays["slot_owner"][:] = -1
+        arrays["slot_status"][:] = 0
+        if self.arrays:
+            used = len(self.arrays["slot_ids"])
+            for name in ("slot_ids", "slot_status", "slot_owner"):
+                arrays[name][:used] = self.arrays[name]
+        if self.data is not None:
+            self.data.unlink()
+            self._retired.append(self.data)
+        self.data, self.arrays = segment, arrays
+        STATE.bind(arrays)
+        self.header[_H_CAPACITY] = capacity
+        self.header[_H_GENERATION] = self.generation
+
+    def _regrow(self):
+        with self.write():
+            self._new_data_segment()
+
+    @contextmanager
+    def write(self):
+        """Seqlock write section; re-entrant so generate and the fleet admin routes can wrap their stores."""
+        with self._write_lock:
+            if self._write_depth == 0:
+                self.header[_H_SEQ] += 1
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self.header[_H_VERSION] = STATE.version
+                    self.header[_H_SEQ] += 1
+
+    def release_slot(self, slot: int):
+        """Mark a forgotten slot so readers wait for the next publish instead of reading it."""
+        self.arrays["slot_owner"][slot] = -1
+
+    def publish(self):
+        """Republish the slot table, statuses, pause flag, rules and clock."""
+        _ensure_generated(registry.ids())
+        meta = json.dumps({"paused": paused, "rules": UPDATE_RULES, "clock": clock.state()}).encode()
+        if len(meta) > SHARED_META_BYTES:
+            raise RuntimeError("KPI rules too large for the shared meta block")
+        with self.write():
+            capacity = len(self.arrays["slot_ids"])
+            slot_ids = STATE.slot_table(capacity)
+            self.arrays["slot_ids"][:] = self.arrays["slot_owner"][:] = slot_ids
+            used = slot_ids >= 0
+            self.arrays["slot_status"][used] = [_STATUS_INDEX[registry.status(int(cid))] for cid in slot_ids[used]]
+            self.meta[:len(meta)] = meta
+            self.header[_H_META_LEN] = len(meta)
+            self.header[_H_TABLES] += 1
+
+    async def serve_mailbox(self):
+        """Run forwarded requests through this worker's app, one at a time."""
+        loop = asyncio.get_running_loop()
+        try:
+            os.unlink(self._doorbell_path)  # left behind by a writer that didn't shut down cleanly
+        except FileNotFoundError:
+            pass
+        self._doorbell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._doorbell.bind(self._doorbell_path)
+        self._doorbell.setblocking(False)
+        while True:
+            ticket = int(self.header[_H_REQUEST])
+            if ticket == self.header[_H_RESPONSE]:
+                try:
+                    await asyncio.wait_for(loop.sock_recv(self._doorbell, 16), SHARED_MAILBOX_IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                response = await _run_forwarded(bytes(self.mailbox[:int(self.header[_H_MAILBOX_LEN])]))
+            except Exception as e:
+                response = _forward_envelope(500, [], f"Forwarded request failed: {e}".encode())
+            if len(response) > SHARED_MAILBOX_BYTES:
+                response = _forward_envelope(502, [], b"Response too large for the shared mailbox")
+            self.mailbox[:len(response)] = response
+            self.header[_H_MAILBOX_LEN] = len(response)
+            self.header[_H_RESPONSE] = ticket
+
+    def close(self):
+        if self._doorbell is not None:
+            self._doorbell.close()
+            if self.writer:
+                try:
+                    os.unlink(self._doorbell_path)
+                except FileNotFoundError:
+                    pass
+        if self.writer:
+            for segment in (self.data, self.control):
+                if segment is not None:
+                    try:
+                        segment.unlink()
+                    except FileNotFoundError:
+                        pass
+
+    # ---- reader side ----
+    def start_reader(self):
+        deadline = time() + SHARED_ATTACH_TIMEOUT_SECONDS
+        while True:
+            try:
+                token = int(os.pread(self._lock_fd, 32, 0) or b"0")
+                if token:
+                    if self.control is None:
+                        self._map_control(_attach_segment(f"{self.name}-ctl"))
+                    if self.header[_H_TOKEN] == token:
+                        break
+            except (FileNotFoundError, ValueError):
+                pass
+            if time() > deadline:
+                raise RuntimeError(f"No shared-state writer for {self.name!r} within {SHARED_ATTACH_TIMEOUT_SECONDS:.0f}s")
+            sleep(0.1)
+        if self.header[_H_LAYOUT] != _LAYOUT_ID:
+            raise RuntimeError("Shared-state writer runs a different KPI layout")
+        self.sync()
+
+    def _try_read(self, fn: Callable[[], Any]) -> Tuple[bool, Any]:
+        """(True, fn()) if fn() ran entirely between two writes within SHARED_READ_SPINS tries."""
+        header = self.header
+        for _ in range(SHARED_READ_SPINS):
+            begin = int(header[_H_SEQ])
+            if begin & 1:
+                continue
+            result = fn()
+            if header[_H_SEQ] == begin:
+                return True, result
+        return False, None
+
+    def read(self, fn: Callable[[], Any]) -> Any:
+        """fn() retried until it ran between two writes. Blocks: worker threads only, the loop uses read_async()."""
+        while True:
+            done, result = self._try_read(fn)
+            if done:
+                return result
+            sleep(SHARED_POLL_SECONDS)
+
+    async def read_async(self, fn: Callable[[], Any]) -> Any:
+        """read() for the event loop: yields to other connections while the writer is mid-update."""
+        while True:
+            done, result = self._try_read(fn)
+            if done:
+                return result
+            await asyncio.sleep(SHARED_POLL_SECONDS)
+
+    def read_values(self, rows: np.ndarray, conveyor_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Values and statuses from one consistent point, even if the fleet changed mid-request (blocks, like read())."""
+        ids = np.asarray(conveyor_ids, dtype=np.int64)
+        while True:
+            missing = [cid for cid in conveyor_ids if cid not in STATE]
+            if missing:
+                # Removed since the route checked it: the same answer the single-process path gives
+                raise HTTPException(status_code=404, detail=f"Conveyor {missing[0]} not found")
+            slots = STATE.slots(conveyor_ids)
+            arrays = self.arrays
+
+            def copy():
+                if (arrays["slot_owner"][slots] != ids).any():
+                    return None  # slots were reassigned since this worker's last sync
+                return arrays["values"][np.ix_(rows, slots)], arrays["slot_status"][slots].astype(np.intp)
+
+            result = self.read(copy)
+            if result is not None:
+                return result
+            # The writer freed or reassigned a slot; wait for it to republish the table
+            sleep(SHARED_POLL_SECONDS)
+            self.sync()
+
+    def sync(self):
+        """Follow the writer: remap after growth, reload tables after admin changes (blocks, like read())."""
+        if self.writer:
+            return
+        header = self.header
+        while header[_H_GENERATION] != self.generation:
+            self._remap(*self.read(self._geometry))
+        if header[_H_TABLES] != self.tables:
+            self._load_tables(*self.read(self._tables))
+        STATE.version = int(header[_H_VERSION])
+
+    async def refresh(self):
+        """sync() for the event loop."""
+        if self.writer:
+            return
+        header = self.header
+        while header[_H_GENERATION] != self.generation:
+            self._remap(*await self.read_async(self._geometry))
+        if header[_H_TABLES] != self.tables:
+            self._load_tables(*await self.read_async(self._tables))
+        STATE.version = int(header[_H_VERSION])
+
+    def _geometry(self) -> Tuple[int, int]:
+        return int(self.header[_H_GENERATION]), int(self.header[_H_CAPACITY])
+
+    def _remap(self, generation: int, capacity: int):
+        if generation == self.generation:
+            return  # another refresh() got here first
+        try:
+            segment = _attach_segment(f"{self.name}-data-{generation}")
+        except FileNotFoundError:
+            return  # the writer grew again in between
+        if self.data is not None:
+            self._retired.append(self.data)
+        self.data, self.generation = segment, generation
+        self.arrays = _data_arrays(segment.buf, capacity)
+        STATE.bind(self.arrays)
+        self.tables = -1
+
+    def _tables(self) -> Tuple[int, int, np.ndarray, np.ndarray, bytes]:
+        header, arrays = self.header, self.arrays
+        return (int(header[_H_GENERATION]), int(header[_H_TABLES]), arrays["slot_ids"].copy(),
+                arrays["slot_status"].copy(), bytes(self.meta[:int(header[_H_META_LEN])]))
+
+    def _load_tables(self, generation: int, tables: int, slot_ids: np.ndarray, slot_status: np.ndarray, meta: bytes):
+        global paused
+        if generation != self.generation or tables <= self.tables:
+            return  # read from a segment that has since been replaced, or already loaded
+        used = np.flatnonzero(slot_ids >= 0)
+        STATE.adopt_slots({int(slot_ids[slot]): int(slot) for slot in used})
+        registry.replace({int(slot_ids[slot]): STATUSES[int(slot_status[slot])] for slot in used})
+        meta = json.loads(meta)
+        paused = meta["paused"]
+        UPDATE_RULES.clear()
+        UPDATE_RULES.update(meta["rules"])
+        clock.load(meta["clock"])
+        response_cache.clear()
+        self.tables = tables
+
+    async def forward(self, scope, receive, send):
+        """Replay an HTTP request on the writer and relay its response."""
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        request = json.dumps({
+            "method": scope["method"], "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in scope["headers"]],
+        }).encode() + b"\n" + bytes(body)
+        if len(request) > SHARED_MAILBOX_BYTES:
+            response = _forward_envelope(413, [], b"Request too large to forward to the writer")
+        else:
+            async with self._mailbox_lock:
+                await asyncio.to_thread(fcntl.flock, self._mailbox_fd, fcntl.LOCK_EX)
+                try:
+                    response = await self._exchange(request)
+                finally:
+                    fcntl.flock(self._mailbox_fd, fcntl.LOCK_UN)
+        meta, _, payload = response.partition(b"\n")
+        meta = json.loads(meta)
+        await send({"type": "http.response.start", "status": meta["status"],
+                    "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in meta["headers"]]})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _exchange(self, request: bytes) -> bytes:
+        header = self.header
+        self.mailbox[:len(request)] = request
+        header[_H_MAILBOX_LEN] = len(request)
+        ticket = int(header[_H_REQUEST]) + 1
+        header[_H_REQUEST] = ticket
+        self._ring()
+        deadline = time() + SHARED_FORWARD_TIMEOUT_SECONDS
+        while header[_H_RESPONSE] != ticket:
+            if time() > deadline:
+                return _forward_envelope(504, [], b"Shared-state writer did not answer")
+            await asyncio.sleep(SHARED_POLL_SECONDS)
+        return bytes(self.mailbox[:int(header[_H_MAILBOX_LEN])])
+
+    def _ring(self):
+        """Wake the writer's mailbox loop; if the datagram is lost it still looks within SHARED_MAILBOX_IDLE_SECONDS."""
+        if self._doorbell is None:
+            self._doorbell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._doorbell.setblocking(False)
+        try:
+            self._doorbell.sendto(b"\x01", self._doorbell_path)
+        except OSError:
+            pass
+
+def _forward_envelope(status: int, headers: List[List[str]], body: bytes) -> bytes:
+    if not headers:
+        headers = [["content-type", "text/plain; charset=utf-8"], ["content-length", str(len(body))]]
+    return json.dumps({"status": status, "headers": headers}).encode() + b"\n" + body
+
+async def _run_forwarded(request: bytes) -> bytes:
+    meta, _, body = request.partition(b"\n")
+    meta = json.loads(meta)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": meta["method"], "path": meta["path"], "raw_path": meta["path"].encode(),
+        "query_string": meta["query"].encode("latin-1"), "root_path": "",
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in meta["headers"]],
+        "client": None, "server": None, "extensions": {}, "state": {},
     }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return pending.pop() if pending else {"type": "http.disconnect"}
+
+    status, headers, chunks = [500], [], []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+            headers.extend([k.decode("latin-1"), v.decode("latin-1")] for k, v in message.get("headers", ()))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return _forward_envelope(status[0], headers, b"".join(chunks))
+
+def _changes_state(scope) -> bool:
+    return scope["method"] not in ("GET", "HEAD", "OPTIONS") and scope["path"].startswith(WRITER_PATH_PREFIXES)
+
+def _writer_only(scope) -> bool:
+    if scope["method"] in ("GET", "HEAD"):
+        return scope["path"].startswith(WRITER_READ_PREFIXES)
+    return _changes_state(scope)
+
+class SharedStateMiddleware:
+    """Readers sync before every request and forward writer-only ones; the writer republishes after changes."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if shared_state is None or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if shared_state.writer:
+            if scope["type"] == "http" and _changes_state(scope):
+                await self._publishing(scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+            return
+        await shared_state.refresh()
+        if scope["type"] == "http" and _writer_only(scope):
+            await shared_state.forward(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    async def _publishing(self, scope, receive, send):
+        # Publish before the response starts, so a client's next request sees its write on any worker
+        published = False
+
+        async def send_after_publish(message):
+            nonlocal published
+            if message["type"] == "http.response.start" and not published:
+                published = True
+                shared_state.publish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_after_publish)
+        finally:
+            if not published:
+                shared_state.publish()
+
+app.add_middleware(SharedStateMiddleware)
+
+shared_state: Optional[SharedState] = None
+
+class FacilityBatch:
+    """Per-KPI value columns for a set of conveyors; dicts are only built on request."""
+
+    def __init__(self, conveyor_ids: List[int], statuses: List[str], columns: Dict[int, List[Any]]):
+        self.conveyor_ids = conveyor_ids
+        self.statuses = statuses
+        self.columns = columns
+        self._position = {cid: j for j, cid in enumerate(conveyor_ids)}
+
+    def category_data(self, conveyor_id: int, category: str) -> Dict[str, Any]:
+        started = perf_counter()
+        j = self._position[conveyor_id]
+        columns = self.columns
+        out: Dict[str, Any] = {}
+        for k in KPIS_BY_CATEGORY[category]:
+            node = out
+            for key in k.path[:-1]:
+                child = node.get(key)
+                if child is None:
+                    child = node[key] = {}
+                node = child
+            node[k.path[-1]] = columns[k.index][j]
+        METRICS.category_builds[category].observe(perf_counter() - started)
+        return out
+
+    def snapshot(self, conveyor_id: int) -> Dict[str, Any]:
+        snap = {"conveyor_id": conveyor_id, "status": self.statuses[self._position[conveyor_id]]}
+        for cat in VALID_CATEGORIES:
+            snap[cat] = self.category_data(conveyor_id, cat)
+        return snap
+
+def read_batch(conveyor_ids: List[int], categories: Optional[List[str]] = None) -> FacilityBatch:
+    """Current values of the given categories (default: all) for a set of conveyors; no generation."""
+    categories = categories or VALID_CATEGORIES
+    _ensure_generated(conveyor_ids)
+    started = perf_counter()
+    kpis = [k for cat in categories for k in KPIS_BY_CATEGORY[cat]]
+    values, status_idx = _read(kpis, conveyor_ids)
+    statuses = [STATUSES[i] for i in status_idx.tolist()]
+    batch = FacilityBatch(conveyor_ids, statuses, _to_columns(kpis, values, status_idx))
+    METRICS.stages["read_batch"].observe(perf_counter() - started)
+    return batch
 
 # ------------------------------------------------------------
-# Other categories (legacy behavior; add cadences later if desired)
+# Per-category entry points (kept for the REST routes; pure reads of current state)
 # ------------------------------------------------------------
+def simulate_overall_facility_data(conveyor_id: int) -> Dict[str, Any]:
+    return read_batch([conveyor_id], ["overall_facility"]).category_data(conveyor_id, "overall_facility")
+
 def simulate_production_data(conveyor_id: int) -> Dict[str, Any]:
-    status = _conveyor_status(conveyor_id)
-    if status == "non-operational":
-        return {
-            "quality": {"first_pass_yield": 0, "defect_rate": 0, "scrap_rate": 0},
-            "time_per_hour": {"units_produced": 0, "cycle_time": 0, "efficiency": 0},
-            "product_management": {"active_orders": 0, "backlog": 0, "on_time_delivery": 0, "inventory_levels": 0},
-            "production_rate": {"current_rate": 0, "target_rate": 0, "variance": 0},
-        }
-    elif status == "faulty":
-        return {
-            "quality": {
-                "first_pass_yield": round(random.uniform(50, 70), 1),
-                "defect_rate": round(random.uniform(15, 30), 2),
-                "scrap_rate": round(random.uniform(10, 20), 2),
-            },
-            "time_per_hour": {
-                "units_produced": random.randint(10, 40),
-                "cycle_time": round(random.uniform(80, 180), 2),
-                "efficiency": round(random.uniform(30, 60), 1),
-            },
-            "product_management": {
-                "active_orders": random.randint(1, 5),
-                "backlog": random.randint(15, 30),
-                "on_time_delivery": round(random.uniform(30, 60), 1),
-                "inventory_levels": round(random.uniform(20, 40), 1),
-            },
-            "production_rate": {
-                "current_rate": random.randint(20, 50),
-                "target_rate": random.randint(100, 160),
-                "variance": round(random.uniform(-70, -40), 1),
-            },
-        }
-    else:
-        return {
-            "quality": {
-                "first_pass_yield": round(random.uniform(85, 99.5), 1),
-                "defect_rate": round(random.uniform(0.1, 5), 2),
-                "scrap_rate": round(random.uniform(0.2, 3), 2),
-            },
-            "time_per_hour": {
-                "units_produced": random.randint(50, 200),
-                "cycle_time": round(random.uniform(15, 60), 2),
-                "efficiency": round(random.uniform(75, 98), 1),
-            },
-            "product_management": {
-                "active_orders": random.randint(3, 15),
-                "backlog": random.randint(0, 10),
-                "on_time_delivery": round(random.uniform(80, 99), 1),
-                "inventory_levels": round(random.uniform(70, 95), 1),
-            },
-            "production_rate": {
-                "current_rate": random.randint(80, 150),
-                "target_rate": random.randint(100, 160),
-                "variance": round(random.uniform(-15, 10), 1),
-            },
-        }
+    return read_batch([conveyor_id], ["production_data"]).category_data(conveyor_id, "production_data")
 
 def simulate_quality_control_data(conveyor_id: int) -> Dict[str, Any]:
-    status = _conveyor_status(conveyor_id)
-    if status == "non-operational":
-        return {
-            "defective_products": {"count": 0, "percentage": 0, "critical_defects": 0},
-            "areas_of_improvement": {"identified_areas": 0, "priority_level": "none", "estimated_impact": 0},
-            "defects_rates": {"by_category": {"assembly": 0, "material": 0, "finish": 0, "packaging": 0}, "trend": "none", "within_targets": False},
-            "quality_metrics": {"dimensional_accuracy": 0, "visual_inspection_pass_rate": 0, "customer_return_rate": 0},
-        }
-    elif status == "faulty":
-        return {
-            "defective_products": {"count": random.randint(40, 80), "percentage": round(random.uniform(15, 30), 2), "critical_defects": random.randint(10, 25)},
-            "areas_of_improvement": {"identified_areas": random.randint(8, 15), "priority_level": "high", "estimated_impact": round(random.uniform(7, 10), 1)},
-            "defects_rates": {
-                "by_category": {
-                    "assembly": round(random.uniform(10, 20), 2),
-                    "material": round(random.uniform(5, 15), 2),
-                    "finish": round(random.uniform(8, 18), 2),
-                    "packaging": round(random.uniform(3, 8), 2),
-                },
-                "trend": "worsening",
-                "within_targets": False,
-            },
-            "quality_metrics": {"dimensional_accuracy": round(random.uniform(70, 85), 2), "visual_inspection_pass_rate": round(random.uniform(60, 80), 1), "customer_return_rate": round(random.uniform(5, 15), 2)},
-        }
-    else:
-        return {
-            "defective_products": {"count": random.randint(0, 20), "percentage": round(random.uniform(0.1, 3), 2), "critical_defects": random.randint(0, 5)},
-            "areas_of_improvement": {"identified_areas": random.randint(1, 5), "priority_level": random.choice(["low", "medium", "high"]), "estimated_impact": round(random.uniform(1, 10), 1)},
-            "defects_rates": {
-                "by_category": {
-                    "assembly": round(random.uniform(0.1, 2), 2),
-                    "material": round(random.uniform(0.05, 1.5), 2),
-                    "finish": round(random.uniform(0.2, 2.5), 2),
-                    "packaging": round(random.uniform(0.1, 1), 2),
-                },
-                "trend": random.choice(["improving", "stable", "worsening"]),
-                "within_targets": random.choice([True, True, True, False]),
-            },
-            "quality_metrics": {"dimensional_accuracy": round(random.uniform(95, 99.9), 2), "visual_inspection_pass_rate": round(random.uniform(90, 99), 1), "customer_return_rate": round(random.uniform(0.01, 1), 2)},
-        }
+    return read_batch([conveyor_id], ["quality_control"]).category_data(conveyor_id, "quality_control")
 
 def simulate_equipment_performance_data(conveyor_id: int) -> Dict[str, Any]:
-    status = _conveyor_status(conveyor_id)
-    if status == "non-operational":
-        return {
-            "uptime_downtime": {"uptime_percentage": 0, "planned_downtime": 24, "unplanned_downtime": 0, "mean_time_between_failures": 0},
-            "operating_conditions": {"temperature": 0, "pressure": 0, "vibration": 0, "noise_level": 0, "load_percentage": 0},
-            "time_per_hour": {"processing_time": 0, "idle_time": 60, "setup_time": 0, "maintenance_time": 0},
-            "parameters": {"temp_pressure_vibration": {"temperature": 0, "pressure": 0, "vibration": 0, "within_spec": False}},
-        }
-    elif status == "faulty":
-        return {
-            "uptime_downtime": {
-                "uptime_percentage": round(random.uniform(30, 60), 1),
-                "planned_downtime": round(random.uniform(3, 6), 1),
-                "unplanned_downtime": round(random.uniform(4, 12), 2),
-                "mean_time_between_failures": round(random.uniform(10, 60), 1),
-            },
-            "operating_conditions": {
-                "temperature": round(random.uniform(45, 65), 1),
-                "pressure": round(random.uniform(40, 70), 1),
-                "vibration": round(random.uniform(5, 15), 2),
-                "noise_level": round(random.uniform(95, 110), 1),
-                "load_percentage": round(random.uniform(30, 50), 1),
-            },
-            "time_per_hour": {
-                "processing_time": round(random.uniform(20, 35), 1),
-                "idle_time": round(random.uniform(15, 25), 1),
-                "setup_time": round(random.uniform(10, 20), 1),
-                "maintenance_time": round(random.uniform(5, 15), 1),
-            },
-            "parameters": {"temp_pressure_vibration": {"temperature": round(random.uniform(45, 65), 1), "pressure": round(random.uniform(40, 70), 1), "vibration": round(random.uniform(5, 15), 2), "within_spec": False}},
-        }
-    else:
-        return {
-            "uptime_downtime": {
-                "uptime_percentage": round(random.uniform(85, 99), 1),
-                "planned_downtime": round(random.uniform(1, 8), 1),
-                "unplanned_downtime": round(random.uniform(0, 4), 2),
-                "mean_time_between_failures": round(random.uniform(100, 500), 1),
-            },
-            "operating_conditions": {
-                "temperature": round(random.uniform(20, 40), 1),
-                "pressure": round(random.uniform(80, 110), 1),
-                "vibration": round(random.uniform(0.1, 2.5), 2),
-                "noise_level": round(random.uniform(60, 95), 1),
-                "load_percentage": round(random.uniform(60, 90), 1),
-            },
-            "time_per_hour": {
-                "processing_time": round(random.uniform(45, 58), 1),
-                "idle_time": round(random.uniform(0, 10), 1),
-                "setup_time": round(random.uniform(2, 8), 1),
-                "maintenance_time": round(random.uniform(0, 5), 1),
-            },
-            "parameters": {"temp_pressure_vibration": {"temperature": round(random.uniform(20, 40), 1), "pressure": round(random.uniform(80, 110), 1), "vibration": round(random.uniform(0.1, 2.5), 2), "within_spec": random.choice([True, True, True, False])}},
-        }
+    return read_batch([conveyor_id], ["equipment_performance"]).category_data(conveyor_id, "equipment_performance")
 
 def simulate_equipment_perf_data(conveyor_id: int) -> Dict[str, Any]:
-    equipment = ["Conveyor Line", "CNC Machine", "Laser Cutter", "Injection Molder", "Robot Arm"]
-    status = _conveyor_status(conveyor_id)
-    equipment_data = {}
-    if status == "non-operational":
-        for item in equipment:
-            equipment_data[item] = {"usage_hours": 0, "performance_score": 0, "wear_percentage": 0, "maintenance_needed": False, "downtime": 24}
-    elif status == "faulty":
-        for item in equipment:
-            equipment_data[item] = {"usage_hours": round(random.uniform(5, 10), 1), "performance_score": round(random.uniform(20, 50), 1), "wear_percentage": round(random.uniform(60, 95), 1), "maintenance_needed": True, "downtime": round(random.uniform(5, 15), 2)}
-    else:
-        for item in equipment:
-            equipment_data[item] = {"usage_hours": round(random.uniform(0, 24), 1), "performance_score": round(random.uniform(70, 100), 1), "wear_percentage": round(random.uniform(0, 80), 1), "maintenance_needed": random.random() > 0.8, "downtime": round(random.uniform(0, 2), 2)}
-    return equipment_data
+    return read_batch([conveyor_id], ["equipment_details"]).category_data(conveyor_id, "equipment_details")
 
 # ------------------------------------------------------------
-# Snapshot builders (use lazy/timed KPI updates)
+# Snapshot builders (read whatever the scheduler last generated)
 # ------------------------------------------------------------
 def get_conveyor_snapshot(conveyor_id: int) -> Dict[str, Any]:
-    status = _conveyor_status(conveyor_id)
-    return {
-        "conveyor_id": conveyor_id,
-        "status": status,
-        "overall_facility": simulate_overall_facility_data(conveyor_id),
-        "production_data": simulate_production_data(conveyor_id),
-        "equipment_performance": simulate_equipment_performance_data(conveyor_id),
-        "quality_control": simulate_quality_control_data(conveyor_id),
-        "equipment_details": simulate_equipment_perf_data(conveyor_id),
-    }
+    return read_batch([conveyor_id]).snapshot(conveyor_id)
 
 def get_all_facility_data() -> Dict[str, Any]:
-    conveyor_data = {f"conveyor_{cid}": get_conveyor_snapshot(cid) for cid in range(1, 6)}
-    return {"timestamp": datetime.now().isoformat(), "facility_status": "operational", "simulation_paused": paused, "conveyor_belts": conveyor_data}
+    batch = read_batch(registry.ids())
+    conveyor_data = {f"conveyor_{cid}": batch.snapshot(cid) for cid in batch.conveyor_ids}
+    return {"timestamp": _timestamp(), "seq": STATE.version, "facility_status": "operational", "simulation_paused": paused, "conveyor_belts": conveyor_data}
+
+# ------------------------------------------------------------
+# Sparse fieldsets: dotted selectors such as "overall_facility.temperature"
+# - A selector names a category, a nested group ("overall_facility.power_usage") or one KPI
+# - Only the selected KPI rows are read and converted; nothing else is built
+# ------------------------------------------------------------
+def resolve_fields(fields: List[str], category: Optional[str] = None) -> List[KpiSpec]:
+    """KPIs behind the selectors (paths relative to `category` when given); raises ValueError."""
+    wanted: Set[int] = set()
+    for field in fields:
+        field = str(field).strip()
+        if category is not None:
+            cat, path = category, field
+        else:
+            cat, _, path = field.partition(".")
+        matched = [k for k in KPIS_BY_CATEGORY.get(cat, ())
+                   if not path or ".".join(k.path) == path or ".".join(k.path).startswith(path + ".")]
+        if not matched:
+            example = "temperature" if category == "overall_facility" else "overall_facility.temperature"
+            raise ValueError(f"Unknown field {field!r}; use a dotted path, e.g. {example}")
+        wanted.update(k.index for k in matched)
+    return [k for k in KPI_SPECS if k.index in wanted]
+
+def _nested_values(kpis: List[KpiSpec], columns: Dict[int, List[Any]], j: int) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for k in kpis:
+        node = out.setdefault(k.category, {})
+        for key in k.path[:-1]:
+            node = node.setdefault(key, {})
+        node[k.path[-1]] = columns[k.index][j]
+    return out
+
+def get_sparse_snapshots(conveyor_ids: List[int], kpis: List[KpiSpec]) -> Dict[int, Dict[str, Any]]:
+    """Only the given KPIs (plus id and status) for each conveyor."""
+    _ensure_generated(conveyor_ids)
+    started = perf_counter()
+    values, status_idx = _read(kpis, conveyor_ids)
+    columns = _to_columns(kpis, values, status_idx)
+    statuses = status_idx.tolist()
+    out = {cid: {"conveyor_id": cid, "status": STATUSES[statuses[j]], **_nested_values(kpis, columns, j)}
+           for j, cid in enumerate(conveyor_ids)}
+    METRICS.stages["read_batch"].observe(perf_counter() - started)
+    return out
+
+# ------------------------------------------------------------
+# Broadcast tick: build one snapshot per tick, encode once per topic
+# ------------------------------------------------------------
+BROADCAST_INTERVAL_SECONDS = 5
+
+def _encode_bytes(payload: Any) -> bytes:
+    started = perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        # Same compact encoding Starlette's send_json uses
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    METRICS.stages["serialize"].observe(perf_counter() - started)
+    return body
+
+def _encode(payload: Any) -> str:
+    return _encode_bytes(payload).decode("utf-8")
+
+# ------------------------------------------------------------
+# Response compression
+# - Accept-Encoding is negotiated per request (br preferred, then gzip, honouring q=0)
+# - Bodies under COMPRESSION_MIN_BYTES are sent as-is; compressing them costs more than it saves
+# ------------------------------------------------------------
+COMPRESSION_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+CONTENT_CODINGS: Tuple[str, ...] = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def _accepted_coding(request: Request) -> Optional[str]:
+    header = request.headers.get("accept-encoding")
+    if not header:
+        return None
+    weights: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    for coding in CONTENT_CODINGS:
+        if weights.get(coding, weights.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def _compress(body: bytes, coding: str) -> bytes:
+    started = perf_counter()
+    if coding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    METRICS.stages["compress"].observe(perf_counter() - started)
+    return compressed
+
+def _json_response(request: Request, payload: Any) -> Response:
+    """Uncached JSON body, compressed when large enough and the client accepts it."""
+    body = _encode_bytes(payload)
+    coding = _accepted_coding(request) if len(body) >= COMPRESSION_MIN_BYTES else None
+    headers = {"Vary": "Accept-Encoding"}
+    if coding is not None:
+        body = _compress(body, coding)
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ------------------------------------------------------------
+# Response cache: serialized REST bodies, valid while the state version holds
+# - Compressed variants sit next to the identity body and are built on first request
+# ------------------------------------------------------------
+class ResponseCache:
+    """Encoded response bodies keyed by route; rebuilt only when that route's version moves."""
+
+    def __init__(self):
+        self._entries: Dict[Tuple, Tuple[int, Dict[str, bytes]]] = {}
+
+    def get(self, key: Tuple, version: int, build: Callable[[], Any], coding: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+        """(body, content coding actually applied) for the route at this version."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            entry = (version, {"identity": _encode_bytes(build())})
+            self._entries[key] = entry
+        variants = entry[1]
+        if coding is None or len(variants["identity"]) < COMPRESSION_MIN_BYTES:
+            return variants["identity"], None
+        body = variants.get(coding)
+        if body is None:
+            body = variants[coding] = _compress(variants["identity"], coding)
+        return body, coding
+
+    def clear(self):
+        self._entries.clear()
+
+response_cache = ResponseCache()
+
+def _etag(version: int) -> str:
+    return f'W/"{version}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    # Weak comparison: W/"5" and "5" name the same version
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+def _cached_json(request: Request, key: Tuple, version: int, build: Callable[[], Any]) -> Response:
+    etag = _etag(version)
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    body, coding = response_cache.get(key, version, build, _accepted_coding(request))
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _sparse_json(request: Request, version: int, build: Callable[[], Any]) -> Response:
+    """ETag/304 like _cached_json, but the body is not cached (field sets are open-ended)."""
+    etag = _etag(version)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+    response = _json_response(request, build())
+    response.headers["ETag"] = etag
+    return response
+
+def _conveyor_version(conveyor_id: int, category: Optional[str] = None) -> int:
+    _ensure_generated([conveyor_id])
+    if category is None:
+        return STATE.conveyor_version(conveyor_id)
+    return STATE.category_version(conveyor_id, category)
+
+def _conveyor_ids_for_topics(topics: List[Tuple]) -> List[int]:
+    if any(topic[0] == "facility" for topic in topics):
+        return registry.ids()
+    return sorted({topic[1] for topic in topics if topic[1] in registry})
+
+# ------------------------------------------------------------
+# Delta encoding for /ws?mode=delta
+# - keyframe: {"type": "keyframe", "seq": n, ...full facility payload}
+# - delta:    {"type": "delta", "seq": n, "base_seq": m, "timestamp": ...,
+#              "changes": {"conveyor_belts.conveyor_1.overall_facility.temperature": 22.4, ...},
+#              "removed": [...paths no longer present...]}
+# seq is the facility version; a delta applies to the frame whose seq == base_seq.
+# Ticks where nothing changed send no frame. Clients can ask for a keyframe at any time.
+# ------------------------------------------------------------
+DELTA_KEYFRAME_INTERVAL = 12  # full keyframe every N frames (once a minute at 5s ticks)
+
+_MISSING = object()
+
+def _flatten(node: Any, prefix: str, out: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(node, dict):
+        for key, value in node.items():
+            _flatten(value, f"{prefix}.{key}", out)
+    else:
+        out[prefix] = node
+    return out
+
+def _leaves(payload: Dict[str, Any]) -> Dict[str, Any]:
+    leaves = {"facility_status": payload["facility_status"], "simulation_paused": payload["simulation_paused"]}
+    return _flatten(payload["conveyor_belts"], "conveyor_belts", leaves)
+
+def _unflatten(leaves: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of _leaves: rebuild the nested facility payload (onto payload) from leaf paths."""
+    for path, value in leaves.items():
+        *parents, key = path.split(".")
+        node = payload
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    payload.setdefault("conveyor_belts", {})  # an empty fleet has no leaves under it
+    return payload
+
+class DeltaEncoder:
+    """Turns consecutive facility payloads into one shared stream of keyframes and deltas."""
+
+    def __init__(self, keyframe_interval: int = DELTA_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.reset()
+
+    def reset(self):
+        self.seq = 0  # facility version of the last emitted frame
+        self.leaves: Dict[str, Any] = {}
+        self.payload: Optional[Dict[str, Any]] = None
+        self.timestamp: Optional[str] = None
+        self._frames_since_keyframe = 0
+        self._keyframe: Optional[Frame] = None
+        self._keyframe_size = 0  # JSON size of the last keyframe sent, to weigh deltas against
+
+    def ready(self) -> bool:
+        """Whether there is a current state to build a keyframe from."""
+        return self.payload is not None or bool(self.leaves)
+
+    def keyframe(self) -> Frame:
+        """Full frame for the current seq; built lazily and reused until the next tick."""
+        if self._keyframe is None:
+            if self.payload is None and self.leaves:
+                self.payload = _unflatten(self.leaves, {"timestamp": self.timestamp, "seq": self.seq})
+            self._keyframe = Frame({"type": "keyframe", **(self.payload or {})})
+        return self._keyframe
+
+    def follow(self, frame: Frame) -> bool:
+        """Mirror another encoder's stream (gateways). False when a delta doesn't apply to our state."""
+        payload = frame.payload
+        if payload["type"] == "keyframe":
+            self.payload = {key: value for key, value in payload.items() if key != "type"}
+            self.leaves = _leaves(self.payload)
+            self._keyframe = frame
+        elif self.ready() and payload["base_seq"] == self.seq:
+            leaves = dict(self.leaves)
+            leaves.update(payload["changes"])
+            for path in payload.get("removed", ()):
+                leaves.pop(path, None)
+            self.leaves = leaves
+            self.payload = self._keyframe = None  # rebuilt from the leaves if a keyframe is asked for
+        else:
+            self.reset()
+            return False
+        self.seq, self.timestamp = payload["seq"], payload["timestamp"]
+        return True
+
+    def encode(self, payload: Dict[str, Any]) -> Optional[Frame]:
+        """Next frame of the stream, or None when the facility version hasn't moved."""
+        if self.payload is not None and payload["seq"] == self.seq:
+            return None
+        leaves = _leaves(payload)
+        previous = self.leaves
+        base_seq, self.seq = self.seq, payload["seq"]
+        self.leaves = leaves
+        self.payload = payload
+        self._keyframe = None
+        if not previous or base_seq > self.seq or self._frames_since_keyframe + 1 >= self.keyframe_interval:
+            # base_seq > seq: the version went back (an older checkpoint was restored); start over
+            return self._send_keyframe()
+        changes = {}
+        for path, value in leaves.items():
+            old = previous.get(path, _MISSING)
+            if old is _MISSING or type(old) is not type(value) or old != value:
+                changes[path] = value
+        frame = {"type": "delta", "seq": self.seq, "base_seq": base_seq, "timestamp": payload["timestamp"], "changes": changes}
+        removed = [path for path in previous if path not in leaves]
+        if removed:
+            frame["removed"] = removed
+        delta = Frame(frame)
+        if len(delta.encoded("json")) >= self._keyframe_size:
+            # Path-keyed changes outweigh the full frame (e.g. a fleet-wide reset)
+            return self._send_keyframe()
+        self._frames_since_keyframe += 1
+        return delta
+
+    def _send_keyframe(self) -> Frame:
+        self._frames_since_keyframe = 0
+        frame = self.keyframe()
+        self._keyframe_size = len(frame.encoded("json"))
+        return frame
+
+delta_encoder = DeltaEncoder()
+
+def build_topic_frames(topics: List[Tuple]) -> Dict[Tuple, Frame]:
+    """Build the snapshot needed by the given topics once and encode one frame per topic."""
+    if not topics:
+        return {}
+    timestamp = _timestamp()
+    batch = read_batch(_conveyor_ids_for_topics(topics))
+    snapshots = {cid: batch.snapshot(cid) for cid in batch.conveyor_ids}
+    frames: Dict[Tuple, Frame] = {}
+    for topic in topics:
+        if topic[0] != "facility" and topic[1] not in snapshots:
+            continue  # conveyor was removed from the registry
+        if topic[0] == "facility":
+            conveyor_data = {f"conveyor_{cid}": snap for cid, snap in snapshots.items()}
+            payload = {"timestamp": timestamp, "seq": STATE.version, "facility_status": "operational", "simulation_paused": paused, "conveyor_belts": conveyor_data}
+            if topic == FACILITY_DELTA_TOPIC:
+                frame = delta_encoder.encode(payload)
+                if frame is not None:
+                    frames[topic] = frame
+                    event_log.append(frame)
+                continue
+        elif topic[0] == "conveyor":
+            cid = topic[1]
+            payload = {"timestamp": timestamp, "seq": STATE.conveyor_version(cid), "conveyor_id": cid, "data": snapshots[cid]}
+        else:
+            _, cid, category_name = topic
+            payload = {"timestamp": timestamp, "seq": STATE.category_version(cid, category_name), "conveyor_id": cid, "category_name": category_name, "data": snapshots[cid].get(category_name)}
+        frames[topic] = Frame(payload)
+    return frames
+
+def build_spc_frames(topics: List[Tuple]) -> Dict[Tuple, Frame]:
+    """One frame per SPC topic with the rule onsets queued since the last tick; unheard events are dropped."""
+    events = SPC.drain()
+    if not events or not topics:
+        return {}
+    timestamp = _timestamp()
+    by_conveyor: Dict[int, List[Dict[str, Any]]] = {}
+    for event in events:
+        by_conveyor.setdefault(event["conveyor_id"], []).append(event)
+    frames: Dict[Tuple, Frame] = {}
+    for topic in topics:
+        picked = events if topic == SPC_TOPIC else by_conveyor.get(topic[1])
+        if picked:
+            frames[topic] = Frame({"type": "spc", "seq": picked[-1]["seq"], "timestamp": timestamp, "events": picked})
+    return frames
+
+async def publish_tick():
+    topics = set(manager.topics())
+    if event_log.recording():
+        topics.add(FACILITY_DELTA_TOPIC)
+    if tick_feed is not None:
+        topics |= tick_feed.topics()
+    frames = build_topic_frames([topic for topic in topics if topic[0] != "spc"])
+    frames.update(build_spc_frames([topic for topic in topics if topic[0] == "spc"]))
+    if tick_feed is not None:
+        tick_feed.send(frames)
+    if frames:
+        await asyncio.gather(*(manager.broadcast(topic, message, delta_encoder.keyframe if topic == FACILITY_DELTA_TOPIC else None)
+                               for topic, message in frames.items()))
+
+async def _broadcast_loop():
+    while True:
+        try:
+            if shared_state is not None:
+                await shared_state.refresh()
+            await publish_tick()
+        except Exception as e:
+            print(f"Broadcast tick failed: {e}")
+        await asyncio.sleep(BROADCAST_INTERVAL_SECONDS)
+
+# ------------------------------------------------------------
+# Server-Sent Events (/events): the delta stream over plain HTTP
+# - Every frame the delta encoder emits is kept, pre-encoded, in a bounded backlog;
+#   the event id is the frame's seq, so a delta's base_seq is the previous event's id
+# - Last-Event-ID (header, or ?last_event_id=) found in the backlog resumes with just
+#   the missed events; anything else starts from a keyframe of the current state
+# - The backlog keeps filling for SSE_RETAIN_SECONDS after the last client leaves,
+#   so a client that reconnects within that window misses nothing
+# ------------------------------------------------------------
+SSE_BACKLOG_EVENTS = 720  # one hour of 5s ticks
+SSE_BACKLOG_BYTES = 64 * 1024 * 1024
+SSE_RETAIN_SECONDS = 300.0
+SSE_HEARTBEAT_SECONDS = 15.0
+SSE_RETRY_MS = 3000
+
+def _sse_event(event_id: int, frame: Frame) -> bytes:
+    return f"id: {event_id}\nevent: {frame.payload['type']}\ndata: {frame.encoded('json')}\n\n".encode("utf-8")
+
+class EventLog:
+    """Bounded backlog of encoded SSE events with strictly increasing ids."""
+
+    def __init__(self, max_events: int = SSE_BACKLOG_EVENTS, max_bytes: int = SSE_BACKLOG_BYTES):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.ids: deque = deque()
+        self.events: deque = deque()
+        self.size = 0
+        self.clients = 0
+        self.last_client_left = 0.0
+        self._changed = asyncio.Event()
+
+    def recording(self) -> bool:
+        return self.clients > 0 or time() - self.last_client_left < SSE_RETAIN_SECONDS
+
+    def append(self, frame: Frame):
+        event_id = frame.payload["seq"]
+        if self.ids and event_id < self.ids[-1]:
+            # The stream restarted from an older seq (a checkpoint restore): its ids would never
+            # be stored, so drop the old ones; resuming clients resync from this keyframe
+            self.clear()
+        # A keyframe of a state already in the log (encoder reset) isn't stored, but still
+        # wakes streams waiting for a first keyframe
+        if not self.ids or event_id > self.ids[-1]:
+            data = _sse_event(event_id, frame)
+            self.ids.append(event_id)
+            self.events.append(data)
+            self.size += len(data)
+            while len(self.ids) > 1 and (len(self.ids) > self.max_events or self.size > self.max_bytes):
+                self.ids.popleft()
+                self.size -= len(self.events.popleft())
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def since(self, last_id: int) -> Optional[List[Tuple[int, bytes]]]:
+        """Events after last_id, or None when last_id isn't in the backlog (resync needed)."""
+        ids = self.ids
+        if ids and ids[-1] == last_id:
+            return []
+        i = bisect.bisect_left(ids, last_id)
+        if i == len(ids) or ids[i] != last_id:
+            return None
+        return [(ids[j], self.events[j]) for j in range(i + 1, len(ids))]
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def clear(self):
+        self.ids.clear()
+        self.events.clear()
+        self.size = 0
+
+event_log = EventLog()
+
+def _sse_keyframe() -> Optional[Tuple[int, bytes]]:
+    if not delta_encoder.ready():
+        if gateway_feed is not None:
+            return None  # the simulator sends one once it sees this gateway wants the stream
+        build_topic_frames([FACILITY_DELTA_TOPIC])
+    return delta_encoder.seq, _sse_event(delta_encoder.seq, delta_encoder.keyframe())
+
+async def _sse_stream(last_id: Optional[int]):
+    event_log.clients += 1
+    manager.topics_changed.set()
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n".encode("utf-8")
+        cursor = last_id
+        resynced = None
+        while True:
+            events = event_log.since(cursor) if cursor is not None else None
+            if events is None and cursor == resynced == delta_encoder.seq:
+                events = []  # the keyframe just sent isn't in the log; wait for the stream to move
+            if events is None:
+                keyframe = _sse_keyframe()
+                if keyframe is None:
+                    if not await event_log.wait(SSE_HEARTBEAT_SECONDS):
+                        yield b": keepalive\n\n"
+                    continue
+                cursor, data = keyframe
+                resynced = cursor
+                yield data
+            elif events:
+                for cursor, data in events:
+                    yield data
+            elif not await event_log.wait(SSE_HEARTBEAT_SECONDS):
+                yield b": keepalive\n\n"
+    finally:
+        event_log.clients -= 1
+        event_log.last_client_left = time()
+
+# ------------------------------------------------------------
+# Tick feed: simulator -> gateway fan-out over a Unix-domain socket
+# - In shared-state mode the writer is the simulator: it builds and encodes each
+#   tick's frames once and streams them to every reader worker, which act as
+#   gateways relaying the frames to their own websocket and SSE clients
+# - Gateways tell the simulator which topics and wire formats their clients use;
+#   a newly wanted topic is answered straight away with its current frame
+#   (a keyframe for the delta stream), so late joiners don't wait for a tick
+# - Whenever the delta stream is produced it goes to every gateway, which follows it:
+#   all processes serve the same seq/base_seq chain and keep the same SSE backlog,
+#   so a client may reconnect to any worker and resume
+# - Messages: !II (meta length, body length), meta JSON, body (the frame's encodings
+#   back to back, in the order the meta lists them)
+# - A gateway that falls TICK_FEED_MAX_BUFFER_BYTES behind is dropped; it reconnects
+#   and resyncs from fresh initial frames
+# ------------------------------------------------------------
+TICK_SOCKET_PATH = os.environ.get("SIMULATED_TICK_SOCKET", "")
+TICK_FEED_MAX_BUFFER_BYTES = 64 * 1024 * 1024
+TICK_FEED_MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+TICK_FEED_INTEREST_SECONDS = 1.0  # gateways also re-check their topics this often (SSE retention expiry)
+TICK_FEED_RECONNECT_SECONDS = 1.0
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+def _tick_socket_path() -> str:
+    return TICK_SOCKET_PATH or os.path.join(os.environ.get("TMPDIR", "/tmp"), f"{SHARED_STATE_NAME}.ticks.sock")
+
+def _feed_message(meta: Dict[str, Any], body: bytes = b"") -> bytes:
+    head = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return struct.pack("!II", len(head), len(body)) + head + body
+
+async def _read_feed_message(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    head_len, body_len = struct.unpack("!II", await reader.readexactly(8))
+    if head_len + body_len > TICK_FEED_MAX_MESSAGE_BYTES:
+        raise ValueError(f"Tick feed message of {head_len + body_len} bytes")
+    head = await reader.readexactly(head_len)
+    return json.loads(head), await reader.readexactly(body_len)
+
+def _feed_record(topic: Tuple, frame: Frame, formats: Tuple[str, ...]) -> bytes:
+    encodings = [frame.encoded(f) for f in formats]
+    encodings = [e.encode("utf-8") if isinstance(e, str) else e for e in encodings]
+    meta = {"topic": list(topic), "seq": frame.payload["seq"], "formats": [[f, len(e)] for f, e in zip(formats, encodings)]}
+    return _feed_message(meta, b"".join(encodings))
+
+def _feed_frame(topic: Tuple, meta: Dict[str, Any], body: bytes) -> Frame:
+    encoded: Dict[str, Union[str, bytes]] = {}
+    offset = 0
+    for wire_format, size in meta["formats"]:
+        data = body[offset:offset + size]
+        offset += size
+        encoded[wire_format] = data.decode("utf-8") if wire_format == "json" else data
+    if topic == FACILITY_DELTA_TOPIC or any(f not in encoded for f in WIRE_FORMATS):
+        # The delta stream is followed, and a format nobody asked for yet is encoded here
+        return Frame.preencoded(_loads(encoded["json"]), encoded)
+    return Frame.preencoded({"seq": meta["seq"]}, encoded)
+
+class TickFeed:
+    """Simulator side: accepts gateways and streams them the frames they subscribe to."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.gateways: Dict[asyncio.StreamWriter, Tuple[Set[Tuple], Tuple[str, ...]]] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        try:
+            os.unlink(self.path)  # left behind by a simulator that didn't shut down cleanly
+        except FileNotFoundError:
+            pass
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    def topics(self) -> Set[Tuple]:
+        topics: Set[Tuple] = set()
+        for wanted, _ in self.gateways.values():
+            topics |= wanted
+        return topics
+
+    def _current_frame(self, topic: Tuple) -> Optional[Frame]:
+        if topic[0] == "spc":
+            return None
+        if topic == FACILITY_DELTA_TOPIC:
+            if not delta_encoder.ready():
+                build_topic_frames([topic])
+            return delta_encoder.keyframe()
+        return manager.last_frames.get(topic) or build_topic_frames([topic]).get(topic)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.gateways[writer] = (set(), ("json",))
+        try:
+            while True:
+                meta, _ = await _read_feed_message(reader)
+                if writer not in self.gateways:
+                    return  # dropped for falling behind
+                wanted, formats = self.gateways[writer]
+                added: Set[Tuple] = set()
+                if "topics" in meta:
+                    topics = {tuple(topic) for topic in meta["topics"]}
+                    formats = tuple(f for f in meta["formats"] if f in WIRE_FORMATS)
+                    added = topics - wanted
+                    self.gateways[writer] = (topics, formats)
+                if meta.get("keyframe"):
+                    added.add(FACILITY_DELTA_TOPIC)
+                for topic in added:
+                    frame = self._current_frame(topic)
+                    if frame is not None:
+                        writer.write(_feed_record(topic, frame, formats))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.gateways.pop(writer, None)
+            writer.close()
+
+    def send(self, frames: Dict[Tuple, Frame]):
+        """Queue this tick's frames for every gateway; never waits on one."""
+        records: Dict[Tuple, bytes] = {}
+        for writer, (wanted, formats) in list(self.gateways.items()):
+            for topic in (wanted | {FACILITY_DELTA_TOPIC}) & frames.keys():
+                record = records.get((topic, formats))
+                if record is None:
+                    record = records[(topic, formats)] = _feed_record(topic, frames[topic], formats)
+                writer.write(record)
+            backlog = writer.transport.get_write_buffer_size()
+            if backlog > TICK_FEED_MAX_BUFFER_BYTES:
+                print(f"Tick feed gateway is {backlog} bytes behind; dropping it")
+                self.gateways.pop(writer, None)
+                writer.transport.abort()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for writer in list(self.gateways):
+            writer.transport.abort()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+class GatewayFeed:
+    """Gateway side: subscribes to the simulator's feed and relays its frames to local clients."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connected = False
+
+    def interest(self) -> Tuple[Set[Tuple], Tuple[str, ...]]:
+        topics = set(manager.topics())
+        if event_log.recording():
+            topics.add(FACILITY_DELTA_TOPIC)
+        formats = {channel.wire_format for channel in list(manager.channels.values())} | {"json"}
+        return topics, tuple(sorted(formats))
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(TICK_FEED_RECONNECT_SECONDS)
+                continue
+            self.connected = True
+            delta_encoder.reset()  # followed afresh from the simulator's first keyframe
+            subscriber = asyncio.create_task(self._subscribe(writer))
+            try:
+                while True:
+                    meta, body = await _read_feed_message(reader)
+                    await self._relay(writer, meta, body)
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+                print(f"Tick feed from {self.path} lost ({e!r}); reconnecting")
+            finally:
+                self.connected = False
+                subscriber.cancel()
+                writer.close()
+            await asyncio.sleep(TICK_FEED_RECONNECT_SECONDS)
+
+    async def _subscribe(self, writer: asyncio.StreamWriter):
+        """Tell the simulator whenever the topics or wire formats wanted here change."""
+        sent = None
+        while True:
+            manager.topics_changed.clear()
+            interest = self.interest()
+            if interest != sent:
+                topics, formats = interest
+                writer.write(_feed_message({"topics": [list(topic) for topic in topics], "formats": list(formats)}))
+                await writer.drain()
+                sent = interest
+            try:
+                await asyncio.wait_for(manager.topics_changed.wait(), TICK_FEED_INTEREST_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _relay(self, writer: asyncio.StreamWriter, meta: Dict[str, Any], body: bytes):
+        topic = tuple(meta["topic"])
+        frame = _feed_frame(topic, meta, body)
+        if topic == FACILITY_DELTA_TOPIC:
+            if not delta_encoder.follow(frame):
+                writer.write(_feed_message({"keyframe": True}))
+                return
+            event_log.append(frame)
+        await manager.broadcast(topic, frame, delta_encoder.keyframe if topic == FACILITY_DELTA_TOPIC else None)
+
+tick_feed: Optional[TickFeed] = None
+gateway_feed: Optional[GatewayFeed] = None
+
+# ------------------------------------------------------------
+# Multiplexed subscriptions (/ws/subscribe)
+# Client messages:
+#   {"type": "subscribe", "id": "temps", "conveyors": [1, 2, 3],
+#    "categories": ["production_data"], "fields": ["overall_facility.temperature"], "interval": 2}
+#   {"type": "unsubscribe", "id": "temps"}      (no id: drop every subscription)
+# - conveyors omitted: the whole fleet; categories and fields omitted: every KPI
+# - Each tick reads the union of all due subscriptions once, then each subscription
+#   gets {"type": "update", "id", "seq", "timestamp", "conveyors": {id: {category: {...}}}}
+#   holding only its own KPIs; it is skipped while the category versions of its
+#   conveyors are unchanged since its last update
+# ------------------------------------------------------------
+SUBSCRIPTION_TICK_SECONDS = 1.0
+MAX_SUBSCRIPTIONS_PER_CLIENT = 32
+
+class Subscription:
+    __slots__ = ("conveyors", "kpis", "categories", "interval", "next_due", "last_seq")
+
+    def __init__(self, conveyors: Optional[List[int]], kpis: List[KpiSpec], interval: float):
+        self.conveyors = conveyors
+        self.kpis = kpis
+        self.categories = sorted({CATEGORY_INDEX[k.category] for k in kpis})
+        self.interval = interval
+        self.next_due = 0.0
+        self.last_seq = -1
+
+    def conveyor_ids(self) -> List[int]:
+        if self.conveyors is None:
+            return registry.ids()
+        return [cid for cid in self.conveyors if cid in registry]
+
+def parse_subscription(request: Dict[str, Any]) -> Subscription:
+    """Validate a subscribe message; raises ValueError with a client-facing reason."""
+    conveyors = request.get("conveyors")
+    if conveyors is not None:
+        if not isinstance(conveyors, list) or not all(isinstance(c, int) and not isinstance(c, bool) for c in conveyors):
+            raise ValueError("conveyors must be a list of conveyor ids")
+        unknown = [c for c in conveyors if c not in registry]
+        if unknown:
+            raise ValueError(f"Unknown conveyors: {unknown}")
+        conveyors = sorted(set(conveyors))
+    categories, fields = request.get("categories") or [], request.get("fields") or []
+    if not isinstance(categories, list) or not all(isinstance(c, str) for c in categories):
+        raise ValueError("categories must be a list of category names")
+    if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+        raise ValueError("fields must be a list of dotted field paths")
+    wanted: Set[int] = set()
+    for category in categories:
+        if category not in KPIS_BY_CATEGORY:
+            raise ValueError(f"Unknown category {category!r}; must be one of: {', '.join(VALID_CATEGORIES)}")
+        wanted.update(k.index for k in KPIS_BY_CATEGORY[category])
+    wanted.update(k.index for k in resolve_fields(fields))
+    kpis = [k for k in KPI_SPECS if k.index in wanted] if wanted else list(KPI_SPECS)
+    try:
+        interval = float(request.get("interval", BROADCAST_INTERVAL_SECONDS))
+    except (TypeError, ValueError):
+        raise ValueError("interval must be a number of seconds")
+    if not math.isfinite(interval):
+        raise ValueError("interval must be a number of seconds")
+    return Subscription(conveyors, kpis, max(interval, SUBSCRIPTION_TICK_SECONDS))
+
+class SubscriptionHub:
+    """Per-socket subscriptions; one union read per tick serves every due subscription."""
+
+    def __init__(self):
+        self.clients: Dict[WebSocket, Dict[str, Subscription]] = {}
+
+    def add(self, websocket: WebSocket):
+        self.clients[websocket] = {}
+
+    def remove(self, websocket: WebSocket):
+        self.clients.pop(websocket, None)
+
+    def build_updates(self, now: float, websocket: Optional[WebSocket] = None) -> List[Tuple[WebSocket, Tuple, Frame]]:
+        """(socket, queue key, frame) for every due subscription (of one socket only, if given)."""
+        clients = list(self.clients.items()) if websocket is None else [(websocket, self.clients.get(websocket, {}))]
+        due = [(ws, sub_id, sub) for ws, subs in clients for sub_id, sub in list(subs.items()) if sub.next_due <= now]
+        if not due:
+            return []
+        selections = {}
+        for ws, sub_id, sub in due:
+            sub.next_due = now + sub.interval
+            ids = sub.conveyor_ids()
+            if not ids:
+                continue
+            _ensure_generated(ids)
+            slots = STATE.slots(ids)
+            seq = int(STATE.category_versions[np.ix_(sub.categories, slots)].max())
+            if seq != sub.last_seq:
+                sub.last_seq = seq
+                selections[(ws, sub_id)] = (sub, ids, seq)
+        if not selections:
+            return []
+        union_ids = sorted({cid for _, ids, _ in selections.values() for cid in ids})
+        union_kpis = sorted({k.index for sub, _, _ in selections.values() for k in sub.kpis})
+        kpis = [KPI_SPECS[i] for i in union_kpis]
+        columns = _to_columns(kpis, *_read(kpis, union_ids))
+        position = {cid: j for j, cid in enumerate(union_ids)}
+        timestamp = _timestamp()
+        frames: Dict[Tuple, Frame] = {}
+        updates = []
+        for (ws, sub_id), (sub, ids, seq) in selections.items():
+            # Clients sharing a widget definition share one encoded frame
+            key = (sub_id, tuple(ids), tuple(k.index for k in sub.kpis), seq)
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = Frame({
+                    "type": "update", "id": sub_id, "seq": seq, "timestamp": timestamp,
+                    "conveyors": {str(cid): _nested_values(sub.kpis, columns, position[cid]) for cid in ids},
+                })
+            updates.append((ws, ("subscription", sub_id), frame))
+        return updates
+
+    async def updates(self, now: float, websocket: Optional[WebSocket] = None) -> List[Tuple[WebSocket, Tuple, Frame]]:
+        """build_updates(), off the event loop on readers, whose shared-memory reads may wait out the writer."""
+        if shared_state is None or shared_state.writer:
+            return self.build_updates(now, websocket)
+        return await asyncio.to_thread(self.build_updates, now, websocket)
+
+    async def tick(self, now: float):
+        updates = await self.updates(now)
+        if not updates:
+            return
+        for ws, key, frame in updates:
+            manager.send(ws, frame, key)
+
+subscription_hub = SubscriptionHub()
+
+async def _subscription_loop():
+    while True:
+        try:
+            if shared_state is not None:
+                await shared_state.refresh()
+            await subscription_hub.tick(clock.now())
+        except Exception as e:
+            print(f"Subscription tick failed: {e}")
+        await asyncio.sleep(SUBSCRIPTION_TICK_SECONDS)
 
 # ------------------------------------------------------------
 # API Models
@@ -443,9 +3377,34 @@ class RulesPatch(BaseModel):
     field: str
     interval_seconds: int
 
+class ClockConfig(BaseModel):
+    warp: Optional[float] = None
+    manual: Optional[bool] = None
+
+class ClockStep(BaseModel):
+    seconds: float
+
+class BatchSelector(BaseModel):
+    conveyor_id: int
+    category: Optional[str] = None  # None selects the full conveyor snapshot
+
+class BatchRequest(BaseModel):
+    selectors: List[BatchSelector]
+
+class ConveyorConfig(BaseModel):
+    id: int
+    status: str = "operational"
+
+class ConveyorStatusUpdate(BaseModel):
+    status: str
+
 # ------------------------------------------------------------
 # Routes
 # ------------------------------------------------------------
+def _require_conveyor(conveyor_id: int):
+    if conveyor_id not in registry:
+        raise HTTPException(status_code=404, detail=f"Conveyor {conveyor_id} not found")
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "SimulatedAPI"}
@@ -454,81 +3413,250 @@ def health_check():
 def read_root():
     return {"message": "Industrial Facility Monitoring API - Optimized"}
 
+# Snapshot routes return cached bytes directly, with the slice's version as ETag.
+# Timestamps are the time the body was built.
+# fields= (comma-separated dotted paths) narrows a route to those KPIs; see resolve_fields.
+def _fields_param(fields: Optional[str], category: Optional[str] = None) -> Optional[List[KpiSpec]]:
+    if fields is None:
+        return None
+    selectors = [f for f in fields.split(",") if f.strip()]
+    if not selectors:
+        raise HTTPException(status_code=400, detail="fields must name at least one path")
+    try:
+        return resolve_fields(selectors, category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/data")
-def get_data():
-    return get_all_facility_data()
+def get_data(request: Request, fields: Optional[str] = None):
+    kpis = _fields_param(fields)
+    ids = registry.ids()
+    _ensure_generated(ids)
+    if kpis is None:
+        return _cached_json(request, ("data",), STATE.version, get_all_facility_data)
+    return _sparse_json(request, STATE.version, lambda: {
+        "timestamp": _timestamp(), "seq": STATE.version, "facility_status": "operational", "simulation_paused": paused,
+        "conveyor_belts": {f"conveyor_{cid}": snap for cid, snap in get_sparse_snapshots(ids, kpis).items()}})
 
 @app.get("/conveyor/{conveyor_id}")
-def get_conveyor_data(conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    facility_data = get_all_facility_data()
-    conveyor = facility_data["conveyor_belts"].get(f"conveyor_{conveyor_id}")
-    if not conveyor:
-        raise HTTPException(status_code=404, detail=f"Conveyor {conveyor_id} not found")
-    return {"timestamp": facility_data["timestamp"], "conveyor_id": conveyor_id, "data": conveyor}
+def get_conveyor_data(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    _require_conveyor(conveyor_id)
+    kpis = _fields_param(fields)
+    version = _conveyor_version(conveyor_id)
+    if kpis is None:
+        return _cached_json(request, ("conveyor", conveyor_id), version, lambda: {
+            "timestamp": _timestamp(), "seq": version, "conveyor_id": conveyor_id, "data": get_conveyor_snapshot(conveyor_id)})
+    return _sparse_json(request, version, lambda: {
+        "timestamp": _timestamp(), "seq": version, "conveyor_id": conveyor_id,
+        "data": get_sparse_snapshots([conveyor_id], kpis)[conveyor_id]})
 
 @app.post("/category/{conveyor_id}")
-def get_category_data(conveyor_id: int, request: CategoryRequest):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    valid_categories = ["overall_facility", "production_data", "equipment_performance", "quality_control", "equipment_details"]
-    if request.category_name not in valid_categories:
-        raise HTTPException(status_code=400, detail=f"Category name must be one of: {', '.join(valid_categories)}")
-    snapshot = get_conveyor_snapshot(conveyor_id)
-    category_data = snapshot.get(request.category_name)
-    if category_data is None:
-        raise HTTPException(status_code=404, detail=f"Category {request.category_name} not found for conveyor {conveyor_id}")
-    return {"timestamp": datetime.now().isoformat(), "conveyor_id": conveyor_id, "category": request.category_name, "data": category_data}
+def get_category_data(conveyor_id: int, body: CategoryRequest, request: Request):
+    _require_conveyor(conveyor_id)
+    category = body.category_name
+    if category not in VALID_CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"Category name must be one of: {', '.join(VALID_CATEGORIES)}")
+    version = _conveyor_version(conveyor_id, category)
+    return _cached_json(request, ("category", conveyor_id, category), version, lambda: {
+        "timestamp": _timestamp(), "seq": version, "conveyor_id": conveyor_id, "category": category,
+        "data": read_batch([conveyor_id], [category]).category_data(conveyor_id, category)})
+
+def _category_route(request: Request, conveyor_id: int, category: str, build: Callable[[int], Any],
+                    fields: Optional[str] = None) -> Response:
+    _require_conveyor(conveyor_id)
+    kpis = _fields_param(fields, category)
+    version = _conveyor_version(conveyor_id, category)
+    if kpis is None:
+        return _cached_json(request, (category, conveyor_id), version, lambda: build(conveyor_id))
+    return _sparse_json(request, version, lambda: get_sparse_snapshots([conveyor_id], kpis)[conveyor_id][category])
 
 @app.get("/conveyor/{conveyor_id}/overall")
-def get_conveyor_overall(conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    return simulate_overall_facility_data(conveyor_id)
+def get_conveyor_overall(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    return _category_route(request, conveyor_id, "overall_facility", simulate_overall_facility_data, fields)
 
 @app.get("/conveyor/{conveyor_id}/production")
-def get_conveyor_production(conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    return simulate_production_data(conveyor_id)
+def get_conveyor_production(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    return _category_route(request, conveyor_id, "production_data", simulate_production_data, fields)
 
 @app.get("/conveyor/{conveyor_id}/equipment")
-def get_conveyor_equipment(conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    return simulate_equipment_performance_data(conveyor_id)
+def get_conveyor_equipment(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    return _category_route(request, conveyor_id, "equipment_performance", simulate_equipment_performance_data, fields)
 
 @app.get("/conveyor/{conveyor_id}/quality")
-def get_conveyor_quality(conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    return simulate_quality_control_data(conveyor_id)
+def get_conveyor_quality(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    return _category_route(request, conveyor_id, "quality_control", simulate_quality_control_data, fields)
 
 @app.get("/conveyor/{conveyor_id}/equipment-details")
-def get_conveyor_equipment_details(conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        raise HTTPException(status_code=404, detail="Conveyor ID must be between 1 and 5")
-    return simulate_equipment_perf_data(conveyor_id)
+def get_conveyor_equipment_details(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    return _category_route(request, conveyor_id, "equipment_details", simulate_equipment_perf_data, fields)
+
+# ---- Batch reads ----
+MAX_BATCH_SELECTORS = 1000
+
+@app.post("/batch")
+def get_batch(body: BatchRequest, request: Request):
+    """Several conveyor/category slices in one round trip, all read from the same snapshot."""
+    selectors = body.selectors
+    if not selectors:
+        raise HTTPException(status_code=400, detail="selectors must not be empty")
+    if len(selectors) > MAX_BATCH_SELECTORS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SELECTORS} selectors per batch")
+    for sel in selectors:
+        _require_conveyor(sel.conveyor_id)
+        if sel.category is not None and sel.category not in VALID_CATEGORIES:
+            raise HTTPException(status_code=400, detail=f"Category name must be one of: {', '.join(VALID_CATEGORIES)}")
+    conveyor_ids = sorted({sel.conveyor_id for sel in selectors})
+    wanted = {sel.category for sel in selectors}
+    categories = VALID_CATEGORIES if None in wanted else [cat for cat in VALID_CATEGORIES if cat in wanted]
+    batch = read_batch(conveyor_ids, categories)
+    results = []
+    for sel in selectors:
+        cid, category = sel.conveyor_id, sel.category
+        if category is None:
+            results.append({"conveyor_id": cid, "category": None, "seq": STATE.conveyor_version(cid), "data": batch.snapshot(cid)})
+        else:
+            results.append({"conveyor_id": cid, "category": category, "seq": STATE.category_version(cid, category),
+                            "data": batch.category_data(cid, category)})
+    return _json_response(request, {"timestamp": _timestamp(), "seq": STATE.version, "results": results})
+
+# ---- Server-Sent Events ----
+@app.get("/events")
+async def stream_events(request: Request, last_event_id: Optional[str] = None):
+    """Delta stream as text/event-stream; EventSource resends Last-Event-ID on reconnect."""
+    raw = request.headers.get("last-event-id") or last_event_id
+    try:
+        last_id = int(raw) if raw else None
+    except ValueError:
+        last_id = None  # not one of ours: start from a keyframe
+    return StreamingResponse(_sse_stream(last_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ---- Simulation status ----
 @app.post("/simulate/status/")
-def update_simulation_status(active: bool):
+async def update_simulation_status(active: bool):
     global paused
-    paused = not active
+    if paused != (not active):
+        paused = not active
+        STATE.touch()
     return {"simulation_active": active, "paused": paused, "status": "ok", "timestamp": datetime.now().isoformat()}
 
 @app.get("/simulate/status/")
 def check_simulation_status():
     return {"simulation_active": not paused, "paused": paused, "timestamp": datetime.now().isoformat()}
 
+# ---- Metrics ----
+@app.get("/metrics")
+def get_metrics():
+    return Response(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ---- KPI history & rollups ----
+def _numeric_kpi(category: str, field: str) -> KpiSpec:
+    kpi = KPI_BY_PATH.get((category, field))
+    if kpi is None:
+        raise HTTPException(status_code=404, detail=f"Unknown KPI {category}/{field}; use a dotted path like power_usage.current_kw")
+    if kpi.kind == "choice":
+        raise HTTPException(status_code=400, detail=f"{category}/{field} is categorical and has no numeric history")
+    return kpi
+
+def _history_slot(conveyor_id: int) -> int:
+    _ensure_generated([conveyor_id])
+    slot = STATE.slot_of(conveyor_id)
+    if slot >= HISTORY_MAX_CONVEYORS:
+        raise HTTPException(status_code=404, detail=f"History is kept for the first {HISTORY_MAX_CONVEYORS} conveyors only (SIMULATED_HISTORY_MAX_CONVEYORS)")
+    return slot
+
+@app.get("/history/{conveyor_id}/{category}/{field}")
+def get_kpi_history(conveyor_id: int, category: str, field: str, request: Request, start: Optional[float] = None,
+                    end: Optional[float] = None, max_points: int = 300):
+    """Samples of one KPI between start and end (epoch seconds), downsampled to max_points."""
+    _require_conveyor(conveyor_id)
+    kpi = _numeric_kpi(category, field)
+    if not 3 <= max_points <= HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"max_points must be between 3 and {HISTORY_MAX_POINTS}")
+    times, values = HISTORY.series(_history_slot(conveyor_id), kpi)
+    if start is not None or end is not None:
+        keep = (times >= (start if start is not None else -math.inf)) & (times <= (end if end is not None else math.inf))
+        times, values = times[keep], values[keep]
+    raw_points = len(times)
+    times, values = lttb(times, values, max_points)
+    if kpi.kind == "float":
+        out_values = np.round(values, kpi.decimals).tolist()
+    elif kpi.kind == "int":
+        out_values = np.rint(values).astype(np.int64).tolist()
+    else:
+        out_values = (values > 0.5).tolist()
+    return _json_response(request, {
+        "conveyor_id": conveyor_id,
+        "category": category,
+        "field": field,
+        "raw_points": raw_points,
+        "timestamps": np.round(times, 3).tolist(),
+        "values": out_values,
+    })
+
+@app.get("/rollups/{conveyor_id}/{category}/{field}")
+def get_kpi_rollups(conveyor_id: int, category: str, field: str, start: Optional[float] = None,
+                    end: Optional[float] = None, level: Optional[str] = None):
+    """Min/max/mean/count buckets overlapping [start, end] (default: the last hour) plus a window summary.
+
+    Without `level`, the finest level that still holds `start` is used. The summary is
+    clipped to the window: coarse buckets cover its interior and finer ones its edges.
+    """
+    _require_conveyor(conveyor_id)
+    kpi = _numeric_kpi(category, field)
+    now = clock.now()
+    end = now if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    names = [name for name, _, _ in ROLLUP_LEVELS]
+    if level is None:
+        level_index = ROLLUPS.level_for(start, now)
+    elif level in names:
+        level_index = names.index(level)
+    else:
+        raise HTTPException(status_code=400, detail=f"level must be one of {names}")
+    width = ROLLUP_LEVELS[level_index][1]
+    slot = _history_slot(conveyor_id)
+    buckets = ROLLUPS.buckets(level_index, slot, kpi, start, end)
+    decimals = kpi.decimals if kpi.kind == "float" else 3
+
+    def stats(lo: float, hi: float, total: float, count: int) -> Dict[str, Any]:
+        return {"min": round(lo, decimals), "max": round(hi, decimals), "mean": round(total / count, 3 if kpi.kind != "float" else decimals), "count": count}
+
+    window = ROLLUPS.summary(slot, kpi, start, end, now)
+    return {
+        "conveyor_id": conveyor_id,
+        "category": category,
+        "field": field,
+        "level": names[level_index],
+        "bucket_seconds": width,
+        "start": start,
+        "end": end,
+        "summary": stats(*window) if window else None,
+        "buckets": [{"start": epoch * width, **stats(lo, hi, total, count)} for epoch, lo, hi, total, count in buckets],
+    }
+
+# ---- Statistical process control ----
+@app.get("/spc/{conveyor_id}")
+def get_spc(conveyor_id: int, request: Request, fields: Optional[str] = None):
+    """Running SPC stats, control limits and firing rules for the conveyor's numeric KPIs."""
+    _require_conveyor(conveyor_id)
+    report = SPC.report(conveyor_id, _fields_param(fields) or SPC_KPIS)
+    out_of_control = [f"{category}.{kpi}" for category, entries in report.items() for kpi, entry in entries.items() if entry.get("rules")]
+    return _json_response(request, {
+        "timestamp": _timestamp(), "conveyor_id": conveyor_id, "status": registry.status(conveyor_id),
+        "min_samples": SPC_MIN_SAMPLES, "rules": dict(SPC_RULES), "out_of_control": out_of_control, "kpis": report,
+    })
+
 # ---- KPI Rules admin ----
 @app.get("/kpi-rules")
 def get_kpi_rules():
     return UPDATE_RULES
 
 @app.patch("/kpi-rules")
-def patch_kpi_rule(patch: RulesPatch):
+async def patch_kpi_rule(patch: RulesPatch):
+    # The admin writers are async so they run on the event loop, between scheduler passes and broadcasts
     cat = patch.category
     field = patch.field
     if patch.interval_seconds < 0:
@@ -536,59 +3664,257 @@ def patch_kpi_rule(patch: RulesPatch):
     if cat not in UPDATE_RULES:
         UPDATE_RULES[cat] = {}
     UPDATE_RULES[cat][field] = int(patch.interval_seconds)
-    # Reset timestamps so changes take effect immediately on next access
-    for cid in range(1, 6):
-        if cid in STATE and cat in STATE[cid] and field in STATE[cid][cat]:
-            STATE[cid][cat][field]["t"] = 0.0
+    # Regenerate now so changes take effect immediately, then follow the new cadence
+    STATE.reset_stamps(cat, field)
+    group = _GROUP_INDEX.get((cat, field))
+    if group is not None:
+        scheduler.schedule(group, clock.now())
     return {"ok": True, "updated": {cat: {field: UPDATE_RULES[cat][field]}}}
 
+# ---- Simulation clock admin ----
+@app.get("/clock")
+def get_clock():
+    return clock.as_dict()
+
+@app.put("/clock")
+async def configure_clock(config: ClockConfig):
+    if config.warp is not None and config.warp <= 0:
+        raise HTTPException(status_code=400, detail="warp must be > 0")
+    clock.configure(warp=config.warp, manual=config.manual)
+    return clock.as_dict()
+
+@app.post("/clock/step")
+async def step_clock(step: ClockStep):
+    # async so each scheduler event of the catch-up runs on the event loop, never alongside a scheduler pass
+    if not clock.manual:
+        raise HTTPException(status_code=400, detail="Stepping requires manual mode (PUT /clock {\"manual\": true})")
+    if not 0 < step.seconds <= MAX_CLOCK_STEP_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {MAX_CLOCK_STEP_SECONDS}]")
+    runs = await scheduler.advance(step.seconds)
+    return {**clock.as_dict(), "group_runs": runs}
+
+# ---- Conveyor fleet admin ----
+@app.get("/conveyors")
+def list_conveyors():
+    return {"count": len(registry), "conveyors": registry.as_list()}
+
+@app.put("/conveyors")
+async def replace_conveyors(conveyors: List[ConveyorConfig]):
+    fleet = {c.id: c.status for c in conveyors}
+    previous = {cid: registry.status(cid) for cid in STATE.conveyor_ids() if cid in registry}
+    with _state_write():  # a republish never pairs new statuses with old values
+        try:
+            registry.replace(fleet)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for cid, status in previous.items():
+            if fleet.get(cid) != status:
+                _forget_conveyor_state(cid)
+            if cid not in fleet:
+                SPC.forget(cid)  # kept across status changes, so a new status is judged against the old one
+    response_cache.clear()
+    STATE.touch()
+    return {"ok": True, "count": len(registry)}
+
+@app.put("/conveyors/{conveyor_id}")
+async def upsert_conveyor(conveyor_id: int, update: ConveyorStatusUpdate):
+    previous = registry.status(conveyor_id) if conveyor_id in registry else None
+    with _state_write():
+        try:
+            registry.set(conveyor_id, update.status)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if previous != update.status:
+            # Cadenced values were drawn for the old status; regenerate them
+            _forget_conveyor_state(conveyor_id)
+    return {"ok": True, "conveyor": {"id": conveyor_id, "status": update.status}}
+
+@app.delete("/conveyors/{conveyor_id}")
+async def delete_conveyor(conveyor_id: int):
+    _require_conveyor(conveyor_id)
+    with _state_write():
+        registry.remove(conveyor_id)
+        _forget_conveyor_state(conveyor_id)
+        SPC.forget(conveyor_id)
+    return {"ok": True, "count": len(registry)}
+
 # ------------------------------------------------------------
-# WebSockets - publish snapshots every 5s; only due KPIs will change.
+# WebSockets - a single producer publishes snapshots every 5s; only due KPIs will change.
+# Handlers just subscribe and wait for the client to go away.
 # ------------------------------------------------------------
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+@app.on_event("startup")
+async def start_background_tasks():
+    global recorder, shared_state, tick_feed, gateway_feed
+    if SHARED_STATE_NAME:
+        shared_state = SharedState(SHARED_STATE_NAME)
+        if not shared_state.writer:
+            await asyncio.to_thread(shared_state.start_reader)
+            # Topic broadcasts come ready-encoded from the simulator; only subscriptions are built here
+            gateway_feed = GatewayFeed(_tick_socket_path())
+            print(f"Worker {os.getpid()} reading shared state {SHARED_STATE_NAME!r} ({len(registry)} conveyors), "
+                  f"relaying ticks from {gateway_feed.path}")
+            app.state.feed_task = asyncio.create_task(gateway_feed.run())
+            app.state.subscription_task = asyncio.create_task(_subscription_loop())
+            return
+    if REPLAY_PATH:
+        log = start_replay(REPLAY_PATH)
+        print(f"Replaying {REPLAY_PATH} at {REPLAY_SPEED}x ({len(log)} blocks, seed {log.header['seed']})")
+        app.state.scheduler_task = asyncio.create_task(_replay_loop(log, REPLAY_SPEED))
+    else:
+        if restore_checkpoint():
+            print(f"Restored simulation state from {CHECKPOINT_PATH} ({len(registry)} conveyors, seq {STATE.version})")
+        if RECORD_PATH:
+            recorder = TickRecorder(RECORD_PATH)
+            print(f"Recording generated ticks to {RECORD_PATH} (seed {SIMULATION_SEED})")
+        app.state.scheduler_task = asyncio.create_task(_scheduler_loop())
+        app.state.checkpoint_task = asyncio.create_task(_checkpoint_loop())
+    if shared_state is not None:
+        shared_state.start_writer()
+        app.state.mailbox_task = asyncio.create_task(shared_state.serve_mailbox())
+        tick_feed = TickFeed(_tick_socket_path())
+        await tick_feed.start()
+        print(f"Worker {os.getpid()} is the shared-state writer for {SHARED_STATE_NAME!r}, publishing ticks on {tick_feed.path}")
+    app.state.broadcast_task = asyncio.create_task(_broadcast_loop())
+    app.state.subscription_task = asyncio.create_task(_subscription_loop())
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for name in ("checkpoint_task", "subscription_task", "broadcast_task", "scheduler_task", "mailbox_task", "feed_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    if tick_feed is not None:
+        tick_feed.close()
+    if recorder is not None:
+        recorder.close()
+    if shared_state is not None:
+        shared_state.close()
+        if not shared_state.writer:
+            return
+    if REPLAY_PATH:
+        return
+    try:
+        await save_checkpoint(force=True)
+    except Exception as e:
+        print(f"Final checkpoint failed: {e}")
+
+def _initial_frame(topic: Tuple) -> Optional[Frame]:
+    if topic[0] == "spc":
+        return None  # events only; /spc/{conveyor_id} has the current state
+    if gateway_feed is not None:
+        # Gateways only relay: a topic new to this process gets its first frame from the simulator
+        if topic == FACILITY_DELTA_TOPIC:
+            return delta_encoder.keyframe() if delta_encoder.ready() else None
+        return manager.last_frames.get(topic)
+    if topic == FACILITY_DELTA_TOPIC:
+        # Late joiners start from a keyframe of the shared stream so later deltas apply cleanly
+        if topic in manager.last_frames or (tick_feed is not None and topic in tick_feed.topics()):
+            return delta_encoder.keyframe()
+        delta_encoder.reset()
+        return build_topic_frames([topic])[topic]
+    # Reuse the last broadcast if there is one
+    return manager.last_frames.get(topic) or build_topic_frames([topic])[topic]
+
+async def _handle_delta_message(websocket: WebSocket, request: Any):
+    """Delta clients may send "keyframe" (or {"type": "keyframe"}) to resync."""
+    if isinstance(request, dict):
+        request = request.get("type")
+    if request == "keyframe" and delta_encoder.ready():
+        manager.send(websocket, delta_encoder.keyframe(), FACILITY_DELTA_TOPIC, delta_encoder.keyframe)
+
+async def _serve_subscriber(websocket: WebSocket, topic: Tuple):
+    await manager.connect(websocket, topic)
     try:
+        frame = _initial_frame(topic)
+        if frame is not None:
+            manager.send(websocket, frame, topic, delta_encoder.keyframe if topic == FACILITY_DELTA_TOPIC else None)
         while True:
-            await websocket.send_json(get_all_facility_data())
-            await asyncio.sleep(5)
+            message = await _receive_message(websocket)
+            if topic == FACILITY_DELTA_TOPIC:
+                await _handle_delta_message(websocket, message)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        manager.disconnect(websocket, topic)
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, mode: str = "full"):
+    if mode not in ("full", "delta"):
+        await websocket.close(code=1008, reason="Invalid mode. Must be 'full' or 'delta'")
+        return
+    await _serve_subscriber(websocket, FACILITY_DELTA_TOPIC if mode == "delta" else FACILITY_TOPIC)
 
 @app.websocket("/ws/conveyor/{conveyor_id}")
 async def websocket_conveyor_endpoint(websocket: WebSocket, conveyor_id: int):
-    if not 1 <= conveyor_id <= 5:
-        await websocket.close(code=1008, reason="Invalid conveyor ID. Must be between 1 and 5")
+    if conveyor_id not in registry:
+        await websocket.close(code=1008, reason=f"Invalid conveyor ID. Conveyor {conveyor_id} not found")
         return
-    await manager.connect(websocket)
-    try:
-        while True:
-            facility_data = get_all_facility_data()
-            conveyor_data = facility_data["conveyor_belts"].get(f"conveyor_{conveyor_id}")
-            response = {"timestamp": facility_data["timestamp"], "conveyor_id": conveyor_id, "data": conveyor_data}
-            await websocket.send_json(response)
-            await asyncio.sleep(5)
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+    await _serve_subscriber(websocket, _conveyor_topic(conveyor_id))
 
 @app.websocket("/ws/conveyor/{conveyor_id}/category/{category_name}")
 async def websocket_category_endpoint(websocket: WebSocket, conveyor_id: int, category_name: str):
-    valid_categories = ["overall_facility", "production_data", "equipment_performance", "quality_control", "equipment_details"]
-    if not 1 <= conveyor_id <= 5:
-        await websocket.close(code=1008, reason="Invalid conveyor ID. Must be between 1 and 5")
+    if conveyor_id not in registry:
+        await websocket.close(code=1008, reason=f"Invalid conveyor ID. Conveyor {conveyor_id} not found")
         return
-    if category_name not in valid_categories:
-        await websocket.close(code=1008, reason=f"Invalid category. Must be one of: {', '.join(valid_categories)}")
+    if category_name not in VALID_CATEGORIES:
+        await websocket.close(code=1008, reason=f"Invalid category. Must be one of: {', '.join(VALID_CATEGORIES)}")
         return
-    await manager.connect(websocket)
+    await _serve_subscriber(websocket, _category_topic(conveyor_id, category_name))
+
+@app.websocket("/ws/spc")
+async def websocket_spc_endpoint(websocket: WebSocket):
+    await _serve_subscriber(websocket, SPC_TOPIC)
+
+@app.websocket("/ws/spc/{conveyor_id}")
+async def websocket_spc_conveyor_endpoint(websocket: WebSocket, conveyor_id: int):
+    if conveyor_id not in registry:
+        await websocket.close(code=1008, reason=f"Invalid conveyor ID. Conveyor {conveyor_id} not found")
+        return
+    await _serve_subscriber(websocket, _spc_topic(conveyor_id))
+
+async def _handle_subscription_message(websocket: WebSocket, request: Any):
+    subscriptions = subscription_hub.clients.get(websocket)
+    if subscriptions is None:
+        return
+    if not isinstance(request, dict):
+        manager.send(websocket, Frame({"type": "error", "detail": "Messages must be JSON (or msgpack) objects"}))
+        return
+    kind, sub_id = request.get("type"), str(request.get("id", "default"))
+    if kind == "subscribe":
+        if sub_id not in subscriptions and len(subscriptions) >= MAX_SUBSCRIPTIONS_PER_CLIENT:
+            manager.send(websocket, Frame({"type": "error", "id": sub_id, "detail": f"At most {MAX_SUBSCRIPTIONS_PER_CLIENT} subscriptions per connection"}))
+            return
+        try:
+            sub = parse_subscription(request)
+        except ValueError as e:
+            manager.send(websocket, Frame({"type": "error", "id": sub_id, "detail": str(e)}))
+            return
+        subscriptions[sub_id] = sub
+        manager.send(websocket, Frame({"type": "subscribed", "id": sub_id, "conveyors": sub.conveyors,
+                                       "kpis": len(sub.kpis), "interval": sub.interval}))
+        # First update right away instead of on the next tick
+        for ws, key, frame in await subscription_hub.updates(clock.now(), websocket):
+            manager.send(ws, frame, key)
+    elif kind == "unsubscribe":
+        removed = list(subscriptions) if "id" not in request else [sub_id] if sub_id in subscriptions else []
+        for name in removed:
+            del subscriptions[name]
+        manager.send(websocket, Frame({"type": "unsubscribed", "ids": removed}))
+    else:
+        manager.send(websocket, Frame({"type": "error", "detail": "type must be 'subscribe' or 'unsubscribe'"}))
+
+@app.websocket("/ws/subscribe")
+async def websocket_subscribe_endpoint(websocket: WebSocket):
+    await manager.connect(websocket, None)
+    subscription_hub.add(websocket)
     try:
         while True:
-            snapshot = get_conveyor_snapshot(conveyor_id)
-            response = {"timestamp": datetime.now().isoformat(), "conveyor_id": conveyor_id, "category_name": category_name, "data": snapshot.get(category_name)}
-            await websocket.send_json(response)
-            await asyncio.sleep(5)
+            await _handle_subscription_message(websocket, await _receive_message(websocket))
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        subscription_hub.remove(websocket)
+        manager.disconnect(websocket, None)
 
 # ------------------------------------------------------------
 # Helper: get local IPs for convenience in __main__
@@ -613,10 +3939,10 @@ if __name__ == "__main__":
     print("\n" + "="*70)
     print(" 🏭 INDUSTRIAL FACILITY MONITORING API SERVER - OPTIMIZED ")
     print("="*70)
-    print(" Conveyor Belt Status:")
-    print("  • Conveyor belts 1-3: Normal operation")
-    print("  • Conveyor belt 4: Faulty operation (abnormal metrics)")
-    print("  • Conveyor belt 5: Non-operational (zero metrics)")
+    print(f" Conveyor Belt Status ({len(registry)} conveyors):")
+    for status in STATUSES:
+        count = sum(1 for c in registry.as_list() if c["status"] == status)
+        print(f"  • {status}: {count}")
     print("\n Server is starting up. Connect using one of these URLs:")
     print(f"  • Local:   http://localhost:{port}")
     
@@ -633,15 +3959,31 @@ if __name__ == "__main__":
         print(f"  • Conveyor equipment data:      http://{local_ips[0]}:{port}/conveyor/1/equipment")
         print(f"  • Conveyor quality data:        http://{local_ips[0]}:{port}/conveyor/1/quality")
         print(f"  • Conveyor equipment details:   http://{local_ips[0]}:{port}/conveyor/1/equipment-details")
+        print(f"  • Batch reads (one snapshot):   http://{local_ips[0]}:{port}/batch (POST with selectors)")
+        print(f"  • Delta stream (SSE):           http://{local_ips[0]}:{port}/events")
+        print(f"  • Conveyor fleet (admin):       http://{local_ips[0]}:{port}/conveyors")
+        print(f"  • KPI history (downsampled):    http://{local_ips[0]}:{port}/history/1/overall_facility/temperature?max_points=300")
+        print(f"  • KPI rollups (min/max/mean):   http://{local_ips[0]}:{port}/rollups/1/overall_facility/temperature")
+        print(f"  • SPC stats & rules:            http://{local_ips[0]}:{port}/spc/4")
         print("\n WebSocket connections:")
         print(f"  • All data:                     ws://{local_ips[0]}:{port}/ws")
+        print(f"  • All data (delta frames):      ws://{local_ips[0]}:{port}/ws?mode=delta")
         print(f"  • Specific conveyor data:       ws://{local_ips[0]}:{port}/ws/conveyor/1")
         print(f"  • Conveyor category data:       ws://{local_ips[0]}:{port}/ws/conveyor/1/category/production_data")
+        print(f"  • Filtered subscriptions:       ws://{local_ips[0]}:{port}/ws/subscribe")
+        print(f"  • SPC out-of-control events:    ws://{local_ips[0]}:{port}/ws/spc")
+        print(f"  • Binary frames:                any ws URL with subprotocol {' / '.join(WIRE_FORMATS)}")
     else:
         print("  • No network IPs detected. Check your network connection.")
     
     print(f"\n API documentation available at: http://localhost:{port}/docs")
     print("="*70 + "\n")
 
+    # More than one worker shares one simulation through shared memory (see SharedState)
+    workers = int(os.environ.get("SIMULATED_WORKERS", 1))
+    if workers > 1:
+        os.environ.setdefault("SIMULATED_SHARED_STATE", f"simulated-{port}")
+        print(f" Running {workers} workers on shared state {os.environ['SIMULATED_SHARED_STATE']!r}\n")
+
     # IMPORTANT: Module name must match this filename without .py
-    uvicorn.run("SimulatedAPI:app", host="0.0.0.0", port=port)
+    uvicorn.run("SimulatedAPI:app", host="0.0.0.0", port=port, workers=workers)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for SimulatedAPI.
+
+Microbenchmarks (batch engine per tick, snapshot builders, cached /data) run in-process.
+The load driver starts the app under uvicorn in a background thread, opens N websocket
+clients on /ws and the per-conveyor channels, hammers the REST routes from a few worker
+threads, and reports ticks/s, p50/p95/p99 frame latency, REST latency, CPU and RSS per
+client count.
+
+    python benchmark_simulation.py                      # everything, default sizes
+    python benchmark_simulation.py --micro              # microbenchmarks only
+    python benchmark_simulation.py --load --clients 1,50,200 --duration 10
+    python benchmark_simulation.py --json bench.json    # machine-readable results too
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import sys
+import threading
+from datetime import datetime
+from time import perf_counter, time
+
+import numpy as np
+
+import SimulatedAPI as api
+
+CONVEYOR_COUNTS = [5, 500, 50_000]
+REPEATS = 5
+DATA_REQUESTS = 300
+SNAPSHOT_CALLS = 2000
+RESULTS_FORMAT = 1
+
+LOAD_CLIENTS = [1, 10, 50]
+LOAD_DURATION = 5.0
+LOAD_WARMUP = 1.0
+LOAD_TICK_INTERVAL = 0.25  # broadcast interval during load runs (production default is 5s)
+LOAD_REST_WORKERS = 4
+LOAD_PORT = 8017
+REST_PATHS = ["/data", "/conveyor/1", "/conveyor/2/overall", "/conveyor/3/production", "/conveyor/4/quality"]
+
+def time_tick(func, repeats=REPEATS):
+    """Best-of-N wall time of func() in milliseconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = perf_counter()
+        func()
+        best = min(best, perf_counter() - start)
+    return best * 1000
+
+def make_fleet(count):
+    """Same mix as the default fleet: of every 5 conveyors, 3 operational, 1 faulty, 1 non-operational."""
+    pattern = ["operational", "operational", "operational", "faulty", "non-operational"]
+    return {cid: pattern[(cid - 1) % 5] for cid in range(1, count + 1)}
+
+def percentiles(samples):
+    """p50/p95/p99 of a list of seconds, in milliseconds (None when there are no samples)."""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+def rss_mb():
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# ------------------------------------------------------------
+# Microbenchmarks
+# ------------------------------------------------------------
+def bench_conveyors(count):
+    api.registry.replace(make_fleet(count))
+    conveyor_ids = api.registry.ids()
+    api.generate(api.KPI_SPECS, conveyor_ids)  # warm up state
+
+    def arrays_only():
+        # Worst case for the scheduler: every KPI group due on the same tick
+        api.generate(api.KPI_SPECS, conveyor_ids)
+
+    def with_dicts():
+        batch = api.read_batch(conveyor_ids)
+        for cid in batch.conveyor_ids:
+            batch.snapshot(cid)
+
+    repeats = REPEATS if count < 10_000 else 2
+    draw_ms = time_tick(arrays_only, repeats)
+    full_ms = time_tick(with_dicts, repeats)
+    return draw_ms, full_ms
+
+def bench_snapshots(calls=SNAPSHOT_CALLS):
+    """Microseconds per call of the snapshot builders behind /conveyor/{id} and /data."""
+    api.registry.replace(make_fleet(5))
+    api.generate(api.KPI_SPECS, api.registry.ids())
+    results = {}
+    for name, func in (("get_conveyor_snapshot", lambda: api.get_conveyor_snapshot(1)),
+                       ("get_all_facility_data", api.get_all_facility_data)):
+        func()
+        start = perf_counter()
+        for _ in range(calls):
+            func()
+        results[name] = (perf_counter() - start) * 1e6 / calls
+    return results
+
+def requests_per_second(client, path, count=DATA_REQUESTS):
+    client.get(path)  # warm up / fill the cache
+    start = perf_counter()
+    for _ in range(count):
+        client.get(path)
+    return count / (perf_counter() - start)
+
+def bench_data_route():
+    """/data with no cache (current engine, dict encoded by FastAPI on every request) vs the cached bytes."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    api.registry.replace(make_fleet(5))
+    # A throwaway app, so the real one gains no extra route
+    uncached = FastAPI()
+    uncached.get("/data")(lambda: api.get_all_facility_data())
+    return requests_per_second(TestClient(uncached), "/data"), requests_per_second(TestClient(api.app), "/data")
+
+def run_micro():
+    print("="*60)
+    print("SimulatedAPI Batch Engine Benchmark")
+    print("="*60)
+    print(f"{'conveyors':>10} {'generate ms':>16} {'read+dicts ms':>16} {'us/conveyor':>12}")
+    engine = []
+    for count in CONVEYOR_COUNTS:
+        draw_ms, full_ms = bench_conveyors(count)
+        engine.append({"conveyors": count, "generate_ms": round(draw_ms, 3), "read_dicts_ms": round(full_ms, 3)})
+        print(f"{count:>10} {draw_ms:>16.2f} {full_ms:>16.2f} {full_ms * 1000 / count:>12.2f}")
+    print("-"*60)
+    snapshots = bench_snapshots()
+    for name, us in snapshots.items():
+        print(f" {name:<28} {us:>10.1f} us/call")
+    uncached, cached = bench_data_route()
+    print(f" /data req/s   no cache: {uncached:>8.0f}   cache: {cached:>8.0f}   ({cached / uncached:.1f}x)")
+    print("="*60)
+    return {
+        "engine": engine,
+        "snapshot_us": {name: round(us, 2) for name, us in snapshots.items()},
+        "data_route_rps": {"uncached": round(uncached, 1), "cached": round(cached, 1)},
+    }
+
+# ------------------------------------------------------------
+# Load driver
+# ------------------------------------------------------------
+class ServerThread:
+    """The app under uvicorn on a background thread, so clients and server share one process."""
+
+    def __init__(self, port):
+        import uvicorn
+
+        config = uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("uvicorn failed to start")
+            threading.Event().wait(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+def client_paths(count, conveyor_ids):
+    """Half the clients on the facility stream, the rest spread over the per-conveyor channels."""
+    paths = []
+    for i in range(count):
+        if i % 2 == 0 or not conveyor_ids:
+            paths.append("/ws")
+        else:
+            paths.append(f"/ws/conveyor/{conveyor_ids[(i // 2) % len(conveyor_ids)]}")
+    return paths
+
+async def ws_client(url, measuring, latencies, frames):
+    import websockets
+
+    async with websockets.connect(url, max_size=None) as ws:
+        while True:
+            message = await ws.recv()
+            received = time()
+            if not measuring.is_set():
+                continue
+            frame = json.loads(message)
+            stamp = frame.get("timestamp")
+            if stamp:
+                latencies.append(received - datetime.fromisoformat(stamp).timestamp())
+            frames[0] += 1
+
+def rest_worker(base, stop, measuring, latencies, counter):
+    import requests
+
+    session = requests.Session()
+    i = 0
+    while not stop.is_set():
+        path = REST_PATHS[i % len(REST_PATHS)]
+        i += 1
+        start = perf_counter()
+        try:
+            session.get(base + path, timeout=10).content
+        except requests.RequestException:
+            continue
+        if measuring.is_set():
+            latencies.append(perf_counter() - start)
+            counter[0] += 1
+
+async def drive(port, clients, duration, rest_workers):
+    """One load step: connect, warm up, measure for `duration` seconds, disconnect."""
+    ticks = [0]
+    tick_durations = []
+    publish_tick = api.publish_tick
+
+    async def counted_tick():
+        start = perf_counter()
+        await publish_tick()
+        if measuring.is_set():
+            ticks[0] += 1
+            tick_durations.append(perf_counter() - start)
+
+    measuring, stop = asyncio.Event(), threading.Event()
+    thread_measuring = threading.Event()
+    frame_latencies, rest_latencies = [], []
+    frames, rest_count = [0], [0]
+    api.publish_tick = counted_tick
+    tasks = [asyncio.create_task(ws_client(f"ws://127.0.0.1:{port}{path}", measuring, frame_latencies, frames))
+             for path in client_paths(clients, api.registry.ids())]
+    workers = [threading.Thread(target=rest_worker, args=(f"http://127.0.0.1:{port}", stop, thread_measuring, rest_latencies, rest_count))
+               for _ in range(rest_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        await asyncio.sleep(LOAD_WARMUP)
+        failed = [t for t in tasks if t.done() and t.exception() is not None]
+        cpu_start, wall_start = cpu_seconds(), perf_counter()
+        measuring.set()
+        thread_measuring.set()
+        await asyncio.sleep(duration)
+        measuring.clear()
+        thread_measuring.clear()
+        wall = perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_start
+    finally:
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for worker in workers:
+            worker.join()
+        api.publish_tick = publish_tick
+    return {
+        "clients": clients,
+        "failed_clients": len(failed),
+        "duration_s": round(wall, 3),
+        "ticks_per_s": round(ticks[0] / wall, 2),
+        "tick_build_ms": percentiles(tick_durations),
+        "frames_per_s": round(frames[0] / wall, 1),
+        "frame_latency_ms": percentiles(frame_latencies),
+        "rest_requests_per_s": round(rest_count[0] / wall, 1),
+        "rest_latency_ms": percentiles(rest_latencies),
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "rss_mb": round(rss_mb(), 1),
+    }
+
+def run_load(client_counts, duration, tick_interval, rest_workers, port):
+    # Keep load runs self-contained: five conveyors, fast ticks, no checkpoint file
+    api.registry.replace(make_fleet(5))
+    api.CHECKPOINT_PATH = ""
+    api.BROADCAST_INTERVAL_SECONDS = tick_interval
+    print("="*96)
+    print(f"SimulatedAPI Load Test  (tick every {tick_interval}s, {rest_workers} REST workers, {duration:.0f}s per step)")
+    print("="*96)
+    print(f"{'clients':>8} {'ticks/s':>8} {'frames/s':>9} {'frame p50/p95/p99 ms':>24} {'REST req/s':>11} {'REST p95 ms':>12} {'CPU %':>7} {'RSS MB':>8}")
+    steps = []
+    with ServerThread(port):
+        for clients in client_counts:
+            step = asyncio.run(drive(port, clients, duration, rest_workers))
+            steps.append(step)
+            lat = step["frame_latency_ms"]
+            lat_text = "/".join("-" if lat[p] is None else f"{lat[p]:.1f}" for p in ("p50", "p95", "p99"))
+            rest_p95 = step["rest_latency_ms"]["p95"]
+            print(f"{clients:>8} {step['ticks_per_s']:>8.2f} {step['frames_per_s']:>9.1f} {lat_text:>24} "
+                  f"{step['rest_requests_per_s']:>11.1f} {'-' if rest_p95 is None else f'{rest_p95:.1f}':>12} "
+                  f"{step['cpu_percent']:>7.1f} {step['rss_mb']:>8.1f}")
+    print("="*96)
+    print(" CPU % and RSS cover the whole process: server, websocket clients and REST workers.")
+    return {"tick_interval_s": tick_interval, "rest_workers": rest_workers, "steps": steps}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--micro", action="store_true", help="run the microbenchmarks only")
+    parser.add_argument("--load", action="store_true", help="run the load driver only")
+    parser.add_argument("--clients", default=",".join(map(str, LOAD_CLIENTS)), help="comma-separated websocket client counts")
+    parser.add_argument("--duration", type=float, default=LOAD_DURATION, help="measured seconds per client count")
+    parser.add_argument("--tick-interval", type=float, default=LOAD_TICK_INTERVAL, help="broadcast interval during load runs")
+    parser.add_argument("--rest-workers", type=int, default=LOAD_REST_WORKERS, help="threads issuing REST requests")
+    parser.add_argument("--port", type=int, default=LOAD_PORT)
+    parser.add_argument("--json", metavar="PATH", help="also write results as JSON ('-' for stdout)")
+    args = parser.parse_args()
+    run_all = not (args.micro or args.load)
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    if args.micro or run_all:
+        results["micro"] = run_micro()
+    if args.load or run_all:
+        counts = [int(c) for c in args.clients.split(",") if c]
+        results["load"] = run_load(counts, args.duration, args.tick_interval, args.rest_workers, args.port)
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Regression checks for SimulatedAPI that run in-process (no server needed)."""
+
+import asyncio
+import gzip
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import SimulatedAPI as api
+
+client = TestClient(api.app)
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_path(tmp_path, monkeypatch):
+    # Checkpoints default to the working directory; keep every test's out of the repo
+    path = tmp_path / "checkpoint.npz"
+    monkeypatch.setattr(api, "CHECKPOINT_PATH", str(path))
+    return path
+
+
+def test_added_conveyor_is_served_after_one_scheduler_pass():
+    # A new slot must hold every KPI, not only the cadence groups that happened to be due
+    assert client.put("/conveyors/42", json={"status": "operational"}).status_code == 200
+    api.scheduler.schedule(0, api.clock.now())
+    api.scheduler.run_due(api.clock.now())
+    response = client.get("/conveyor/42")
+    assert response.status_code == 200
+    assert response.json()["conveyor_id"] == 42
+    assert client.get("/data").status_code == 200
+    client.delete("/conveyors/42")
+
+
+def test_subscription_rejects_non_list_filters():
+    for request in ({"categories": "overall_facility"}, {"fields": "overall_facility.temperature"},
+                    {"categories": [1]}, {"fields": [{"x": 1}]}):
+        with pytest.raises(ValueError, match="must be a list"):
+            api.parse_subscription(request)
+    with pytest.raises(ValueError, match="must be a list"):
+        api.parse_subscription({"conveyors": [True]})
+    for interval in ("nan", "inf", float("-inf")):
+        with pytest.raises(ValueError, match="interval must be a number"):
+            api.parse_subscription({"interval": interval})
+
+
+def test_steady_state_tick_is_a_delta_smaller_than_the_keyframe():
+    encoder = api.DeltaEncoder()
+    keyframe = encoder.encode(api.get_all_facility_data())
+    assert keyframe.payload["type"] == "keyframe"
+    # One tick of the fastest cadence groups moves only a few leaves
+    fastest = min(api._group_interval(g) for g in range(len(api.KPI_GROUPS)))
+    due = [k for k in api.KPI_SPECS if api._group_interval(k.group) == fastest]
+    api.generate(due, api.registry.ids())
+    delta = encoder.encode(api.get_all_facility_data())
+    assert delta.payload["type"] == "delta"
+    assert len(delta.encoded("json")) < len(keyframe.encoded("json"))
+
+
+def test_conditional_get_returns_304_until_a_tick():
+    etag = client.get("/data").headers["etag"]
+    assert etag.startswith('W/"')
+    response = client.get("/data", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    api.generate(api.KPI_SPECS, api.registry.ids())
+    response = client.get("/data", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.parametrize("coding", api.CONTENT_CODINGS)
+def test_data_is_compressed_for_accepted_coding(coding):
+    expected = client.get("/data", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in expected.headers
+    with client.stream("GET", "/data", headers={"Accept-Encoding": coding}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == coding
+    body = api.brotli.decompress(raw) if coding == "br" else gzip.decompress(raw)
+    assert json.loads(body) == expected.json()
+
+
+def test_spc_flags_an_injected_shift():
+    spc, kpi, conveyor_id = api.SpcStore(), api.SPC_KPIS[0], 900
+    rng = np.random.default_rng(7)
+    for t, x in enumerate(rng.normal(50.0, 1.0, 40)):
+        spc.record([kpi], [conveyor_id], np.array([[x]]), float(t))
+    assert not spc.report(conveyor_id, [kpi])[kpi.category][".".join(kpi.path)]["rules"]
+    spc.record([kpi], [conveyor_id], np.array([[56.0]]), 40.0)
+    entry = spc.report(conveyor_id, [kpi])[kpi.category][".".join(kpi.path)]
+    assert "we1" in entry["rules"]
+    assert any(e["conveyor_id"] == conveyor_id and "we1" in e["rules"] for e in spc.drain())
+
+
+def test_replay_reproduces_recorded_values(tmp_path, monkeypatch):
+    ids = api.registry.ids()
+    api.generate(api.KPI_SPECS, ids)
+    path = str(tmp_path / "ticks.log")
+    recorder = api.TickRecorder(path)  # opens with a keyframe of the current values
+    monkeypatch.setattr(api, "recorder", recorder)
+    now = api.clock.now()
+    for step in range(1, 4):
+        api.generate([k for k in api.KPI_SPECS if k.group == step], ids, now + step)
+    recorder.close()
+    monkeypatch.setattr(api, "recorder", None)
+    slots = api.STATE.slots(ids)
+    recorded = api.STATE.values[:, slots].copy()
+    api.generate(api.KPI_SPECS, ids)  # move away from the recorded state
+    log = api.start_replay(path)
+    for i in range(log.position, len(log)):
+        api._apply_replay_block(log, i)
+    np.testing.assert_allclose(api.STATE.values[:, api.STATE.slots(ids)], recorded, rtol=1e-6)
+
+
+@pytest.fixture
+def default_fleet():
+    yield
+    api.registry.replace(dict(api.DEFAULT_CONVEYORS))
+    api.generate(api.KPI_SPECS, api.registry.ids())
+
+
+def test_checkpoint_round_trip(default_fleet):
+    assert client.put("/conveyors/77", json={"status": "faulty"}).status_code == 200
+    api.generate(api.KPI_SPECS, api.registry.ids())
+    asyncio.run(api.save_checkpoint(force=True))
+    ids, version, fleet = api.registry.ids(), api.STATE.version, api.registry.as_list()
+    saved = api.STATE.values[:, api.STATE.slots(ids)].copy()
+    client.delete("/conveyors/77")
+    api.generate(api.KPI_SPECS, api.registry.ids())
+    assert api.restore_checkpoint()
+    assert api.registry.as_list() == fleet
+    assert api.STATE.version == version
+    np.testing.assert_array_equal(api.STATE.values[:, api.STATE.slots(ids)], saved)
+
+
+def test_edited_fleet_file_wins_over_checkpoint(tmp_path, monkeypatch, default_fleet):
+    fleet_file = tmp_path / "conveyors.json"
+    monkeypatch.setenv("SIMULATED_CONVEYORS_FILE", str(fleet_file))
+
+    def start_with(conveyors):
+        # What a restart with this file does before restoring the checkpoint
+        fleet_file.write_text(json.dumps({"conveyors": conveyors}))
+        fleet = api._load_conveyors()
+        monkeypatch.setattr(api, "FLEET_FILE_DIGEST", api._fleet_digest(fleet))
+        api.registry.replace(fleet)
+
+    start_with([{"id": 1}, {"id": 2}, {"id": 3}])
+    api.generate(api.KPI_SPECS, api.registry.ids())
+    asyncio.run(api.save_checkpoint(force=True))
+    start_with([{"id": 1}, {"id": 2, "status": "faulty"}, {"id": 7}])
+    assert api.restore_checkpoint()
+    assert api.registry.as_list() == [{"id": 1, "status": "operational"}, {"id": 2, "status": "faulty"},
+                                      {"id": 7, "status": "operational"}]
+    # Conveyor 2 was re-statused by the file: its saved values are dropped, not resumed
+    assert api.STATE.missing([1, 2, 3]) == [2, 3]